@@ -1,69 +1,48 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Tuple
 from datetime import datetime
 import os
+import json
+import asyncio
 
 from db.redis_client import RedisClient
 from db.postgres_client import PostgresClient
+from db.models import is_valid_uuid
 from memory.short_term import ShortTermMemory
 from memory.long_term import LongTermMemory
-from memory.vector_store import VectorStore
-from llm.base import BaseLLM
-from llm.openai_api import OpenAIClient
-from llm.anthropic_api import AnthropicClient
-from llm.deepseek_api import DeepSeekClient
-from llm.openrouter_api import OpenRouterClient
+from llm.base import is_error_response
+from api.clients import (
+    get_redis,
+    get_postgres,
+    get_short_term_memory,
+    get_long_term_memory,
+    get_llm_for_model
+)
 
 # 创建路由器
 router = APIRouter()
 
-# 创建客户端实例
-redis_client = RedisClient()
-postgres_client = PostgresClient()
-vector_store = VectorStore()
+# 对话总结的防抖配置
+SUMMARY_MIN_NEW_MESSAGES = int(os.getenv("SUMMARY_MIN_NEW_MESSAGES", "6"))  # 触发总结所需的最少新消息数
+SUMMARY_DEBOUNCE_SECONDS = int(os.getenv("SUMMARY_DEBOUNCE_SECONDS", "300"))  # 两次总结之间的最短间隔（秒）
 
-# 创建LLM客户端
-try:
-    openai_client = OpenAIClient()
-except Exception as e:
-    print(f"OpenAI客户端初始化失败: {e}")
-    openai_client = None
+# 发送给LLM的最大token数
+MAX_TOKEN_LIMIT = int(os.getenv("MAX_TOKEN_LIMIT", "4000"))
 
-try:
-    anthropic_client = AnthropicClient()
-except Exception as e:
-    print(f"Anthropic客户端初始化失败: {e}")
-    anthropic_client = None
+# 对话总结的队列配置：启用后由独立的worker进程（worker.py）消费Redis Stream执行总结
+SUMMARY_WORKER_ENABLED = os.getenv("SUMMARY_WORKER_ENABLED", "false").lower() == "true"
+SUMMARY_STREAM = os.getenv("SUMMARY_STREAM", "summarize_stream")
+SUMMARY_STREAM_MAXLEN = int(os.getenv("SUMMARY_STREAM_MAXLEN", "10000"))
 
-try:
-    deepseek_client = DeepSeekClient()
-except Exception as e:
-    print(f"DeepSeek客户端初始化失败: {e}")
-    deepseek_client = None
+# LLM回复的语义缓存配置（需要Redis加载RediSearch模块）：相似的问题直接返回缓存的回复
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))  # 命中所需的最小余弦相似度
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "300"))  # 缓存回复的有效期（秒）
 
-try:
-    openrouter_client = OpenRouterClient()
-except Exception as e:
-    print(f"OpenRouter客户端初始化失败: {e}")
-    openrouter_client = None
-
-# 选择默认LLM客户端
-default_llm_client = None
-if deepseek_client:
-    default_llm_client = deepseek_client
-elif openrouter_client:
-    default_llm_client = openrouter_client
-elif openai_client:
-    default_llm_client = openai_client
-elif anthropic_client:
-    default_llm_client = anthropic_client
-else:
-    raise ValueError("没有可用的LLM客户端")
-
-# 创建记忆管理器
-short_term_memory = ShortTermMemory(redis_client, postgres_client)
-long_term_memory = LongTermMemory(postgres_client, redis_client, vector_store, default_llm_client)
+# 流式回复被中断时保存部分回复的任务，保留引用以免任务在完成前被回收
+_pending_saves: set = set()
 
 # 模型
 class Message(BaseModel):
@@ -84,44 +63,55 @@ class ChatResponse(BaseModel):
     memories_used: Optional[List[Dict[str, Any]]] = Field(None, description="使用的记忆")
     created_at: str = Field(..., description="创建时间")
 
-@router.post("/", response_model=ChatResponse)
-async def chat(
+async def prepare_chat_turn(
     request: ChatRequest,
-    background_tasks: BackgroundTasks
-):
+    postgres_client: PostgresClient,
+    short_term_memory: ShortTermMemory,
+    long_term_memory: LongTermMemory
+) -> Tuple[Any, List[Dict[str, str]], List[Dict[str, str]], List[Dict[str, Any]]]:
     """
-    聊天API
+    准备一轮对话：获取或创建对话，选择上下文并加入相关记忆
+    
+    Returns:
+        (对话对象, 发送给LLM的消息列表, 本轮需要保存的新消息, 使用的记忆)
     """
-    # 获取LLM客户端
-    llm_client = None
-    model_name = request.model.lower()
-    
-    if "deepseek" in model_name and deepseek_client:
-        llm_client = deepseek_client
-    elif "openrouter" in model_name or "/" in model_name:
-        # OpenRouter模型通常包含"/"，如"openai/gpt-4"
-        if openrouter_client:
-            llm_client = openrouter_client
-    elif "gpt" in model_name or "openai" in model_name:
-        if openai_client:
-            llm_client = openai_client
-    elif "claude" in model_name or "anthropic" in model_name:
-        if anthropic_client:
-            llm_client = anthropic_client
-    
-    # 如果没有找到匹配的客户端，使用默认客户端
-    if not llm_client:
-        llm_client = default_llm_client
-    
-    # 获取或创建对话
+    # ID列是UUID类型，非法的ID直接视为不存在，避免查询时的类型转换错误
+    if not is_valid_uuid(request.user_id):
+        raise HTTPException(status_code=404, detail="用户不存在")
+    if request.conversation_id and not is_valid_uuid(request.conversation_id):
+        raise HTTPException(status_code=404, detail="对话不存在")
+    
+    # 相关记忆只依赖用户和本轮消息，可以与对话的读取并发执行
+    async def get_relevant_memories() -> List[Dict[str, Any]]:
+        if not request.use_memory:
+            return []
+        return await long_term_memory.get_relevant_memories(
+            user_id=request.user_id,
+            context=request.message
+        )
+    
+    # 获取或创建对话，同时并发获取对话历史和相关记忆
     conversation_id = request.conversation_id
     if not conversation_id:
-        # 创建新对话
-        conversation = await postgres_client.create_conversation(request.user_id)
-        conversation_id = conversation.id
+        # 创建新对话，新对话没有历史消息
+        conversation, memories = await asyncio.gather(
+            postgres_client.create_conversation(request.user_id),
+            get_relevant_memories()
+        )
+        messages = []
     else:
+        conversation, messages, memories = await asyncio.gather(
+            postgres_client.get_conversation_by_id(conversation_id),
+            short_term_memory.select_context(
+                conversation_id=conversation_id,
+                query=request.message,
+                max_tokens=MAX_TOKEN_LIMIT // 2,  # 预留一半token给回复和记忆
+                model=request.model
+            ),
+            get_relevant_memories()
+        )
+        
         # 验证对话是否存在
-        conversation = await postgres_client.get_conversation_by_id(conversation_id)
         if not conversation:
             raise HTTPException(status_code=404, detail="对话不存在")
         
@@ -129,13 +119,8 @@ async def chat(
         if conversation.user_id != request.user_id:
             raise HTTPException(status_code=403, detail="无权访问该对话")
     
-    # 获取对话历史
-    max_token_limit = int(os.getenv("MAX_TOKEN_LIMIT", "4000"))
-    messages = await short_term_memory.get_messages_with_token_limit(
-        conversation_id=conversation_id,
-        max_tokens=max_token_limit // 2,  # 预留一半token给回复和记忆
-        model=request.model
-    )
+    # 本轮需要保存的新消息，统一批量写入
+    new_messages = []
     
     # 添加系统消息
     if request.system_message and not any(msg["role"] == "system" for msg in messages):
@@ -144,12 +129,7 @@ async def chat(
             "content": request.system_message
         }
         messages.insert(0, system_message)
-        await short_term_memory.add_message(
-            conversation_id=conversation_id,
-            role="system",
-            content=request.system_message,
-            model=request.model
-        )
+        new_messages.append(system_message)
     
     # 添加用户消息
     user_message = {
@@ -157,77 +137,296 @@ async def chat(
         "content": request.message
     }
     messages.append(user_message)
-    await short_term_memory.add_message(
-        conversation_id=conversation_id,
-        role="user",
-        content=request.message,
-        model=request.model
-    )
+    new_messages.append(user_message)
     
-    # 获取相关记忆
+    # 格式化相关记忆
     memories_used = []
-    if request.use_memory:
-        memories = await long_term_memory.get_relevant_memories(
-            user_id=request.user_id,
-            context=request.message
+    if memories:
+        # 格式化记忆为上下文
+        memory_context = await long_term_memory.format_memories_for_context(
+            memories=memories,
+            max_tokens=MAX_TOKEN_LIMIT // 4  # 使用1/4的token限制给记忆
         )
         
-        if memories:
-            # 格式化记忆为上下文
-            memory_context = await long_term_memory.format_memories_for_context(
-                memories=memories,
-                max_tokens=max_token_limit // 4  # 使用1/4的token限制给记忆
-            )
-            
-            # 添加记忆上下文
-            if memory_context:
-                memory_message = {
-                    "role": "system",
-                    "content": memory_context
-                }
-                messages.append(memory_message)
-                memories_used = memories
-    
-    # 生成回复
-    response = await llm_client.generate_chat_response(
-        messages=messages,
-        max_tokens=max_token_limit // 2,  # 使用1/2的token限制给回复
-        temperature=0.7
+        # 添加记忆上下文
+        if memory_context:
+            memory_message = {
+                "role": "system",
+                "content": memory_context
+            }
+            messages.append(memory_message)
+            memories_used = memories
+    
+    return conversation, messages, new_messages, memories_used
+
+async def get_cached_response(
+    request: ChatRequest,
+    redis_client: RedisClient,
+    long_term_memory: LongTermMemory
+) -> Tuple[Optional[List[float]], Optional[str]]:
+    """
+    从语义缓存中查找相似问题的回复
+    
+    Returns:
+        (用户消息的嵌入向量, 缓存的回复)，未启用语义缓存时都为None，未命中时回复为None
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return None, None
+    
+    try:
+        # 检索记忆时已经计算过同一条消息的向量，这里通常直接命中向量缓存
+        embedding = await long_term_memory.embedding_cache.embed_query_with_cache(request.message)
+    except Exception as e:
+        print(f"计算语义缓存向量失败: {e}")
+        return None, None
+    
+    cached_response = await redis_client.get_semantic_response(
+        embedding,
+        user_id=request.user_id,
+        model=request.model,
+        threshold=SEMANTIC_CACHE_THRESHOLD
     )
+    return embedding, cached_response
+
+async def save_user_turn(
+    request: ChatRequest,
+    short_term_memory: ShortTermMemory,
+    conversation: Any,
+    new_messages: List[Dict[str, str]]
+):
+    """
+    在生成回复前保存本轮的用户消息（以及新加入的系统消息）
     
-    # 添加助手消息
-    assistant_message = {
-        "role": "assistant",
-        "content": response
-    }
-    await short_term_memory.add_message(
-        conversation_id=conversation_id,
-        role="assistant",
-        content=response,
+    即使生成失败或客户端中途断开，用户消息也不会丢失，紧接着的下一轮对话也能读到它
+    """
+    await short_term_memory.add_messages(
+        conversation_id=conversation.id,
+        messages=new_messages,
         model=request.model
     )
+
+def save_partial_reply(
+    request: ChatRequest,
+    short_term_memory: ShortTermMemory,
+    conversation: Any,
+    response: str
+):
+    """
+    流式回复被中断时保存已经生成的部分回复
     
-    # 在后台任务中总结对话
-    background_tasks.add_task(
-        summarize_conversation,
-        conversation_id=conversation_id,
-        user_id=request.user_id,
-        messages=messages + [assistant_message]
+    客户端断开时StreamingResponse不会执行后台任务，因此单独创建任务保存，不受请求取消的影响
+    """
+    if not response:
+        return
+    
+    task = asyncio.create_task(short_term_memory.add_messages(
+        conversation_id=conversation.id,
+        messages=[{"role": "assistant", "content": response}],
+        model=request.model
+    ))
+    _pending_saves.add(task)
+    task.add_done_callback(_pending_saves.discard)
+
+async def finish_chat_turn(
+    request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    redis_client: RedisClient,
+    short_term_memory: ShortTermMemory,
+    conversation: Any,
+    response: str,
+    cache_embedding: Optional[List[float]] = None
+):
+    """
+    结束一轮对话：在后台保存助手回复、写入语义缓存并按需总结对话
+    
+    用户消息已经由save_user_turn保存；回复是错误提示时既不保存也不写入缓存。
+    如果提供了cache_embedding，还会将回复写入语义缓存
+    """
+    if response and not is_error_response(response):
+        if cache_embedding is not None:
+            background_tasks.add_task(
+                redis_client.put_semantic_response,
+                cache_embedding,
+                user_id=request.user_id,
+                model=request.model,
+                response=response,
+                expiry=SEMANTIC_CACHE_TTL
+            )
+        
+        # 在后台任务中保存助手回复（后台任务按添加顺序执行，保存完成后才会总结对话）
+        background_tasks.add_task(
+            short_term_memory.add_messages,
+            conversation_id=conversation.id,
+            messages=[{"role": "assistant", "content": response}],
+            model=request.model
+        )
+    
+    # 在后台任务中总结对话，同一对话在防抖时间内只会排队一次
+    if await redis_client.acquire_lock(f"sumlock:{conversation.id}", SUMMARY_DEBOUNCE_SECONDS):
+        background_tasks.add_task(
+            queue_summary,
+            conversation_id=conversation.id,
+            user_id=request.user_id,
+            existing_summary=conversation.summary,
+            summarized_message_count=conversation.summarized_message_count or 0
+        )
+
+@router.post("/", response_model=ChatResponse)
+async def chat(
+    request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    redis_client: RedisClient = Depends(get_redis),
+    postgres_client: PostgresClient = Depends(get_postgres),
+    short_term_memory: ShortTermMemory = Depends(get_short_term_memory),
+    long_term_memory: LongTermMemory = Depends(get_long_term_memory)
+):
+    """
+    聊天API
+    """
+    # 获取LLM客户端
+    llm_client = get_llm_for_model(request.model)
+    
+    conversation, messages, new_messages, memories_used = await prepare_chat_turn(
+        request, postgres_client, short_term_memory, long_term_memory
+    )
+    
+    # 生成回复前先保存用户消息，同时查找语义缓存
+    _, (embedding, response) = await asyncio.gather(
+        save_user_turn(request, short_term_memory, conversation, new_messages),
+        get_cached_response(request, redis_client, long_term_memory)
+    )
+    if response is None:
+        response = await llm_client.generate_chat_response(
+            messages=messages,
+            max_tokens=MAX_TOKEN_LIMIT // 2,  # 使用1/2的token限制给回复
+            temperature=0.7
+        )
+    else:
+        embedding = None  # 命中缓存时无需再次写入
+    
+    await finish_chat_turn(
+        request, background_tasks, redis_client, short_term_memory,
+        conversation, response, cache_embedding=embedding
     )
     
     # 返回响应
     return ChatResponse(
-        conversation_id=conversation_id,
+        conversation_id=conversation.id,
         response=response,
         memories_used=memories_used,
         created_at=datetime.utcnow().isoformat()
     )
 
-@router.get("/conversations", response_model=List[Dict[str, Any]])
-async def get_conversations(user_id: str):
+def format_sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """
+    将数据格式化为一条Server-Sent Events消息
+    
+    Args:
+        data: 消息数据
+        event: 事件类型，如果为None则使用默认的message事件
+    
+    Returns:
+        SSE格式的字符串
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+@router.post("/stream")
+async def chat_stream(
+    request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    redis_client: RedisClient = Depends(get_redis),
+    postgres_client: PostgresClient = Depends(get_postgres),
+    short_term_memory: ShortTermMemory = Depends(get_short_term_memory),
+    long_term_memory: LongTermMemory = Depends(get_long_term_memory)
+):
+    """
+    流式聊天API，以Server-Sent Events的形式逐段返回回复
+    
+    事件依次为：start（对话ID和使用的记忆）、多条回复片段、done（完整回复）
+    """
+    # 获取LLM客户端
+    llm_client = get_llm_for_model(request.model)
+    
+    conversation, messages, new_messages, memories_used = await prepare_chat_turn(
+        request, postgres_client, short_term_memory, long_term_memory
+    )
+    
+    # 生成回复前先保存用户消息，同时查找语义缓存（相似的问题直接使用缓存的回复）
+    _, (embedding, cached_response) = await asyncio.gather(
+        save_user_turn(request, short_term_memory, conversation, new_messages),
+        get_cached_response(request, redis_client, long_term_memory)
+    )
+    
+    async def event_stream():
+        yield format_sse(
+            {"conversation_id": conversation.id, "memories_used": memories_used},
+            event="start"
+        )
+        
+        if cached_response is not None:
+            # 命中缓存时一次性返回，且无需再次写入缓存
+            response = cached_response
+            cache_embedding = None
+            yield format_sse({"content": response})
+        else:
+            chunks = []
+            # 需要保存的回复片段，不包含客户端返回的错误提示
+            reply_chunks = []
+            completed = False
+            try:
+                async for chunk in llm_client.generate_chat_response_stream(
+                    messages=messages,
+                    max_tokens=MAX_TOKEN_LIMIT // 2,  # 使用1/2的token限制给回复
+                    temperature=0.7
+                ):
+                    chunks.append(chunk)
+                    if not is_error_response(chunk):
+                        reply_chunks.append(chunk)
+                    yield format_sse({"content": chunk})
+                completed = True
+            finally:
+                if not completed:
+                    # 客户端断开或生成中断，保存已经生成的部分回复
+                    save_partial_reply(request, short_term_memory, conversation, "".join(reply_chunks))
+            response = "".join(reply_chunks)
+            # 生成过程中出错时回复不完整，不写入语义缓存
+            cache_embedding = embedding if len(reply_chunks) == len(chunks) else None
+        
+        # 回复完成后才保存助手回复，后台任务会在流结束后执行
+        await finish_chat_turn(
+            request, background_tasks, redis_client, short_term_memory,
+            conversation, response, cache_embedding=cache_embedding
+        )
+        
+        yield format_sse(
+            {
+                "conversation_id": conversation.id,
+                "response": "".join(chunks),
+                "created_at": datetime.utcnow().isoformat()
+            },
+            event="done"
+        )
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        background=background_tasks
+    )
+
+@router.get("/conversations", response_model=None)  # 直接返回字典，跳过响应的重复校验
+async def get_conversations(
+    user_id: str,
+    postgres_client: PostgresClient = Depends(get_postgres)
+):
     """
     获取用户的所有对话
     """
+    if not is_valid_uuid(user_id):
+        return []
+    
     conversations = await postgres_client.get_user_conversations(user_id)
     
     return [
@@ -241,13 +440,19 @@ async def get_conversations(user_id: str):
         for conv in conversations
     ]
 
-@router.get("/conversations/{conversation_id}/messages", response_model=List[Dict[str, Any]])
-async def get_conversation_messages(conversation_id: str, user_id: str):
+@router.get("/conversations/{conversation_id}/messages", response_model=None)  # 直接返回字典，跳过响应的重复校验
+async def get_conversation_messages(
+    conversation_id: str,
+    user_id: str,
+    postgres_client: PostgresClient = Depends(get_postgres)
+):
     """
     获取对话的所有消息
     """
-    # 验证对话是否存在
-    conversation = await postgres_client.get_conversation_by_id(conversation_id)
+    # 验证对话是否存在，同时加载对话的消息
+    if not is_valid_uuid(conversation_id):
+        raise HTTPException(status_code=404, detail="对话不存在")
+    conversation = await postgres_client.get_conversation_by_id(conversation_id, with_messages=True)
     if not conversation:
         raise HTTPException(status_code=404, detail="对话不存在")
     
@@ -256,7 +461,7 @@ async def get_conversation_messages(conversation_id: str, user_id: str):
         raise HTTPException(status_code=403, detail="无权访问该对话")
     
     # 获取消息
-    db_messages = await postgres_client.get_conversation_messages(conversation_id)
+    db_messages = conversation.messages
     
     return [
         {
@@ -270,11 +475,18 @@ async def get_conversation_messages(conversation_id: str, user_id: str):
     ]
 
 @router.delete("/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: str, user_id: str):
+async def delete_conversation(
+    conversation_id: str,
+    user_id: str,
+    postgres_client: PostgresClient = Depends(get_postgres),
+    short_term_memory: ShortTermMemory = Depends(get_short_term_memory)
+):
     """
     删除对话
     """
     # 验证对话是否存在
+    if not is_valid_uuid(conversation_id):
+        raise HTTPException(status_code=404, detail="对话不存在")
     conversation = await postgres_client.get_conversation_by_id(conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="对话不存在")
@@ -290,18 +502,80 @@ async def delete_conversation(conversation_id: str, user_id: str):
     
     return {"status": "success"}
 
-async def summarize_conversation(conversation_id: str, user_id: str, messages: List[Dict[str, str]]):
+async def queue_summary(
+    conversation_id: str,
+    user_id: str,
+    existing_summary: Optional[Dict[str, Any]] = None,
+    summarized_message_count: int = 0
+):
     """
-    后台任务：总结对话
+    后台任务：将对话总结交给worker进程，未启用worker或入队失败时在当前进程中执行
+    
+    在当前进程中执行时直接使用chat中已读取的摘要信息，worker进程则自行从PostgreSQL读取
     """
-    # 获取现有摘要
-    conversation = await postgres_client.get_conversation_by_id(conversation_id)
-    existing_summary = conversation.summary if conversation else None
+    if SUMMARY_WORKER_ENABLED:
+        message_id = await get_redis().add_to_stream(
+            SUMMARY_STREAM,
+            {"conversation_id": conversation_id, "user_id": user_id},
+            maxlen=SUMMARY_STREAM_MAXLEN
+        )
+        if message_id:
+            return
+    
+    await summarize_conversation(
+        conversation_id,
+        user_id,
+        existing_summary=existing_summary,
+        summarized_message_count=summarized_message_count
+    )
+
+async def summarize_conversation(
+    conversation_id: str,
+    user_id: str,
+    existing_summary: Optional[Dict[str, Any]] = None,
+    summarized_message_count: Optional[int] = None
+):
+    """
+    总结对话，消息从PostgreSQL中重新读取，因此可以在worker进程中执行
+    
+    如果调用方已经读取过对话，可以传入summarized_message_count和existing_summary以省去一次查询
+    """
+    redis_client = get_redis()
+    postgres_client = get_postgres()
+    long_term_memory = get_long_term_memory()
+    
+    # 调用方没有提供摘要信息时查询对话，获取现有摘要
+    if summarized_message_count is None:
+        conversation = await postgres_client.get_conversation_by_id(conversation_id)
+        existing_summary = conversation.summary if conversation else None
+        summarized_message_count = (conversation.summarized_message_count or 0) if conversation else 0
+    last_count = summarized_message_count
+    
+    # 距离上次总结的新消息不足时跳过，并释放锁让后续对话轮次重新检查
+    current_count = await postgres_client.count_conversation_messages(conversation_id)
+    new_count = current_count - last_count
+    if new_count < SUMMARY_MIN_NEW_MESSAGES:
+        await redis_client.release_lock(f"sumlock:{conversation_id}")
+        return
+    
+    db_messages = await postgres_client.get_conversation_messages_lite(conversation_id)
+    messages = [
+        {
+            "role": msg.role,
+            "content": msg.content
+        }
+        for msg in db_messages
+    ]
+    
+    # 已有摘要时只总结新增的消息（增量摘要）
+    if existing_summary:
+        messages = messages[-new_count:]
     
     # 总结对话
     await long_term_memory.summarize_conversation(
         conversation_id=conversation_id,
         user_id=user_id,
         messages=messages,
-        existing_summary=existing_summary
-    )
\ No newline at end of file
+        existing_summary=existing_summary,
+        summarized_message_count=current_count
+    )
@@ -0,0 +1,166 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+from db.redis_client import RedisClient
+from db.postgres_client import PostgresClient
+from memory.short_term import ShortTermMemory
+from memory.long_term import LongTermMemory
+from memory.vector_store import VectorStore
+from memory.embedding_cache import EmbeddingCache
+from memory.embedding_store import EmbeddingStore
+from llm.base import BaseLLM
+from llm.openai_api import OpenAIClient
+from llm.anthropic_api import AnthropicClient
+from llm.deepseek_api import DeepSeekClient
+from llm.openrouter_api import OpenRouterClient
+from llm.multi_client import RaceClient, PoolClient
+
+# 所有客户端在第一次使用时才创建，并在整个进程内共享同一个实例
+# 路由通过Depends获取这些实例，测试时可以使用app.dependency_overrides替换
+
+@lru_cache(maxsize=None)
+def get_redis() -> RedisClient:
+    """获取共享的Redis客户端"""
+    return RedisClient()
+
+@lru_cache(maxsize=None)
+def get_postgres() -> PostgresClient:
+    """获取共享的PostgreSQL客户端"""
+    return PostgresClient()
+
+@lru_cache(maxsize=None)
+def get_vector_store() -> VectorStore:
+    """获取共享的向量数据库"""
+    return VectorStore()
+
+@lru_cache(maxsize=None)
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    """获取持久化向量存储，未启用或初始化失败时返回None"""
+    if os.getenv("EMBEDDING_STORE_ENABLED", "true").lower() != "true":
+        return None
+    try:
+        return EmbeddingStore()
+    except Exception as e:
+        print(f"持久化向量存储初始化失败: {e}")
+        return None
+
+@lru_cache(maxsize=None)
+def get_embedding_cache() -> EmbeddingCache:
+    """获取共享的查询向量缓存"""
+    vector_store = get_vector_store()
+    return EmbeddingCache(
+        embed_func=vector_store.embed_texts,
+        model_name=vector_store.embedding_model_name,
+        redis_client=get_redis(),
+        store=get_embedding_store()
+    )
+
+@lru_cache(maxsize=None)
+def get_openai() -> Optional[OpenAIClient]:
+    """获取OpenAI客户端，初始化失败时返回None"""
+    try:
+        return OpenAIClient()
+    except Exception as e:
+        print(f"OpenAI客户端初始化失败: {e}")
+        return None
+
+@lru_cache(maxsize=None)
+def get_anthropic() -> Optional[AnthropicClient]:
+    """获取Anthropic客户端，初始化失败时返回None"""
+    try:
+        return AnthropicClient()
+    except Exception as e:
+        print(f"Anthropic客户端初始化失败: {e}")
+        return None
+
+@lru_cache(maxsize=None)
+def get_deepseek() -> Optional[DeepSeekClient]:
+    """获取DeepSeek客户端，初始化失败时返回None"""
+    try:
+        return DeepSeekClient()
+    except Exception as e:
+        print(f"DeepSeek客户端初始化失败: {e}")
+        return None
+
+@lru_cache(maxsize=None)
+def get_openrouter() -> Optional[OpenRouterClient]:
+    """获取OpenRouter客户端，初始化失败时返回None"""
+    try:
+        return OpenRouterClient()
+    except Exception as e:
+        print(f"OpenRouter客户端初始化失败: {e}")
+        return None
+
+@lru_cache(maxsize=None)
+def get_default_llm() -> BaseLLM:
+    """
+    获取默认LLM客户端，优先级为DeepSeek > OpenRouter > OpenAI > Anthropic
+
+    LLM_ROUTING为race时同时调用所有可用的客户端并使用最快的回复，
+    为pool时按延迟在可用的客户端之间分配请求并自动故障切换，默认只使用优先级最高的客户端
+
+    Returns:
+        LLM客户端
+    """
+    routing = os.getenv("LLM_ROUTING", "single").lower()
+    getters = (get_deepseek, get_openrouter, get_openai, get_anthropic)
+
+    if routing in ("race", "pool"):
+        clients = [client for client in (get_client() for get_client in getters) if client]
+        if len(clients) > 1:
+            return RaceClient(clients) if routing == "race" else PoolClient(clients)
+
+    for get_client in getters:
+        client = get_client()
+        if client:
+            return client
+    raise ValueError("没有可用的LLM客户端")
+
+def get_llm_for_model(model: str) -> BaseLLM:
+    """
+    根据模型名称选择LLM客户端，没有匹配的客户端时使用默认客户端
+
+    Args:
+        model: 模型名称
+
+    Returns:
+        LLM客户端
+    """
+    llm_client = None
+    model_name = model.lower()
+
+    if "deepseek" in model_name and get_deepseek():
+        llm_client = get_deepseek()
+    elif "openrouter" in model_name or "/" in model_name:
+        # OpenRouter模型通常包含"/"，如"openai/gpt-4"
+        llm_client = get_openrouter()
+    elif "gpt" in model_name or "openai" in model_name:
+        llm_client = get_openai()
+    elif "claude" in model_name or "anthropic" in model_name:
+        llm_client = get_anthropic()
+
+    return llm_client or get_default_llm()
+
+async def close_llm_clients():
+    """关闭已创建的LLM客户端持有的HTTP连接，在应用关闭时调用"""
+    for get_client in (get_deepseek, get_openrouter, get_openai, get_anthropic):
+        # 只关闭已经创建过的客户端，避免在关闭时才初始化
+        if get_client.cache_info().currsize and get_client():
+            await get_client().aclose()
+
+@lru_cache(maxsize=None)
+def get_long_term_memory() -> LongTermMemory:
+    """获取共享的长期记忆管理器"""
+    return LongTermMemory(
+        get_postgres(),
+        get_redis(),
+        get_vector_store(),
+        get_default_llm(),
+        embedding_cache=get_embedding_cache()
+    )
+
+@lru_cache(maxsize=None)
+def get_short_term_memory() -> ShortTermMemory:
+    """获取共享的短期记忆管理器，与长期记忆共用向量缓存"""
+    return ShortTermMemory(get_redis(), get_postgres(), get_embedding_cache())
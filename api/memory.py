@@ -3,64 +3,14 @@ from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional, Union
 from datetime import datetime
 
-from db.redis_client import RedisClient
 from db.postgres_client import PostgresClient
+from db.models import is_valid_uuid
 from memory.long_term import LongTermMemory
-from memory.vector_store import VectorStore
-from llm.openai_api import OpenAIClient
-from llm.deepseek_api import DeepSeekClient
-from llm.openrouter_api import OpenRouterClient
-from llm.anthropic_api import AnthropicClient
+from api.clients import get_postgres, get_long_term_memory
 
 # 创建路由器
 router = APIRouter()
 
-# 创建客户端实例
-redis_client = RedisClient()
-postgres_client = PostgresClient()
-vector_store = VectorStore()
-
-# 创建LLM客户端
-try:
-    openai_client = OpenAIClient()
-except Exception as e:
-    print(f"OpenAI客户端初始化失败: {e}")
-    openai_client = None
-
-try:
-    deepseek_client = DeepSeekClient()
-except Exception as e:
-    print(f"DeepSeek客户端初始化失败: {e}")
-    deepseek_client = None
-
-try:
-    openrouter_client = OpenRouterClient()
-except Exception as e:
-    print(f"OpenRouter客户端初始化失败: {e}")
-    openrouter_client = None
-
-try:
-    anthropic_client = AnthropicClient()
-except Exception as e:
-    print(f"Anthropic客户端初始化失败: {e}")
-    anthropic_client = None
-
-# 选择默认LLM客户端
-default_llm_client = None
-if deepseek_client:
-    default_llm_client = deepseek_client
-elif openrouter_client:
-    default_llm_client = openrouter_client
-elif openai_client:
-    default_llm_client = openai_client
-elif anthropic_client:
-    default_llm_client = anthropic_client
-else:
-    raise ValueError("没有可用的LLM客户端")
-
-# 创建长期记忆管理器
-long_term_memory = LongTermMemory(postgres_client, redis_client, vector_store, default_llm_client)
-
 # 模型
 class MemoryCreate(BaseModel):
     user_id: str = Field(..., description="用户ID")
@@ -100,10 +50,16 @@ class Memory(BaseModel):
     relevance: Optional[float] = Field(None, description="相关性评分")
 
 @router.post("/", response_model=Memory)
-async def create_memory(memory: MemoryCreate):
+async def create_memory(
+    memory: MemoryCreate,
+    long_term_memory: LongTermMemory = Depends(get_long_term_memory)
+):
     """
     创建记忆
     """
+    if not is_valid_uuid(memory.user_id):
+        raise HTTPException(status_code=404, detail="用户不存在")
+    
     result = await long_term_memory.create_memory(
         user_id=memory.user_id,
         content=memory.content,
@@ -117,10 +73,16 @@ async def create_memory(memory: MemoryCreate):
     return result
 
 @router.get("/{memory_id}", response_model=Memory)
-async def get_memory(memory_id: str):
+async def get_memory(
+    memory_id: str,
+    long_term_memory: LongTermMemory = Depends(get_long_term_memory)
+):
     """
     获取记忆
     """
+    if not is_valid_uuid(memory_id):
+        raise HTTPException(status_code=404, detail="记忆不存在")
+    
     memory = await long_term_memory.get_memory(memory_id)
     if not memory:
         raise HTTPException(status_code=404, detail="记忆不存在")
@@ -128,10 +90,17 @@ async def get_memory(memory_id: str):
     return memory
 
 @router.put("/{memory_id}", response_model=Memory)
-async def update_memory(memory_id: str, memory: MemoryUpdate):
+async def update_memory(
+    memory_id: str,
+    memory: MemoryUpdate,
+    long_term_memory: LongTermMemory = Depends(get_long_term_memory)
+):
     """
     更新记忆
     """
+    if not is_valid_uuid(memory_id):
+        raise HTTPException(status_code=404, detail="记忆不存在")
+    
     success = await long_term_memory.update_memory(
         memory_id=memory_id,
         content=memory.content,
@@ -149,21 +118,38 @@ async def update_memory(memory_id: str, memory: MemoryUpdate):
     return updated_memory
 
 @router.delete("/{memory_id}")
-async def delete_memory(memory_id: str, soft_delete: bool = True):
+async def delete_memory(
+    memory_id: str,
+    soft_delete: bool = True,
+    long_term_memory: LongTermMemory = Depends(get_long_term_memory)
+):
     """
     删除记忆
     """
+    if not is_valid_uuid(memory_id):
+        raise HTTPException(status_code=404, detail="记忆不存在")
+    
     success = await long_term_memory.delete_memory(memory_id, soft_delete)
     if not success:
         raise HTTPException(status_code=404, detail="记忆不存在")
     
     return {"status": "success"}
 
-@router.post("/search", response_model=List[Memory])
-async def search_memories(search: MemorySearch):
+@router.post(
+    "/search",
+    response_model=None,  # 结果由服务端构造，跳过逐条校验；文档中仍使用Memory模型
+    responses={200: {"model": List[Memory]}}
+)
+async def search_memories(
+    search: MemorySearch,
+    long_term_memory: LongTermMemory = Depends(get_long_term_memory)
+):
     """
     搜索记忆
     """
+    if not is_valid_uuid(search.user_id):
+        return []
+    
     memories = await long_term_memory.search_memories(
         user_id=search.user_id,
         query=search.query,
@@ -173,39 +159,46 @@ async def search_memories(search: MemorySearch):
     
     return memories
 
-@router.get("/user/{user_id}", response_model=List[Memory])
+@router.get(
+    "/user/{user_id}",
+    response_model=None,  # 结果由服务端构造，跳过逐条校验；文档中仍使用Memory模型
+    responses={200: {"model": List[Memory]}}
+)
 async def get_user_memories(
     user_id: str,
     category: Optional[str] = None,
-    active_only: bool = True
+    active_only: bool = True,
+    postgres_client: PostgresClient = Depends(get_postgres)
 ):
     """
     获取用户的所有记忆
     """
-    memories = await postgres_client.get_user_memories(
+    if not is_valid_uuid(user_id):
+        return []
+    
+    # 分批读取记忆，每批用一次查询获取标签，避免一次性加载所有ORM对象
+    result = []
+    async for memories in postgres_client.stream_user_memories(
         user_id=user_id,
         category=category,
         active_only=active_only
-    )
-    
-    result = []
-    for memory in memories:
-        # 获取标签
-        tags = await postgres_client.get_memory_tags(memory.id)
+    ):
+        tags_by_memory = await postgres_client.get_memory_tags_bulk([memory.id for memory in memories])
         
-        result.append({
-            "id": memory.id,
-            "user_id": memory.user_id,
-            "content": memory.content,
-            "source": memory.source,
-            "importance": memory.importance,
-            "category": memory.category,
-            "metadata": memory.metadata,
-            "created_at": memory.created_at.isoformat(),
-            "updated_at": memory.updated_at.isoformat(),
-            "embedding_id": memory.embedding_id,
-            "tags": tags
-        })
+        for memory in memories:
+            result.append({
+                "id": memory.id,
+                "user_id": memory.user_id,
+                "content": memory.content,
+                "source": memory.source,
+                "importance": memory.importance,
+                "category": memory.category,
+                "metadata": memory.meta_data,
+                "created_at": memory.created_at.isoformat(),
+                "updated_at": memory.updated_at.isoformat(),
+                "embedding_id": memory.embedding_id,
+                "tags": tags_by_memory.get(memory.id, [])
+            })
     
     return result
 
@@ -214,13 +207,17 @@ async def save_memory_command(
     user_id: str,
     content: str,
     category: Optional[str] = None,
-    tags: Optional[str] = None
+    tags: Optional[str] = None,
+    long_term_memory: LongTermMemory = Depends(get_long_term_memory)
 ):
     """
     保存记忆命令
     
     这是一个用户友好的API，用于通过命令保存记忆
     """
+    if not is_valid_uuid(user_id):
+        raise HTTPException(status_code=404, detail="用户不存在")
+    
     tag_list = tags.split(",") if tags else []
     
     result = await long_term_memory.create_memory(
@@ -243,19 +240,23 @@ async def recall_memory_command(
     user_id: str,
     query: str,
     category: Optional[str] = None,
-    limit: int = 5
+    limit: int = 5,
+    long_term_memory: LongTermMemory = Depends(get_long_term_memory)
 ):
     """
     回忆记忆命令
     
     这是一个用户友好的API，用于通过命令回忆记忆
     """
-    memories = await long_term_memory.search_memories(
-        user_id=user_id,
-        query=query,
-        category=category,
-        limit=limit
-    )
+    # 非法的用户ID不会有任何记忆
+    memories = []
+    if is_valid_uuid(user_id):
+        memories = await long_term_memory.search_memories(
+            user_id=user_id,
+            query=query,
+            category=category,
+            limit=limit
+        )
     
     return {
         "status": "success",
@@ -267,19 +268,22 @@ async def recall_memory_command(
 async def forget_memory_command(
     user_id: str,
     query: str,
-    hard_delete: bool = False
+    hard_delete: bool = False,
+    long_term_memory: LongTermMemory = Depends(get_long_term_memory)
 ):
     """
     忘记记忆命令
     
     这是一个用户友好的API，用于通过命令忘记记忆
     """
-    # 搜索相关记忆
-    memories = await long_term_memory.search_memories(
-        user_id=user_id,
-        query=query,
-        limit=5
-    )
+    # 搜索相关记忆，非法的用户ID不会有任何记忆
+    memories = []
+    if is_valid_uuid(user_id):
+        memories = await long_term_memory.search_memories(
+            user_id=user_id,
+            query=query,
+            limit=5
+        )
     
     # 删除找到的记忆
     deleted_count = 0
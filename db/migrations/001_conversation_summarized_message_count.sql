@@ -0,0 +1,4 @@
+-- 为已有的conversations表添加上次总结时的消息数量字段
+-- 新建的数据库由create_tables自动创建该字段，无需执行此脚本
+ALTER TABLE conversations
+    ADD COLUMN IF NOT EXISTS summarized_message_count INTEGER NOT NULL DEFAULT 0;
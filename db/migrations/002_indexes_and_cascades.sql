@@ -0,0 +1,39 @@
+-- 为已有数据库添加外键索引、复合索引以及级联删除
+-- 新建的数据库由create_tables自动创建，无需执行此脚本
+
+-- 删除重复的记忆标签，以便添加唯一约束
+DELETE FROM memory_tags a
+    USING memory_tags b
+    WHERE a.memory_id = b.memory_id
+      AND a.tag = b.tag
+      AND a.id > b.id;
+
+ALTER TABLE memory_tags
+    ADD CONSTRAINT uq_memtag UNIQUE (memory_id, tag);
+
+CREATE INDEX IF NOT EXISTS ix_memory_tags_memory_id ON memory_tags (memory_id);
+CREATE INDEX IF NOT EXISTS ix_memory_tags_tag ON memory_tags (tag);
+CREATE INDEX IF NOT EXISTS ix_conversations_user_id ON conversations (user_id);
+CREATE INDEX IF NOT EXISTS ix_messages_conversation_id_created_at ON messages (conversation_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_memories_user_id_is_active_category ON memories (user_id, is_active, category);
+
+-- 将外键改为级联删除
+ALTER TABLE memory_tags
+    DROP CONSTRAINT IF EXISTS memory_tags_memory_id_fkey,
+    ADD CONSTRAINT memory_tags_memory_id_fkey
+        FOREIGN KEY (memory_id) REFERENCES memories (id) ON DELETE CASCADE;
+
+ALTER TABLE messages
+    DROP CONSTRAINT IF EXISTS messages_conversation_id_fkey,
+    ADD CONSTRAINT messages_conversation_id_fkey
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE;
+
+ALTER TABLE memories
+    DROP CONSTRAINT IF EXISTS memories_user_id_fkey,
+    ADD CONSTRAINT memories_user_id_fkey
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE;
+
+ALTER TABLE conversations
+    DROP CONSTRAINT IF EXISTS conversations_user_id_fkey,
+    ADD CONSTRAINT conversations_user_id_fkey
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE;
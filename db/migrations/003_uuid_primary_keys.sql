@@ -0,0 +1,38 @@
+-- 将所有主键和外键从VARCHAR(36)改为原生UUID类型（16字节，比较更快）
+-- 新建的数据库由create_tables自动创建，无需执行此脚本
+BEGIN;
+
+-- 先删除外键，修改类型后再重新创建
+ALTER TABLE memory_tags DROP CONSTRAINT IF EXISTS memory_tags_memory_id_fkey;
+ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_conversation_id_fkey;
+ALTER TABLE memories DROP CONSTRAINT IF EXISTS memories_user_id_fkey;
+ALTER TABLE conversations DROP CONSTRAINT IF EXISTS conversations_user_id_fkey;
+
+ALTER TABLE users ALTER COLUMN id TYPE uuid USING id::uuid;
+
+ALTER TABLE conversations ALTER COLUMN id TYPE uuid USING id::uuid;
+ALTER TABLE conversations ALTER COLUMN user_id TYPE uuid USING user_id::uuid;
+
+ALTER TABLE messages ALTER COLUMN id TYPE uuid USING id::uuid;
+ALTER TABLE messages ALTER COLUMN conversation_id TYPE uuid USING conversation_id::uuid;
+
+ALTER TABLE memories ALTER COLUMN id TYPE uuid USING id::uuid;
+ALTER TABLE memories ALTER COLUMN user_id TYPE uuid USING user_id::uuid;
+
+ALTER TABLE memory_tags ALTER COLUMN id TYPE uuid USING id::uuid;
+ALTER TABLE memory_tags ALTER COLUMN memory_id TYPE uuid USING memory_id::uuid;
+
+ALTER TABLE conversations
+    ADD CONSTRAINT conversations_user_id_fkey
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE;
+ALTER TABLE memories
+    ADD CONSTRAINT memories_user_id_fkey
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE;
+ALTER TABLE messages
+    ADD CONSTRAINT messages_conversation_id_fkey
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE;
+ALTER TABLE memory_tags
+    ADD CONSTRAINT memory_tags_memory_id_fkey
+        FOREIGN KEY (memory_id) REFERENCES memories (id) ON DELETE CASCADE;
+
+COMMIT;
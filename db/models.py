@@ -1,63 +1,113 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Boolean, Float
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Boolean, Float, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
-from datetime import datetime
+from sqlalchemy.sql import func
 import uuid
 
 Base = declarative_base()
 
+def utc_now():
+    """
+    数据库端生成的当前UTC时间（不带时区），作为时间列的默认值和更新值
+    
+    由数据库统一生成时间，避免各个客户端时钟不一致，也无需在Python中格式化并绑定参数
+    """
+    return func.timezone("UTC", func.now())
+
+def is_valid_uuid(value: object) -> bool:
+    """
+    判断值是否为合法的UUID字符串
+    
+    ID列使用PostgreSQL原生的UUID类型，把非法的ID传入查询会导致类型转换错误，
+    路由在查询前用它检查来自请求的ID
+    
+    Args:
+        value: 要检查的值
+    
+    Returns:
+        是否为合法的UUID
+    """
+    if not isinstance(value, str):
+        return False
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
 class User(Base):
     """用户模型"""
     __tablename__ = "users"
+    # 插入和更新时通过RETURNING取回数据库生成的时间，无需再次查询
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(UUID(as_uuid=False), primary_key=True, default=lambda: str(uuid.uuid4()))
     username = Column(String(50), unique=True, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now())
+    updated_at = Column(DateTime, server_default=utc_now(), onupdate=utc_now())
     
     # 关系
-    conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan")
-    memories = relationship("Memory", back_populates="user", cascade="all, delete-orphan")
+    # 关系默认禁止懒加载，需要时在查询中使用selectinload显式加载，避免N+1查询
+    # 删除时由数据库的级联外键删除子记录，无需先加载集合
+    conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan", passive_deletes=True, lazy="raise")
+    memories = relationship("Memory", back_populates="user", cascade="all, delete-orphan", passive_deletes=True, lazy="raise")
 
 class Conversation(Base):
     """对话模型"""
     __tablename__ = "conversations"
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String(36), ForeignKey("users.id"), nullable=False)
+    id = Column(UUID(as_uuid=False), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(UUID(as_uuid=False), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     title = Column(String(100), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now())
+    updated_at = Column(DateTime, server_default=utc_now(), onupdate=utc_now())
     summary = Column(JSON, nullable=True)  # 对话摘要，JSON格式
+    summarized_message_count = Column(Integer, default=0, nullable=False)  # 上次总结时的消息数量
     
     # 关系
-    user = relationship("User", back_populates="conversations")
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+    user = relationship("User", back_populates="conversations", lazy="raise")
+    messages = relationship(
+        "Message",
+        back_populates="conversation",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="Message.created_at",
+        lazy="raise"
+    )
 
 class Message(Base):
     """消息模型"""
     __tablename__ = "messages"
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    conversation_id = Column(String(36), ForeignKey("conversations.id"), nullable=False)
+    id = Column(UUID(as_uuid=False), primary_key=True, default=lambda: str(uuid.uuid4()))
+    conversation_id = Column(UUID(as_uuid=False), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
     role = Column(String(20), nullable=False)  # user, assistant, system
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now())
     tokens = Column(Integer, nullable=True)  # 消息的token数量
     
     # 关系
-    conversation = relationship("Conversation", back_populates="messages")
+    conversation = relationship("Conversation", back_populates="messages", lazy="raise")
+    
+    # 索引：按对话获取消息时按创建时间排序
+    __table_args__ = (
+        Index("ix_messages_conversation_id_created_at", "conversation_id", "created_at"),
+    )
 
 class Memory(Base):
     """记忆模型"""
     __tablename__ = "memories"
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String(36), ForeignKey("users.id"), nullable=False)
+    id = Column(UUID(as_uuid=False), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(UUID(as_uuid=False), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     content = Column(Text, nullable=False)  # 记忆内容
     source = Column(String(50), nullable=True)  # 记忆来源（如对话ID、用户手动添加等）
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now())
+    updated_at = Column(DateTime, server_default=utc_now(), onupdate=utc_now())
     importance = Column(Float, default=0.5)  # 重要性评分，0-1
     category = Column(String(50), nullable=True)  # 记忆类别（如个人信息、偏好、任务等）
     meta_data = Column(JSON, nullable=True)  # 元数据，JSON格式
@@ -65,18 +115,42 @@ class Memory(Base):
     embedding_id = Column(String(100), nullable=True)  # 向量数据库中的ID
     
     # 关系
-    user = relationship("User", back_populates="memories")
+    user = relationship("User", back_populates="memories", lazy="raise")
+    tags = relationship("MemoryTag", back_populates="memory", cascade="all, delete-orphan", passive_deletes=True, lazy="raise")
+    
+    # 索引：get_user_memories按用户、激活状态和类别过滤
+    # 激活记忆的查询使用部分索引，索引顺序与排序条件一致，无需再单独排序
+    # 向量搜索的结果按用户和embedding_id批量查找记忆
+    __table_args__ = (
+        Index("ix_memories_user_id_is_active_category", "user_id", "is_active", "category"),
+        Index("ix_memories_user_id_embedding_id", "user_id", "embedding_id"),
+        Index(
+            "ix_memories_user_active_importance",
+            user_id, importance.desc(), updated_at.desc(),
+            postgresql_where=(is_active == True)
+        ),
+        Index(
+            "ix_memories_user_category_active_importance",
+            user_id, category, importance.desc(), updated_at.desc(),
+            postgresql_where=(is_active == True)
+        ),
+    )
 
 class MemoryTag(Base):
     """记忆标签模型"""
     __tablename__ = "memory_tags"
     
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    memory_id = Column(String(36), ForeignKey("memories.id"), nullable=False)
+    id = Column(UUID(as_uuid=False), primary_key=True, default=lambda: str(uuid.uuid4()))
+    memory_id = Column(UUID(as_uuid=False), ForeignKey("memories.id", ondelete="CASCADE"), nullable=False, index=True)
     tag = Column(String(50), nullable=False)
     
+    # 关系
+    memory = relationship("Memory", back_populates="tags", lazy="raise")
+    
     # 索引和约束
     __table_args__ = (
         # 复合唯一约束，确保同一记忆不会有重复标签
+        UniqueConstraint("memory_id", "tag", name="uq_memtag"),
+        Index("ix_memory_tags_tag", "tag"),
         {"sqlite_autoincrement": True},
     )
\ No newline at end of file
@@ -1,15 +1,71 @@
 import os
+import json
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, selectinload
 from sqlalchemy.future import select
-from typing import List, Dict, Any, Optional, Type, TypeVar, Generic
-from datetime import datetime
+from sqlalchemy import func, insert, update, delete, bindparam, Row, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import List, Dict, Any, Optional, Type, TypeVar, Generic, AsyncIterator
+from datetime import datetime, timedelta
 
-from db.models import Base, User, Conversation, Message, Memory, MemoryTag
+from db.models import Base, User, Conversation, Message, Memory, MemoryTag, utc_now
+from utils.batcher import MicroBatcher
 
 # 定义泛型类型变量
 T = TypeVar('T')
 
+# 当前上下文中由transaction()开启的共享会话，同一事务内的多次操作复用同一个会话
+_current_session: ContextVar[Optional[AsyncSession]] = ContextVar("postgres_session", default=None)
+
+# 常用查询在模块加载时构建一次，参数通过bindparam传入，
+# 避免每次调用都重新构建表达式，SQLAlchemy也能直接命中已编译SQL的缓存
+_GET_USER_BY_ID = select(User).where(User.id == bindparam("user_id")).limit(1)
+_GET_USER_BY_USERNAME = select(User).where(User.username == bindparam("username")).limit(1)
+_GET_CONVERSATION_BY_ID = select(Conversation).where(Conversation.id == bindparam("conversation_id")).limit(1)
+_GET_CONVERSATION_WITH_MESSAGES = _GET_CONVERSATION_BY_ID.options(selectinload(Conversation.messages))
+_GET_USER_CONVERSATIONS = (
+    select(Conversation)
+    .where(Conversation.user_id == bindparam("user_id"))
+    .order_by(Conversation.updated_at.desc())
+)
+_GET_CONVERSATION_MESSAGES = (
+    select(Message)
+    .where(Message.conversation_id == bindparam("conversation_id"))
+    .order_by(Message.created_at)
+)
+_GET_CONVERSATION_MESSAGES_LITE = (
+    select(Message.role, Message.content, Message.tokens)
+    .where(Message.conversation_id == bindparam("conversation_id"))
+    .order_by(Message.created_at)
+)
+_COUNT_CONVERSATION_MESSAGES = (
+    select(func.count(Message.id))
+    .where(Message.conversation_id == bindparam("conversation_id"))
+)
+_GET_MEMORY_BY_ID = select(Memory).where(Memory.id == bindparam("memory_id")).limit(1)
+_GET_MEMORY_WITH_TAGS = _GET_MEMORY_BY_ID.options(selectinload(Memory.tags))
+_GET_MEMORIES_BY_EMBEDDING_IDS = (
+    select(Memory)
+    .where(Memory.user_id == bindparam("user_id"))
+    .where(Memory.embedding_id.in_(bindparam("embedding_ids", expanding=True)))
+    .where(Memory.is_active == True)
+)
+_GET_MEMORY_TAG = (
+    select(MemoryTag)
+    .where(MemoryTag.memory_id == bindparam("memory_id"))
+    .where(MemoryTag.tag == bindparam("tag"))
+    .limit(1)
+)
+_GET_MEMORY_TAGS = select(MemoryTag.tag).where(MemoryTag.memory_id == bindparam("memory_id"))
+_GET_MEMORY_TAGS_BULK = (
+    select(MemoryTag.memory_id, MemoryTag.tag)
+    .where(MemoryTag.memory_id.in_(bindparam("memory_ids", expanding=True)))
+)
+
 class PostgresClient:
     """PostgreSQL客户端，用于长期存储数据"""
     
@@ -24,11 +80,25 @@ class PostgresClient:
         # 创建数据库URL
         self.database_url = f"postgresql+asyncpg://{self.postgres_user}:{self.postgres_password}@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}"
         
-        # 创建异步引擎
+        # 使用pgbouncer事务池时，连接会在不同的会话之间复用，必须关闭asyncpg的预编译语句缓存
+        connect_args = {}
+        if os.getenv("PG_PGBOUNCER", "false").lower() == "true":
+            connect_args = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0
+            }
+        
+        # 创建异步引擎，显式配置连接池，避免并发请求等待连接
         self.engine = create_async_engine(
             self.database_url,
             echo=False,  # 设置为True可以查看SQL语句
-            future=True
+            future=True,
+            pool_size=int(os.getenv("PG_POOL_SIZE", "20")),
+            max_overflow=int(os.getenv("PG_POOL_OVERFLOW", "30")),
+            pool_pre_ping=True,  # 使用前检测连接是否可用
+            pool_recycle=int(os.getenv("PG_POOL_RECYCLE", "1800")),  # 定期重建连接（秒）
+            pool_timeout=int(os.getenv("PG_POOL_TIMEOUT", "10")),  # 等待空闲连接的最长时间（秒）
+            connect_args=connect_args
         )
         
         # 创建异步会话工厂
@@ -37,12 +107,82 @@ class PostgresClient:
             expire_on_commit=False,
             class_=AsyncSession
         )
+        
+        # 短时间内逐条创建的消息合并为一次INSERT
+        self._message_batcher = MicroBatcher(
+            self._insert_message_rows,
+            max_batch=int(os.getenv("PG_INSERT_BATCH_SIZE", "100")),
+            max_delay=float(os.getenv("PG_INSERT_BATCH_DELAY", "0.005")),
+            # 一批消息在同一事务中写入，失败时整批回滚，逐条重试后只有出错的消息（如对话已被删除）会失败
+            isolate_failures=True
+        )
     
     async def create_tables(self):
         """创建数据库表"""
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
     
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[AsyncSession]:
+        """
+        开启一个事务，上下文中的所有PostgresClient操作共享同一个会话，退出时统一提交
+        
+        发生异常时回滚全部操作；嵌套调用会加入外层事务。
+        同一个会话不能并发使用，事务内的操作需要依次await，不能放在asyncio.gather中
+        
+        Returns:
+            共享的异步会话
+        """
+        session = _current_session.get()
+        if session is not None:
+            yield session
+            return
+        
+        async with self.async_session() as session:
+            token = _current_session.set(session)
+            try:
+                yield session
+                await session.commit()
+            except BaseException:
+                await session.rollback()
+                raise
+            finally:
+                _current_session.reset(token)
+    
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[AsyncSession]:
+        """获取会话：在transaction()中时复用共享会话，否则创建新会话"""
+        session = _current_session.get()
+        if session is not None:
+            yield session
+            return
+        
+        async with self.async_session() as session:
+            yield session
+    
+    @staticmethod
+    async def _commit(session: AsyncSession):
+        """提交会话；共享会话只flush，由transaction()在退出时统一提交"""
+        if session is _current_session.get():
+            await session.flush()
+        else:
+            await session.commit()
+    
+    async def warmup(self, connections: int = 1):
+        """
+        预先建立连接池中的连接，避免启动后的第一批请求同时建立连接
+        
+        Args:
+            connections: 预先建立的连接数，不超过连接池大小
+        """
+        async def connect():
+            async with self.engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        
+        # 同时持有多个连接才能让连接池建立多个不同的连接
+        connections = max(1, min(connections, self.engine.pool.size()))
+        await asyncio.gather(*(connect() for _ in range(connections)))
+    
     async def get_session(self) -> AsyncSession:
         """
         获取数据库会话
@@ -67,11 +207,11 @@ class PostgresClient:
         Returns:
             创建的用户对象
         """
-        async with self.async_session() as session:
+        async with self._session() as session:
             user = User(username=username)
             session.add(user)
-            await session.commit()
-            await session.refresh(user)
+            # 时间戳由数据库的server_default生成，eager_defaults在flush时通过RETURNING一并加载，提交后无需重新查询
+            await self._commit(session)
             return user
     
     async def get_user_by_id(self, user_id: str) -> Optional[User]:
@@ -84,9 +224,8 @@ class PostgresClient:
         Returns:
             用户对象，如果不存在则返回None
         """
-        async with self.async_session() as session:
-            result = await session.execute(select(User).where(User.id == user_id))
-            return result.scalars().first()
+        async with self._session() as session:
+            return await session.scalar(_GET_USER_BY_ID, {"user_id": user_id})
     
     async def get_user_by_username(self, username: str) -> Optional[User]:
         """
@@ -98,9 +237,8 @@ class PostgresClient:
         Returns:
             用户对象，如果不存在则返回None
         """
-        async with self.async_session() as session:
-            result = await session.execute(select(User).where(User.username == username))
-            return result.scalars().first()
+        async with self._session() as session:
+            return await session.scalar(_GET_USER_BY_USERNAME, {"username": username})
     
     # 对话相关方法
     async def create_conversation(self, user_id: str, title: Optional[str] = None) -> Conversation:
@@ -114,26 +252,30 @@ class PostgresClient:
         Returns:
             创建的对话对象
         """
-        async with self.async_session() as session:
+        async with self._session() as session:
             conversation = Conversation(user_id=user_id, title=title)
             session.add(conversation)
-            await session.commit()
-            await session.refresh(conversation)
+            await self._commit(session)
             return conversation
     
-    async def get_conversation_by_id(self, conversation_id: str) -> Optional[Conversation]:
+    async def get_conversation_by_id(
+        self, 
+        conversation_id: str,
+        with_messages: bool = False
+    ) -> Optional[Conversation]:
         """
         通过ID获取对话
         
         Args:
             conversation_id: 对话ID
+            with_messages: 是否同时加载对话的所有消息（按创建时间排序）
         
         Returns:
             对话对象，如果不存在则返回None
         """
-        async with self.async_session() as session:
-            result = await session.execute(select(Conversation).where(Conversation.id == conversation_id))
-            return result.scalars().first()
+        async with self._session() as session:
+            query = _GET_CONVERSATION_WITH_MESSAGES if with_messages else _GET_CONVERSATION_BY_ID
+            return await session.scalar(query, {"conversation_id": conversation_id})
     
     async def get_user_conversations(self, user_id: str) -> List[Conversation]:
         """
@@ -145,33 +287,44 @@ class PostgresClient:
         Returns:
             对话列表
         """
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(Conversation)
-                .where(Conversation.user_id == user_id)
-                .order_by(Conversation.updated_at.desc())
-            )
+        async with self._session() as session:
+            result = await session.execute(_GET_USER_CONVERSATIONS, {"user_id": user_id})
             return result.scalars().all()
     
-    async def update_conversation_summary(self, conversation_id: str, summary: Dict[str, Any]) -> bool:
+    async def update_conversation_summary(
+        self, 
+        conversation_id: str, 
+        summary: Dict[str, Any],
+        summarized_message_count: Optional[int] = None
+    ) -> bool:
         """
         更新对话摘要
         
         Args:
             conversation_id: 对话ID
             summary: 摘要数据
+            summarized_message_count: 本次总结覆盖的消息数量，如果为None则不更新
         
         Returns:
             是否成功
         """
-        async with self.async_session() as session:
-            conversation = await session.get(Conversation, conversation_id)
-            if conversation:
-                conversation.summary = summary
-                conversation.updated_at = datetime.utcnow()
-                await session.commit()
-                return True
-            return False
+        values = {
+            "summary": summary,
+            "updated_at": utc_now()
+        }
+        if summarized_message_count is not None:
+            values["summarized_message_count"] = summarized_message_count
+        
+        # 直接执行UPDATE，无需先读取整行
+        async with self._session() as session:
+            result = await session.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation_id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            await self._commit(session)
+            return result.rowcount > 0
     
     # 消息相关方法
     async def create_message(
@@ -182,7 +335,7 @@ class PostgresClient:
         tokens: Optional[int] = None
     ) -> Message:
         """
-        创建消息
+        创建消息，短时间内的多次调用会被合并为一次INSERT
         
         Args:
             conversation_id: 对话ID
@@ -193,23 +346,111 @@ class PostgresClient:
         Returns:
             创建的消息对象
         """
+        # 创建时间在调用时由客户端生成（进入批处理器之前），保证合并写入后按created_at排序仍与调用顺序一致
+        # （同一条INSERT中数据库的now()对所有行相同，无法区分先后，因此消息不使用server_default）
+        row = {
+            "conversation_id": conversation_id,
+            "role": role,
+            "content": content,
+            "tokens": tokens,
+            "created_at": datetime.utcnow()
+        }
+        
+        # 在事务中时直接写入共享会话，与事务内的其他操作一起提交
+        session = _current_session.get()
+        if session is not None:
+            return (await self._write_message_rows(session, [row]))[0]
+        return await self._message_batcher.submit(row)
+    
+    async def _insert_message_rows(self, rows: List[Dict[str, Any]]) -> List[Message]:
+        """
+        用一次INSERT写入多条消息，并更新相关对话的更新时间
+        
+        由消息批处理器调用，合并了多个调用方的消息，始终使用独立的会话和事务
+        
+        Args:
+            rows: 消息行列表
+        
+        Returns:
+            与输入一一对应的消息对象列表
+        """
         async with self.async_session() as session:
-            message = Message(
-                conversation_id=conversation_id,
-                role=role,
-                content=content,
-                tokens=tokens
-            )
-            session.add(message)
+            messages = await self._write_message_rows(session, rows)
+            await session.commit()
+            return messages
+    
+    async def _write_message_rows(self, session: AsyncSession, rows: List[Dict[str, Any]]) -> List[Message]:
+        """
+        在指定会话中写入多条消息，并更新相关对话的更新时间（不提交）
+        
+        Args:
+            session: 数据库会话
+            rows: 消息行列表
+        
+        Returns:
+            与输入一一对应的消息对象列表
+        """
+        conversation_ids = list(dict.fromkeys(row["conversation_id"] for row in rows))
+        
+        result = await session.scalars(
+            insert(Message).returning(Message, sort_by_parameter_order=True),
+            rows
+        )
+        messages = result.all()
+        
+        # 在同一事务中更新对话的更新时间，无需先读取对话
+        await session.execute(
+            update(Conversation)
+            .where(Conversation.id.in_(conversation_ids))
+            .values(updated_at=utc_now())
+            .execution_options(synchronize_session=False)
+        )
+        return messages
+    
+    async def create_messages(
+        self, 
+        conversation_id: str, 
+        messages: List[Dict[str, Any]]
+    ) -> int:
+        """
+        批量创建消息，所有消息通过一次executemany写入
+        
+        Args:
+            conversation_id: 对话ID
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello", "tokens": 5}, ...]
+        
+        Returns:
+            创建的消息数量
+        """
+        if not messages:
+            return 0
+        
+        # 显式递增创建时间，保证按created_at排序时与传入顺序一致
+        now = datetime.utcnow()
+        rows = [
+            {
+                "conversation_id": conversation_id,
+                "role": message["role"],
+                "content": message["content"],
+                "tokens": message.get("tokens"),
+                "created_at": now + timedelta(microseconds=i)
+            }
+            for i, message in enumerate(messages)
+        ]
+        
+        async with self._session() as session:
+            await session.execute(insert(Message), rows)
             
-            # 更新对话的更新时间
-            conversation = await session.get(Conversation, conversation_id)
-            if conversation:
-                conversation.updated_at = datetime.utcnow()
+            # 在同一事务中更新对话的更新时间，无需先读取对话
+            await session.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation_id)
+                .values(updated_at=utc_now())
+                .execution_options(synchronize_session=False)
+            )
             
-            await session.commit()
-            await session.refresh(message)
-            return message
+            await self._commit(session)
+            return len(rows)
     
     async def get_conversation_messages(self, conversation_id: str) -> List[Message]:
         """
@@ -221,14 +462,40 @@ class PostgresClient:
         Returns:
             消息列表
         """
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(Message)
-                .where(Message.conversation_id == conversation_id)
-                .order_by(Message.created_at)
-            )
+        async with self._session() as session:
+            result = await session.execute(_GET_CONVERSATION_MESSAGES, {"conversation_id": conversation_id})
             return result.scalars().all()
     
+    async def get_conversation_messages_lite(self, conversation_id: str) -> List[Row]:
+        """
+        获取对话的所有消息，只读取角色、内容和token数量
+        
+        使用Core查询返回元组行，不创建ORM对象，适合只需要消息内容的场景
+        
+        Args:
+            conversation_id: 对话ID
+        
+        Returns:
+            消息行列表，可以通过row.role、row.content、row.tokens访问
+        """
+        async with self._session() as session:
+            result = await session.execute(_GET_CONVERSATION_MESSAGES_LITE, {"conversation_id": conversation_id})
+            return result.all()
+    
+    async def count_conversation_messages(self, conversation_id: str) -> int:
+        """
+        统计对话的消息数量
+        
+        Args:
+            conversation_id: 对话ID
+        
+        Returns:
+            消息数量
+        """
+        async with self._session() as session:
+            result = await session.execute(_COUNT_CONVERSATION_MESSAGES, {"conversation_id": conversation_id})
+            return result.scalar() or 0
+    
     # 记忆相关方法
     async def create_memory(
         self,
@@ -255,40 +522,150 @@ class PostgresClient:
         Returns:
             创建的记忆对象
         """
-        async with self.async_session() as session:
+        async with self._session() as session:
             memory = Memory(
                 user_id=user_id,
                 content=content,
                 source=source,
                 importance=importance,
                 category=category,
-                metadata=metadata,
+                meta_data=metadata,
                 embedding_id=embedding_id
             )
             session.add(memory)
-            await session.commit()
-            await session.refresh(memory)
+            await self._commit(session)
             return memory
     
-    async def get_memory_by_id(self, memory_id: str) -> Optional[Memory]:
+    async def create_memories_bulk(self, memories: List[Dict[str, Any]]) -> List[Memory]:
+        """
+        批量创建记忆，所有记忆通过一次INSERT ... RETURNING写入
+        
+        Args:
+            memories: 记忆列表，每项包含user_id、content、source、importance、category、metadata、embedding_id
+        
+        Returns:
+            与输入一一对应的记忆对象列表
+        """
+        if not memories:
+            return []
+        
+        rows = [
+            {
+                "user_id": memory["user_id"],
+                "content": memory["content"],
+                "source": memory.get("source"),
+                "importance": memory.get("importance", 0.5),
+                "category": memory.get("category"),
+                "meta_data": memory.get("metadata"),
+                "embedding_id": memory.get("embedding_id")
+            }
+            for memory in memories
+        ]
+        
+        async with self._session() as session:
+            result = await session.scalars(
+                insert(Memory).returning(Memory, sort_by_parameter_order=True),
+                rows
+            )
+            created = result.all()
+            await self._commit(session)
+            return created
+    
+    # COPY写入的列，顺序与bulk_copy_memories生成的记录一致
+    _MEMORY_COPY_COLUMNS = [
+        "id", "user_id", "content", "source", "created_at", "updated_at",
+        "importance", "category", "meta_data", "is_active", "embedding_id"
+    ]
+    
+    async def bulk_copy_memories(self, memories: List[Dict[str, Any]]) -> List[str]:
+        """
+        使用PostgreSQL的COPY协议批量导入记忆，适合导入历史数据、迁移用户等大批量场景
+        
+        绕过ORM直接通过asyncpg的copy_records_to_table写入，不返回记忆对象，
+        也不会加入transaction()中的共享事务
+        
+        Args:
+            memories: 记忆列表，每项包含user_id、content，以及可选的id、source、importance、category、metadata、embedding_id、created_at
+        
+        Returns:
+            与输入一一对应的记忆ID列表
+        """
+        if not memories:
+            return []
+        
+        now = datetime.utcnow()
+        ids = [memory.get("id") or str(uuid.uuid4()) for memory in memories]
+        records = [
+            (
+                uuid.UUID(memory_id),
+                uuid.UUID(memory["user_id"]),
+                memory["content"],
+                memory.get("source"),
+                memory.get("created_at") or now,
+                memory.get("created_at") or now,
+                memory.get("importance", 0.5),
+                memory.get("category"),
+                # asyncpg以文本形式编码json列
+                json.dumps(memory["metadata"], ensure_ascii=False) if memory.get("metadata") is not None else None,
+                memory.get("is_active", True),
+                memory.get("embedding_id")
+            )
+            for memory_id, memory in zip(ids, memories)
+        ]
+        
+        async with self.engine.connect() as conn:
+            raw_connection = await conn.get_raw_connection()
+            driver_connection = raw_connection.driver_connection
+            async with driver_connection.transaction():
+                await driver_connection.copy_records_to_table(
+                    Memory.__tablename__,
+                    records=records,
+                    columns=self._MEMORY_COPY_COLUMNS
+                )
+        return ids
+    
+    async def get_memory_by_id(self, memory_id: str, with_tags: bool = False) -> Optional[Memory]:
         """
         通过ID获取记忆
         
         Args:
             memory_id: 记忆ID
+            with_tags: 是否同时加载记忆的标签
         
         Returns:
             记忆对象，如果不存在则返回None
         """
-        async with self.async_session() as session:
-            result = await session.execute(select(Memory).where(Memory.id == memory_id))
-            return result.scalars().first()
+        async with self._session() as session:
+            query = _GET_MEMORY_WITH_TAGS if with_tags else _GET_MEMORY_BY_ID
+            return await session.scalar(query, {"memory_id": memory_id})
+    
+    async def get_memories_by_embedding_ids(self, user_id: str, embedding_ids: List[str]) -> List[Memory]:
+        """
+        通过向量数据库中的ID批量获取用户的激活记忆，只需一次查询
+        
+        Args:
+            user_id: 用户ID
+            embedding_ids: 向量数据库中的ID列表
+        
+        Returns:
+            记忆列表，不保证与embedding_ids的顺序一致，不存在或未激活的记忆不返回
+        """
+        if not embedding_ids:
+            return []
+        
+        async with self._session() as session:
+            result = await session.execute(
+                _GET_MEMORIES_BY_EMBEDDING_IDS,
+                {"user_id": user_id, "embedding_ids": list(embedding_ids)}
+            )
+            return result.scalars().all()
     
     async def get_user_memories(
         self, 
         user_id: str, 
         category: Optional[str] = None,
-        active_only: bool = True
+        active_only: bool = True,
+        with_tags: bool = False
     ) -> List[Memory]:
         """
         获取用户的所有记忆
@@ -297,13 +674,17 @@ class PostgresClient:
             user_id: 用户ID
             category: 记忆类别
             active_only: 是否只返回激活的记忆
+            with_tags: 是否同时加载所有记忆的标签（一次额外查询）
         
         Returns:
             记忆列表
         """
-        async with self.async_session() as session:
+        async with self._session() as session:
             query = select(Memory).where(Memory.user_id == user_id)
             
+            if with_tags:
+                query = query.options(selectinload(Memory.tags))
+            
             if category:
                 query = query.where(Memory.category == category)
             
@@ -315,6 +696,43 @@ class PostgresClient:
             result = await session.execute(query)
             return result.scalars().all()
     
+    async def stream_user_memories(
+        self, 
+        user_id: str, 
+        category: Optional[str] = None,
+        active_only: bool = True,
+        batch_size: int = 200
+    ) -> AsyncIterator[List[Memory]]:
+        """
+        分批流式读取用户的所有记忆，内存占用与批大小而不是记忆总数成正比
+        
+        Args:
+            user_id: 用户ID
+            category: 记忆类别
+            active_only: 是否只返回激活的记忆
+            batch_size: 每批读取的记忆数量
+        
+        Yields:
+            记忆列表，每批最多batch_size条
+        """
+        query = select(Memory).where(Memory.user_id == user_id)
+        
+        if category:
+            query = query.where(Memory.category == category)
+        
+        if active_only:
+            query = query.where(Memory.is_active == True)
+        
+        query = query.order_by(Memory.importance.desc(), Memory.updated_at.desc())
+        
+        async with self.async_session() as stream_session:
+            # 流式读取使用独立的会话，每批读取后清空标识映射不会影响事务中的共享会话
+            result = await stream_session.stream_scalars(query.execution_options(yield_per=batch_size))
+            async for batch in result.partitions():
+                yield batch
+                # 处理完一批后从会话中移除，避免标识映射无限增长
+                stream_session.expunge_all()
+    
     async def update_memory(
         self,
         memory_id: str,
@@ -340,26 +758,26 @@ class PostgresClient:
         Returns:
             是否成功
         """
-        async with self.async_session() as session:
-            memory = await session.get(Memory, memory_id)
-            if memory:
-                if content is not None:
-                    memory.content = content
-                if importance is not None:
-                    memory.importance = importance
-                if category is not None:
-                    memory.category = category
-                if metadata is not None:
-                    memory.metadata = metadata
-                if is_active is not None:
-                    memory.is_active = is_active
-                if embedding_id is not None:
-                    memory.embedding_id = embedding_id
-                
-                memory.updated_at = datetime.utcnow()
-                await session.commit()
-                return True
-            return False
+        values = {
+            "content": content,
+            "importance": importance,
+            "category": category,
+            "meta_data": metadata,
+            "is_active": is_active,
+            "embedding_id": embedding_id
+        }
+        values = {key: value for key, value in values.items() if value is not None}
+        
+        # 直接执行UPDATE，无需先读取整行
+        async with self._session() as session:
+            result = await session.execute(
+                update(Memory)
+                .where(Memory.id == memory_id)
+                .values(updated_at=utc_now(), **values)
+                .execution_options(synchronize_session=False)
+            )
+            await self._commit(session)
+            return result.rowcount > 0
     
     async def delete_memory(self, memory_id: str, soft_delete: bool = True) -> bool:
         """
@@ -372,18 +790,22 @@ class PostgresClient:
         Returns:
             是否成功
         """
-        async with self.async_session() as session:
-            memory = await session.get(Memory, memory_id)
-            if memory:
-                if soft_delete:
-                    memory.is_active = False
-                    memory.updated_at = datetime.utcnow()
-                    await session.commit()
-                else:
-                    await session.delete(memory)
-                    await session.commit()
-                return True
-            return False
+        if soft_delete:
+            statement = (
+                update(Memory)
+                .where(Memory.id == memory_id)
+                .values(is_active=False, updated_at=utc_now())
+            )
+        else:
+            statement = delete(Memory).where(Memory.id == memory_id)
+        
+        # 直接执行UPDATE或DELETE，无需先读取整行
+        async with self._session() as session:
+            result = await session.execute(
+                statement.execution_options(synchronize_session=False)
+            )
+            await self._commit(session)
+            return result.rowcount > 0
     
     # 记忆标签相关方法
     async def add_memory_tag(self, memory_id: str, tag: str) -> MemoryTag:
@@ -397,24 +819,72 @@ class PostgresClient:
         Returns:
             创建的标签对象
         """
-        async with self.async_session() as session:
-            # 检查标签是否已存在
-            result = await session.execute(
-                select(MemoryTag)
-                .where(MemoryTag.memory_id == memory_id)
-                .where(MemoryTag.tag == tag)
+        async with self._session() as session:
+            # 一条语句完成插入，标签已存在时不做任何操作，避免先查询再插入的竞争
+            memory_tag = await session.scalar(
+                pg_insert(MemoryTag)
+                .values(memory_id=memory_id, tag=tag)
+                .on_conflict_do_nothing(constraint="uq_memtag")
+                .returning(MemoryTag)
             )
-            existing_tag = result.scalars().first()
-            
-            if existing_tag:
-                return existing_tag
+            await self._commit(session)
             
-            memory_tag = MemoryTag(memory_id=memory_id, tag=tag)
-            session.add(memory_tag)
-            await session.commit()
-            await session.refresh(memory_tag)
+            if memory_tag is None:
+                # 标签已存在，读取已有的标签
+                memory_tag = await session.scalar(_GET_MEMORY_TAG, {"memory_id": memory_id, "tag": tag})
             return memory_tag
     
+    async def add_memory_tags(self, memory_id: str, tags: List[str]) -> bool:
+        """
+        批量添加记忆标签，已存在的标签会被忽略
+        
+        Args:
+            memory_id: 记忆ID
+            tags: 标签列表
+        
+        Returns:
+            是否成功
+        """
+        tags = list(dict.fromkeys(tags))
+        if not tags:
+            return True
+        
+        async with self._session() as session:
+            await session.execute(
+                pg_insert(MemoryTag)
+                .values([{"memory_id": memory_id, "tag": tag} for tag in tags])
+                .on_conflict_do_nothing(constraint="uq_memtag")
+            )
+            await self._commit(session)
+            return True
+    
+    async def add_memory_tags_bulk(self, tags_by_memory: Dict[str, List[str]]) -> bool:
+        """
+        一次性为多条记忆添加标签，已存在的标签会被忽略
+        
+        Args:
+            tags_by_memory: 记忆ID到标签列表的映射
+        
+        Returns:
+            是否成功
+        """
+        rows = [
+            {"memory_id": memory_id, "tag": tag}
+            for memory_id, tags in tags_by_memory.items()
+            for tag in dict.fromkeys(tags or [])
+        ]
+        if not rows:
+            return True
+        
+        async with self._session() as session:
+            await session.execute(
+                pg_insert(MemoryTag)
+                .values(rows)
+                .on_conflict_do_nothing(constraint="uq_memtag")
+            )
+            await self._commit(session)
+            return True
+    
     async def get_memory_tags(self, memory_id: str) -> List[str]:
         """
         获取记忆的所有标签
@@ -425,12 +895,29 @@ class PostgresClient:
         Returns:
             标签列表
         """
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(MemoryTag.tag)
-                .where(MemoryTag.memory_id == memory_id)
-            )
-            return result.scalars().all()
+        async with self._session() as session:
+            result = await session.scalars(_GET_MEMORY_TAGS, {"memory_id": memory_id})
+            return result.all()
+    
+    async def get_memory_tags_bulk(self, memory_ids: List[str]) -> Dict[str, List[str]]:
+        """
+        批量获取多个记忆的标签，只需一次查询
+        
+        Args:
+            memory_ids: 记忆ID列表
+        
+        Returns:
+            记忆ID到标签列表的映射，没有标签的记忆对应空列表
+        """
+        tags_by_memory: Dict[str, List[str]] = {memory_id: [] for memory_id in memory_ids}
+        if not memory_ids:
+            return tags_by_memory
+        
+        async with self._session() as session:
+            result = await session.execute(_GET_MEMORY_TAGS_BULK, {"memory_ids": list(memory_ids)})
+            for memory_id, tag in result.all():
+                tags_by_memory.setdefault(memory_id, []).append(tag)
+            return tags_by_memory
     
     async def remove_memory_tag(self, memory_id: str, tag: str) -> bool:
         """
@@ -443,16 +930,13 @@ class PostgresClient:
         Returns:
             是否成功
         """
-        async with self.async_session() as session:
+        # 直接执行DELETE，无需先读取标签
+        async with self._session() as session:
             result = await session.execute(
-                select(MemoryTag)
+                delete(MemoryTag)
                 .where(MemoryTag.memory_id == memory_id)
                 .where(MemoryTag.tag == tag)
+                .execution_options(synchronize_session=False)
             )
-            memory_tag = result.scalars().first()
-            
-            if memory_tag:
-                await session.delete(memory_tag)
-                await session.commit()
-                return True
-            return False
\ No newline at end of file
+            await self._commit(session)
+            return result.rowcount > 0
\ No newline at end of file
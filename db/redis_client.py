@@ -1,9 +1,101 @@
 import os
-import json
+import re
+import uuid
+import asyncio
+import logging
+import functools
+import orjson
+import numpy as np
 import redis.asyncio as redis
-from typing import Dict, List, Any, Optional, Union
+from redis.exceptions import RedisError
+from typing import Dict, List, Any, Optional, Union, Callable
 from datetime import datetime, timedelta
 
+# 进程内共享的Redis连接池，所有RedisClient实例复用同一个连接池
+_shared_pool: Optional[redis.ConnectionPool] = None
+
+def get_shared_pool() -> redis.ConnectionPool:
+    """
+    获取进程内共享的Redis连接池，首次调用时创建
+    
+    Returns:
+        Redis连接池
+    """
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = redis.ConnectionPool(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            db=int(os.getenv("REDIS_DB", 0)),
+            password=os.getenv("REDIS_PASSWORD", None),
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 64)),
+            decode_responses=False  # 直接返回字节，由orjson解析，省去中间字符串
+        )
+    return _shared_pool
+
+# orjson直接生成字节，并支持numpy数组和datetime
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+def dumps_json(value: Any) -> bytes:
+    """将数据序列化为JSON字节"""
+    return orjson.dumps(value, option=_ORJSON_OPTIONS)
+
+def loads_json(data: Union[bytes, str]) -> Any:
+    """将JSON字节或字符串反序列化"""
+    return orjson.loads(data)
+
+# 超过该大小（字节）的JSON在线程池中解析，避免长时间阻塞事件循环
+JSON_OFFLOAD_THRESHOLD = int(os.getenv("REDIS_JSON_OFFLOAD_BYTES", "32768"))
+
+async def loads_json_async(data: Union[bytes, str]) -> Any:
+    """反序列化JSON，较大的数据放到线程池中解析"""
+    if len(data) > JSON_OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(orjson.loads, data)
+    return orjson.loads(data)
+
+# Redis键模板，预先绑定str.format，避免每次调用都解析f-string
+_CONVERSATION_MESSAGES_KEY = "conversation:{}:messages".format
+_USER_MEMORY_CACHE_KEY = "user:{}:memory_cache".format
+_SIMILARITY_CACHE_KEY = "simcache:{}".format
+_SEARCH_CACHE_KEY = "memsearch:{}".format
+
+# 语义缓存向量在RediSearch中的存储类型：FLOAT16（redis-stack 7.x即可使用）、FLOAT32或INT8（需要Redis 8+）
+SEMANTIC_VECTOR_TYPE = os.getenv("SEMANTIC_CACHE_VECTOR_TYPE", "FLOAT16").upper()
+
+logger = logging.getLogger(__name__)
+
+# Redis操作中可以安全降级处理的异常：Redis本身的错误以及缓存数据无法序列化/解析
+_REDIS_OP_ERRORS = (RedisError, orjson.JSONEncodeError, orjson.JSONDecodeError)
+
+def _redis_op(default: Any = None):
+    """
+    Redis操作的统一错误处理：失败时记录警告并返回默认值，缓存故障不影响主流程
+    
+    任务取消（asyncio.CancelledError）和其他未预期的异常会继续向上抛出
+    
+    Args:
+        default: 失败时的返回值，如果是可调用对象则每次调用它生成新的返回值
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except _REDIS_OP_ERRORS as e:
+                logger.warning("Redis操作%s失败: %s", func.__name__, e)
+                return default() if callable(default) else default
+        return wrapper
+    return decorator
+
+async def close_shared_pool():
+    """断开共享连接池中的所有连接，在应用关闭时调用"""
+    global _shared_pool
+    if _shared_pool is not None:
+        await _shared_pool.disconnect()
+        _shared_pool = None
+
 class RedisClient:
     """Redis客户端，用于缓存短期记忆和其他需要快速访问的数据"""
     
@@ -14,18 +106,16 @@ class RedisClient:
         self.redis_db = int(os.getenv("REDIS_DB", 0))
         self.redis_password = os.getenv("REDIS_PASSWORD", None)
         
-        # 创建Redis连接池
-        self.redis_pool = redis.ConnectionPool(
-            host=self.redis_host,
-            port=self.redis_port,
-            db=self.redis_db,
-            password=self.redis_password,
-            decode_responses=True  # 自动将字节解码为字符串
-        )
+        # 复用进程内共享的Redis连接池，避免每个实例各自建立连接
+        self.redis_pool = get_shared_pool()
         
         # 创建Redis客户端
         self.redis = redis.Redis(connection_pool=self.redis_pool)
+        
+        # 已确认存在的语义缓存索引
+        self._semantic_indexes = set()
     
+    @_redis_op(default=False)
     async def ping(self) -> bool:
         """
         测试Redis连接
@@ -33,16 +123,13 @@ class RedisClient:
         Returns:
             连接是否成功
         """
-        try:
-            return await self.redis.ping()
-        except Exception as e:
-            print(f"Redis连接失败: {e}")
-            return False
+        return await self.redis.ping()
     
     async def close(self):
-        """关闭Redis连接"""
+        """关闭Redis客户端（共享连接池由close_shared_pool统一关闭）"""
         await self.redis.close()
     
+    @_redis_op(default=False)
     async def set_json(self, key: str, value: Dict[str, Any], expiry: Optional[int] = None) -> bool:
         """
         将JSON数据存储到Redis
@@ -55,17 +142,14 @@ class RedisClient:
         Returns:
             是否成功
         """
-        try:
-            json_data = json.dumps(value)
-            if expiry:
-                await self.redis.setex(key, expiry, json_data)
-            else:
-                await self.redis.set(key, json_data)
-            return True
-        except Exception as e:
-            print(f"Redis设置JSON失败: {e}")
-            return False
+        json_data = dumps_json(value)
+        if expiry:
+            await self.redis.setex(key, expiry, json_data)
+        else:
+            await self.redis.set(key, json_data)
+        return True
     
+    @_redis_op(default=None)
     async def get_json(self, key: str) -> Optional[Dict[str, Any]]:
         """
         从Redis获取JSON数据
@@ -76,15 +160,59 @@ class RedisClient:
         Returns:
             JSON数据，如果不存在则返回None
         """
-        try:
-            data = await self.redis.get(key)
-            if data:
-                return json.loads(data)
-            return None
-        except Exception as e:
-            print(f"Redis获取JSON失败: {e}")
-            return None
+        data = await self.redis.get(key)
+        if data:
+            return await loads_json_async(data)
+        return None
     
+    async def get_json_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        使用一次MGET批量获取JSON数据
+        
+        Args:
+            keys: Redis键列表
+        
+        Returns:
+            与键一一对应的JSON数据列表，不存在的键对应None
+        """
+        if not keys:
+            return []
+        values = await self._mget(keys)
+        if values is None:
+            return [None] * len(keys)
+        return values
+    
+    @_redis_op(default=None)
+    async def _mget(self, keys: List[str]) -> Optional[List[Optional[Dict[str, Any]]]]:
+        """执行MGET并解析结果，失败时返回None"""
+        values = await self.redis.mget(keys)
+        return [await loads_json_async(value) if value else None for value in values]
+    
+    @_redis_op(default=False)
+    async def set_json_many(self, items: Dict[str, Dict[str, Any]], expiry: Optional[int] = None) -> bool:
+        """
+        使用pipeline批量存储JSON数据
+        
+        Args:
+            items: Redis键到JSON数据的映射
+            expiry: 过期时间（秒），如果为None则不过期
+        
+        Returns:
+            是否成功
+        """
+        if not items:
+            return True
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                json_data = dumps_json(value)
+                if expiry:
+                    pipe.setex(key, expiry, json_data)
+                else:
+                    pipe.set(key, json_data)
+            await pipe.execute()
+        return True
+    
+    @_redis_op(default=False)
     async def delete(self, key: str) -> bool:
         """
         删除Redis键
@@ -95,13 +223,10 @@ class RedisClient:
         Returns:
             是否成功
         """
-        try:
-            await self.redis.delete(key)
-            return True
-        except Exception as e:
-            print(f"Redis删除键失败: {e}")
-            return False
+        await self.redis.delete(key)
+        return True
     
+    @_redis_op(default=False)
     async def exists(self, key: str) -> bool:
         """
         检查Redis键是否存在
@@ -112,12 +237,35 @@ class RedisClient:
         Returns:
             是否存在
         """
-        try:
-            return await self.redis.exists(key) > 0
-        except Exception as e:
-            print(f"Redis检查键是否存在失败: {e}")
-            return False
+        return await self.redis.exists(key) > 0
     
+    @_redis_op(default=False)
+    async def acquire_lock(self, key: str, expiry: int) -> bool:
+        """
+        尝试获取一个带过期时间的锁（SET NX EX）
+        
+        Args:
+            key: 锁的键
+            expiry: 过期时间（秒）
+        
+        Returns:
+            是否获取成功，锁已被占用时返回False
+        """
+        return bool(await self.redis.set(key, "1", nx=True, ex=expiry))
+    
+    async def release_lock(self, key: str) -> bool:
+        """
+        释放锁
+        
+        Args:
+            key: 锁的键
+        
+        Returns:
+            是否成功
+        """
+        return await self.delete(key)
+    
+    @_redis_op(default=False)
     async def set_conversation_messages(
         self, 
         conversation_id: str, 
@@ -125,7 +273,7 @@ class RedisClient:
         expiry: int = 86400  # 默认1天
     ) -> bool:
         """
-        存储对话消息到Redis
+        存储对话消息到Redis，每条消息是列表中的一个元素
         
         Args:
             conversation_id: 对话ID
@@ -135,9 +283,16 @@ class RedisClient:
         Returns:
             是否成功
         """
-        key = f"conversation:{conversation_id}:messages"
-        return await self.set_json(key, {"messages": messages}, expiry)
+        key = _CONVERSATION_MESSAGES_KEY(conversation_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if messages:
+                pipe.rpush(key, *[dumps_json(message) for message in messages])
+                pipe.expire(key, expiry)
+            await pipe.execute()
+        return True
     
+    @_redis_op(default=list)
     async def get_conversation_messages(self, conversation_id: str) -> List[Dict[str, str]]:
         """
         从Redis获取对话消息
@@ -148,11 +303,19 @@ class RedisClient:
         Returns:
             消息列表，如果不存在则返回空列表
         """
-        key = f"conversation:{conversation_id}:messages"
-        data = await self.get_json(key)
-        if data and "messages" in data:
-            return data["messages"]
-        return []
+        key = _CONVERSATION_MESSAGES_KEY(conversation_id)
+        try:
+            items = await self.redis.lrange(key, 0, -1)
+        except redis.ResponseError as e:
+            # 旧版本以单个JSON字符串缓存对话消息，遇到这种键时直接删除，之后从PostgreSQL重新加载
+            if "WRONGTYPE" not in str(e):
+                raise
+            await self.delete(key)
+            return []
+        if not items:
+            return []
+        # 每条消息都是一个JSON对象，拼接成JSON数组后一次解析，省去逐条调用解析函数的开销
+        return await loads_json_async(b"[" + b",".join(items) + b"]")
     
     async def add_conversation_message(
         self, 
@@ -173,14 +336,59 @@ class RedisClient:
         Returns:
             是否成功
         """
-        messages = await self.get_conversation_messages(conversation_id)
-        messages.append(message)
+        return await self.add_conversation_messages(conversation_id, [message], max_messages, expiry)
+    
+    @_redis_op(default=False)
+    async def add_conversation_messages(
+        self, 
+        conversation_id: str, 
+        messages: List[Dict[str, str]], 
+        max_messages: int = 10,
+        expiry: int = 86400  # 默认1天
+    ) -> bool:
+        """
+        向对话批量添加消息，并保持最大消息数量
+        
+        使用RPUSH追加、LTRIM裁剪，无需读取已有消息，并发写入时也不会丢失更新
+        
+        Args:
+            conversation_id: 对话ID
+            messages: 新消息列表
+            max_messages: 最大消息数量
+            expiry: 过期时间（秒）
+        
+        Returns:
+            是否成功
+        """
+        if not messages:
+            return True
+        
+        key = _CONVERSATION_MESSAGES_KEY(conversation_id)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.rpush(key, *[dumps_json(message) for message in messages])
+                pipe.ltrim(key, -max_messages, -1)
+                pipe.expire(key, expiry)
+                await pipe.execute()
+        except redis.ResponseError as e:
+            # 旧格式的键直接删除，之后的读取会从PostgreSQL重新加载
+            if "WRONGTYPE" not in str(e):
+                raise
+            await self.delete(key)
+            return False
+        return True
+    
+    async def clear_conversation_messages(self, conversation_id: str) -> bool:
+        """
+        删除对话消息缓存
         
-        # 如果超过最大消息数量，删除最早的消息
-        if len(messages) > max_messages:
-            messages = messages[-max_messages:]
+        Args:
+            conversation_id: 对话ID
         
-        return await self.set_conversation_messages(conversation_id, messages, expiry)
+        Returns:
+            是否成功
+        """
+        return await self.delete(_CONVERSATION_MESSAGES_KEY(conversation_id))
     
     async def set_user_memory_cache(
         self, 
@@ -199,7 +407,7 @@ class RedisClient:
         Returns:
             是否成功
         """
-        key = f"user:{user_id}:memory_cache"
+        key = _USER_MEMORY_CACHE_KEY(user_id)
         return await self.set_json(key, memory_data, expiry)
     
     async def get_user_memory_cache(self, user_id: str) -> Optional[Dict[str, Any]]:
@@ -212,18 +420,360 @@ class RedisClient:
         Returns:
             记忆数据，如果不存在则返回None
         """
-        key = f"user:{user_id}:memory_cache"
+        key = _USER_MEMORY_CACHE_KEY(user_id)
         return await self.get_json(key)
     
+    async def set_user_similarity_cache(
+        self, 
+        user_id: str, 
+        entries: List[Dict[str, Any]], 
+        expiry: int = 300  # 默认5分钟
+    ) -> bool:
+        """
+        缓存用户最近的记忆检索结果（以查询向量为键）
+        
+        Args:
+            user_id: 用户ID
+            entries: 缓存条目列表，按从旧到新排列
+            expiry: 过期时间（秒）
+        
+        Returns:
+            是否成功
+        """
+        key = _SIMILARITY_CACHE_KEY(user_id)
+        return await self.set_json(key, {"entries": entries}, expiry)
+    
+    async def get_user_similarity_cache(self, user_id: str) -> List[Dict[str, Any]]:
+        """
+        获取用户最近的记忆检索结果缓存
+        
+        Args:
+            user_id: 用户ID
+        
+        Returns:
+            缓存条目列表，如果不存在则返回空列表
+        """
+        key = _SIMILARITY_CACHE_KEY(user_id)
+        data = await self.get_json(key)
+        if data and "entries" in data:
+            return data["entries"]
+        return []
+    
+    @_redis_op(default=None)
+    async def get_user_search_cache(self, user_id: str, field: str) -> Optional[Dict[str, Any]]:
+        """
+        获取用户某次记忆搜索的缓存结果
+        
+        Args:
+            user_id: 用户ID
+            field: 搜索条件的摘要
+        
+        Returns:
+            缓存的搜索结果，如果不存在则返回None
+        """
+        data = await self.redis.hget(_SEARCH_CACHE_KEY(user_id), field)
+        if data:
+            return await loads_json_async(data)
+        return None
+    
+    @_redis_op(default=False)
+    async def set_user_search_cache(
+        self, 
+        user_id: str, 
+        field: str, 
+        value: Dict[str, Any], 
+        expiry: int = 300  # 默认5分钟
+    ) -> bool:
+        """
+        缓存用户某次记忆搜索的结果
+        
+        同一用户的所有搜索结果保存在一个哈希中，记忆变化时只需删除一个键即可全部失效
+        
+        Args:
+            user_id: 用户ID
+            field: 搜索条件的摘要
+            value: 搜索结果
+            expiry: 整个哈希的过期时间（秒），每次写入时刷新
+        
+        Returns:
+            是否成功
+        """
+        key = _SEARCH_CACHE_KEY(user_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, field, dumps_json(value))
+            pipe.expire(key, expiry)
+            await pipe.execute()
+        return True
+    
+    @_redis_op(default=False)
     async def invalidate_user_memory_cache(self, user_id: str) -> bool:
         """
-        使用户的记忆缓存失效
+        使用户的记忆缓存失效（包括检索结果的相似度缓存和搜索结果缓存）
+        
+        Args:
+            user_id: 用户ID
+        
+        Returns:
+            是否成功
+        """
+        await self.redis.delete(
+            _USER_MEMORY_CACHE_KEY(user_id), _SIMILARITY_CACHE_KEY(user_id), _SEARCH_CACHE_KEY(user_id)
+        )
+        return True
+    
+    @staticmethod
+    def _escape_tag(value: str) -> str:
+        """转义RediSearch TAG查询中的特殊字符"""
+        return re.sub(r"([^\w])", r"\\\1", value)
+    
+    @staticmethod
+    def _semantic_index_name(index: str) -> str:
+        """索引名称带上向量类型，切换类型时使用新的索引，不会与旧格式的数据混用"""
+        return f"{index}_{SEMANTIC_VECTOR_TYPE.lower()}"
+    
+    @staticmethod
+    def _encode_semantic_vector(embedding: List[float]) -> bytes:
+        """
+        将向量归一化后按SEMANTIC_VECTOR_TYPE编码为字节
+        
+        归一化后各分量都在[-1, 1]之间，INT8直接按127缩放，余弦相似度基本不受影响，
+        存储和传输量约为FLOAT32的1/4
+        """
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+        if SEMANTIC_VECTOR_TYPE == "INT8":
+            return np.clip(np.rint(vec * 127), -127, 127).astype(np.int8).tobytes()
+        if SEMANTIC_VECTOR_TYPE == "FLOAT16":
+            return vec.astype(np.float16).tobytes()
+        return vec.tobytes()
+    
+    async def _ensure_semantic_index(self, index: str, dim: int) -> bool:
+        """
+        确保语义缓存的RediSearch索引存在（HNSW向量索引，余弦距离，向量类型为SEMANTIC_VECTOR_TYPE）
+        
+        Args:
+            index: 索引名称
+            dim: 向量维度
+        
+        Returns:
+            是否可用，Redis未加载RediSearch模块时返回False
+        """
+        if index in self._semantic_indexes:
+            return True
+        
+        # 只有启用语义缓存时才需要RediSearch
+        from redis.commands.search.field import TagField, TextField, VectorField
+        from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+        
+        try:
+            await self.redis.ft(index).create_index(
+                [
+                    TagField("user_id"),
+                    TagField("model"),
+                    TextField("response", no_index=True),
+                    VectorField("emb", "HNSW", {
+                        "TYPE": SEMANTIC_VECTOR_TYPE,
+                        "DIM": dim,
+                        "DISTANCE_METRIC": "COSINE"
+                    })
+                ],
+                definition=IndexDefinition(prefix=[f"{index}:"], index_type=IndexType.HASH)
+            )
+        except redis.ResponseError as e:
+            if "Index already exists" not in str(e):
+                logger.error("Redis创建语义缓存索引失败，语义缓存不可用（向量类型%s）: %s", SEMANTIC_VECTOR_TYPE, e)
+                return False
+        
+        self._semantic_indexes.add(index)
+        return True
+    
+    @_redis_op(default=None)
+    async def get_semantic_response(
+        self, 
+        embedding: List[float], 
+        user_id: str,
+        model: str,
+        threshold: float = 0.9,
+        index: str = "semcache"
+    ) -> Optional[str]:
+        """
+        查找与给定向量最相似的已缓存LLM回复
+        
+        Args:
+            embedding: 用户消息的嵌入向量
+            user_id: 用户ID，缓存按用户隔离
+            model: 模型名称，缓存按模型隔离
+            threshold: 命中所需的最小余弦相似度
+            index: 索引名称
+        
+        Returns:
+            缓存的回复，未命中时返回None
+        """
+        from redis.commands.search.query import Query
+        
+        index = self._semantic_index_name(index)
+        if not await self._ensure_semantic_index(index, len(embedding)):
+            return None
+        
+        query = (
+            Query(
+                f"(@user_id:{{{self._escape_tag(user_id)}}} @model:{{{self._escape_tag(model)}}})"
+                "=>[KNN 1 @emb $vec AS score]"
+            )
+            .return_fields("response", "score")
+            .dialect(2)
+        )
+        result = await self.redis.ft(index).search(
+            query,
+            query_params={"vec": self._encode_semantic_vector(embedding)}
+        )
+        if not result.docs:
+            return None
+        
+        # RediSearch返回的是余弦距离
+        doc = result.docs[0]
+        if 1.0 - float(doc.score) >= threshold:
+            return doc.response
+        return None
+    
+    @_redis_op(default=False)
+    async def put_semantic_response(
+        self, 
+        embedding: List[float], 
+        user_id: str,
+        model: str,
+        response: str,
+        expiry: int = 300,  # 默认5分钟
+        index: str = "semcache"
+    ) -> bool:
+        """
+        缓存一条LLM回复，以用户消息的嵌入向量为键
         
         Args:
+            embedding: 用户消息的嵌入向量
             user_id: 用户ID
+            model: 模型名称
+            response: LLM回复
+            expiry: 过期时间（秒）
+            index: 索引名称
+        
+        Returns:
+            是否成功
+        """
+        index = self._semantic_index_name(index)
+        if not await self._ensure_semantic_index(index, len(embedding)):
+            return False
+        
+        key = f"{index}:{uuid.uuid4().hex}"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={
+                "user_id": user_id,
+                "model": model,
+                "response": response,
+                "emb": self._encode_semantic_vector(embedding)
+            })
+            pipe.expire(key, expiry)
+            await pipe.execute()
+        return True
+    
+    @_redis_op(default=None)
+    async def add_to_stream(
+        self, 
+        stream: str, 
+        fields: Dict[str, str], 
+        maxlen: Optional[int] = None
+    ) -> Optional[str]:
+        """
+        向Redis Stream添加一条消息
+        
+        Args:
+            stream: Stream名称
+            fields: 消息字段
+            maxlen: Stream的最大长度（近似裁剪），如果为None则不限制
+        
+        Returns:
+            消息ID，失败时返回None
+        """
+        message_id = await self.redis.xadd(stream, fields, maxlen=maxlen, approximate=True)
+        return message_id.decode()
+    
+    @_redis_op(default=False)
+    async def ensure_stream_group(self, stream: str, group: str) -> bool:
+        """
+        确保Stream的消费者组存在，Stream不存在时自动创建
+        
+        Args:
+            stream: Stream名称
+            group: 消费者组名称
+        
+        Returns:
+            是否成功
+        """
+        try:
+            await self.redis.xgroup_create(stream, group, id="0", mkstream=True)
+            return True
+        except redis.ResponseError as e:
+            # 消费者组已存在
+            if "BUSYGROUP" in str(e):
+                return True
+            raise
+    
+    async def read_stream_group(
+        self, 
+        stream: str, 
+        group: str, 
+        consumer: str, 
+        count: int = 8,
+        block: int = 5000,
+        pending: bool = False
+    ) -> List[tuple]:
+        """
+        以消费者组的方式读取Stream消息
+        
+        Args:
+            stream: Stream名称
+            group: 消费者组名称
+            consumer: 消费者名称
+            count: 每次最多读取的消息数
+            block: 没有新消息时的阻塞时间（毫秒）
+            pending: 是否读取已投递给该消费者但尚未确认的消息
+        
+        Returns:
+            (消息ID, 消息字段)列表
+        """
+        response = await self.redis.xreadgroup(
+            group,
+            consumer,
+            {stream: "0" if pending else ">"},
+            count=count,
+            block=None if pending else block
+        )
+        if not response:
+            return []
+        # 连接池不自动解码，这里将消息ID和字段解码为字符串
+        return [
+            (
+                message_id.decode(),
+                {key.decode(): value.decode() for key, value in fields.items()}
+            )
+            for _, messages in response
+            for message_id, fields in messages
+        ]
+    
+    @_redis_op(default=False)
+    async def ack_stream(self, stream: str, group: str, message_id: str) -> bool:
+        """
+        确认Stream消息已处理完成
+        
+        Args:
+            stream: Stream名称
+            group: 消费者组名称
+            message_id: 消息ID
         
         Returns:
             是否成功
         """
-        key = f"user:{user_id}:memory_cache"
-        return await self.delete(key)
\ No newline at end of file
+        await self.redis.xack(stream, group, message_id)
+        return True
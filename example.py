@@ -11,9 +11,7 @@ from typing import Dict, Any, List, Optional
 load_dotenv()
 
 # 导入必要的模块
-from db.postgres_client import PostgresClient
-from db.redis_client import RedisClient
-from memory.vector_store import VectorStore
+from api.clients import get_postgres, get_redis, get_vector_store
 from memory.short_term import ShortTermMemory
 from memory.long_term import LongTermMemory
 from llm.openai_api import OpenAIClient
@@ -26,7 +24,7 @@ USER_ID = "user-123"
 
 async def setup_database():
     """设置数据库"""
-    postgres_client = PostgresClient()
+    postgres_client = get_postgres()
     
     # 创建数据库表
     await postgres_client.create_tables()
@@ -80,10 +78,10 @@ def get_llm_client():
 
 async def chat_example(user_id):
     """聊天示例"""
-    # 创建客户端
-    redis_client = RedisClient()
-    postgres_client = PostgresClient()
-    vector_store = VectorStore()
+    # 获取共享的客户端，与setup_database使用同一个数据库引擎和连接池
+    redis_client = get_redis()
+    postgres_client = get_postgres()
+    vector_store = get_vector_store()
     llm_client = get_llm_client()
     
     print(f"使用模型: {llm_client.get_model_name()}")
@@ -115,28 +113,26 @@ async def chat_example(user_id):
     print(f"\n用户: {user_message}")
     
     messages.append({"role": "user", "content": user_message})
-    await short_term.add_message(
-        conversation_id=conversation_id,
-        role="user",
-        content=user_message
-    )
     
     # 获取AI回复
     ai_response = await llm_client.generate_chat_response(messages)
     print(f"AI: {ai_response}")
     
+    # 用户消息和AI回复一起保存，同时总结对话并存储为长期记忆（两者互不依赖，并发执行）
     messages.append({"role": "assistant", "content": ai_response})
-    await short_term.add_message(
-        conversation_id=conversation_id,
-        role="assistant",
-        content=ai_response
-    )
-    
-    # 总结对话并存储为长期记忆
-    summary = await long_term.summarize_conversation(
-        conversation_id=conversation_id,
-        user_id=user_id,
-        messages=messages
+    _, summary = await asyncio.gather(
+        short_term.add_messages(
+            conversation_id=conversation_id,
+            messages=[
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": ai_response}
+            ]
+        ),
+        long_term.summarize_conversation(
+            conversation_id=conversation_id,
+            user_id=user_id,
+            messages=messages
+        )
     )
     print(f"\n对话摘要: {json.dumps(summary, ensure_ascii=False, indent=2)}")
     
@@ -145,11 +141,6 @@ async def chat_example(user_id):
     print(f"\n用户: {user_message}")
     
     messages.append({"role": "user", "content": user_message})
-    await short_term.add_message(
-        conversation_id=conversation_id,
-        role="user",
-        content=user_message
-    )
     
     # 获取相关记忆
     memories = await long_term.get_relevant_memories(
@@ -168,19 +159,22 @@ async def chat_example(user_id):
     ai_response = await llm_client.generate_chat_response(messages)
     print(f"AI: {ai_response}")
     
+    # 保存消息的同时更新对话摘要
     messages.append({"role": "assistant", "content": ai_response})
-    await short_term.add_message(
-        conversation_id=conversation_id,
-        role="assistant",
-        content=ai_response
-    )
-    
-    # 更新对话摘要
-    summary = await long_term.summarize_conversation(
-        conversation_id=conversation_id,
-        user_id=user_id,
-        messages=messages,
-        existing_summary=summary
+    _, summary = await asyncio.gather(
+        short_term.add_messages(
+            conversation_id=conversation_id,
+            messages=[
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": ai_response}
+            ]
+        ),
+        long_term.summarize_conversation(
+            conversation_id=conversation_id,
+            user_id=user_id,
+            messages=messages,
+            existing_summary=summary
+        )
     )
     
     # 手动添加记忆
@@ -204,16 +198,18 @@ async def chat_example(user_id):
     messages = [{"role": "system", "content": system_message}]
     
     messages.append({"role": "user", "content": user_message})
-    await short_term.add_message(
-        conversation_id=conversation_id,
-        role="user",
-        content=user_message
-    )
     
-    # 获取相关记忆
-    memories = await long_term.get_relevant_memories(
-        user_id=user_id,
-        context=user_message
+    # 保存用户消息的同时获取相关记忆
+    _, memories = await asyncio.gather(
+        short_term.add_message(
+            conversation_id=conversation_id,
+            role="user",
+            content=user_message
+        ),
+        long_term.get_relevant_memories(
+            user_id=user_id,
+            context=user_message
+        )
     )
     
     if memories:
@@ -235,10 +231,6 @@ async def chat_example(user_id):
     )
     
     print(f"搜索结果: {json.dumps([{'content': mem['content'],'relevance': mem.get('relevance', 0)} for mem in search_results], ensure_ascii=False, indent=2)}")
-    
-    # 关闭连接
-    await redis_client.close()
-    await postgres_client.close()
 
 async def main():
     """主函数"""
@@ -247,6 +239,10 @@ async def main():
     
     # 运行聊天示例
     await chat_example(user_id)
+    
+    # 关闭连接
+    await get_redis().close()
+    await get_postgres().close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -1,11 +1,15 @@
 import os
 import anthropic
-from typing import List, Dict, Any, Optional, Union
-import asyncio
+from typing import List, Dict, Any, Optional, Union, AsyncIterator
 import re
+import logging
 from utils.token_counter import count_tokens
 
-from llm.base import BaseLLM
+from llm.cache import response_cache
+from llm.base import BaseLLM, ERROR_RESPONSE_PREFIX
+from llm.rate_limit import RateLimiter, sdk_max_retries
+
+logger = logging.getLogger(__name__)
 
 class AnthropicClient(BaseLLM):
     """Anthropic API客户端"""
@@ -24,8 +28,14 @@ class AnthropicClient(BaseLLM):
         
         self.model = model or os.getenv("ANTHROPIC_MODEL", "claude-2")
         
+        # Claude-3模型使用messages API，其他模型使用completions API
+        self._is_claude3 = self.model.startswith("claude-3")
+        
+        # 按ANTHROPIC_RPM限制发送请求的速率，收到429时自动降速
+        self._limiter = RateLimiter.from_env("ANTHROPIC")
         # 设置Anthropic客户端
-        self.client = anthropic.AsyncAnthropic(api_key=self.api_key)
+        # 网络错误、限流和服务端错误的重试：启用限流时由限流器重试，每次重试都获取令牌，否则由SDK自动重试
+        self.client = anthropic.AsyncAnthropic(api_key=self.api_key, max_retries=sdk_max_retries(self._limiter))
         
         # 模型上下文窗口大小
         self.context_sizes = {
@@ -35,6 +45,8 @@ class AnthropicClient(BaseLLM):
             "claude-3-sonnet-20240229": 200000,
             "claude-3-haiku-20240307": 200000
         }
+        # 模型在初始化后不再变化，上下文窗口大小只需查找一次；未知模型默认为100000
+        self._context_size = self.context_sizes.get(self.model, 100000)
     
     async def generate_text(
         self, 
@@ -57,8 +69,10 @@ class AnthropicClient(BaseLLM):
         Returns:
             生成的文本
         """
+        # 临时错误按指数退避重试（见RateLimiter.call）
         try:
-            response = await self.client.completions.create(
+            response = await self._limiter.call(
+                self.client.completions.create,
                 model=self.model,
                 prompt=f"{anthropic.HUMAN_PROMPT} {prompt}{anthropic.AI_PROMPT}",
                 max_tokens_to_sample=max_tokens or 1000,
@@ -69,23 +83,8 @@ class AnthropicClient(BaseLLM):
             
             return response.completion
         except Exception as e:
-            print(f"Anthropic API调用失败: {e}")
-            # 重试一次
-            try:
-                await asyncio.sleep(1)  # 等待1秒后重试
-                response = await self.client.completions.create(
-                    model=self.model,
-                    prompt=f"{anthropic.HUMAN_PROMPT} {prompt}{anthropic.AI_PROMPT}",
-                    max_tokens_to_sample=max_tokens or 1000,
-                    temperature=temperature,
-                    top_p=top_p,
-                    stop_sequences=stop or []
-                )
-                
-                return response.completion
-            except Exception as e:
-                print(f"Anthropic API重试失败: {e}")
-                return f"抱歉，我遇到了一些问题，无法生成回复。错误: {str(e)}"
+            logger.warning("Anthropic API调用失败: %s", e)
+            return f"{ERROR_RESPONSE_PREFIX}错误: {str(e)}"
     
     async def generate_chat_response(
         self, 
@@ -93,7 +92,8 @@ class AnthropicClient(BaseLLM):
         max_tokens: Optional[int] = None,
         temperature: float = 0.7,
         top_p: float = 1.0,
-        stop: Optional[List[str]] = None
+        stop: Optional[List[str]] = None,
+        cache: Optional[bool] = None
     ) -> str:
         """
         生成聊天回复
@@ -104,110 +104,128 @@ class AnthropicClient(BaseLLM):
             temperature: 温度参数，控制随机性
             top_p: 核采样参数
             stop: 停止生成的标记列表
+            cache: 是否使用进程内的回复缓存，如果为None则只在temperature为0时使用
         
         Returns:
             生成的回复文本
         """
-        # 将消息列表转换为Anthropic格式
-        prompt = ""
-        for message in messages:
-            role = message["role"]
-            content = message["content"]
-            
-            if role == "user":
-                prompt += f"{anthropic.HUMAN_PROMPT} {content} "
-            elif role == "assistant":
-                prompt += f"{anthropic.AI_PROMPT} {content} "
-            elif role == "system":
-                # 系统消息放在开头
-                prompt = f"{content} " + prompt
-        
-        # 添加最后的AI提示
-        prompt += anthropic.AI_PROMPT
+        # 命中回复缓存时直接返回
+        cache_key = self._response_cache_key(messages, max_tokens, temperature, top_p, stop, cache)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
+        # 临时错误按指数退避重试（见RateLimiter.call）
         try:
             # 对于较新的Claude-3模型，使用messages API
-            if self.model.startswith("claude-3"):
-                # 转换为Claude-3消息格式
-                claude_messages = []
-                for message in messages:
-                    role = message["role"]
-                    content = message["content"]
-                    
-                    if role == "user":
-                        claude_messages.append({"role": "user", "content": content})
-                    elif role == "assistant":
-                        claude_messages.append({"role": "assistant", "content": content})
-                    elif role == "system":
-                        claude_messages.append({"role": "system", "content": content})
-                
-                response = await self.client.messages.create(
+            if self._is_claude3:
+                response = await self._limiter.call(
+                    self.client.messages.create,
                     model=self.model,
-                    messages=claude_messages,
+                    messages=self._to_claude3_messages(messages),
                     max_tokens=max_tokens or 1000,
                     temperature=temperature,
                     top_p=top_p,
                     stop_sequences=stop or []
                 )
                 
-                return response.content[0].text
+                text = response.content[0].text
             else:
                 # 对于旧版Claude模型，使用completions API
-                response = await self.client.completions.create(
+                response = await self._limiter.call(
+                    self.client.completions.create,
                     model=self.model,
-                    prompt=prompt,
+                    prompt=self._to_legacy_prompt(messages),
                     max_tokens_to_sample=max_tokens or 1000,
                     temperature=temperature,
                     top_p=top_p,
                     stop_sequences=stop or []
                 )
                 
-                return response.completion
+                text = response.completion
+            
+            response_cache.set(cache_key, text)
+            return text
+        except Exception as e:
+            logger.warning("Anthropic API调用失败: %s", e)
+            return f"{ERROR_RESPONSE_PREFIX}错误: {str(e)}"
+    
+    async def generate_chat_response_stream(
+        self, 
+        messages: List[Dict[str, str]], 
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        stop: Optional[List[str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        以流的形式生成聊天回复，收到增量内容后立即返回
+        
+        命中回复缓存时直接返回缓存的完整回复
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+            max_tokens: 生成的最大token数
+            temperature: 温度参数，控制随机性
+            top_p: 核采样参数
+            stop: 停止生成的标记列表
+        
+        Yields:
+            回复文本片段
+        """
+        cache_key = self._response_cache_key(messages, max_tokens, temperature, top_p, stop, None)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        try:
+            if self._is_claude3:
+                stream = await self._limiter.call(
+                    self.client.messages.create,
+                    model=self.model,
+                    messages=self._to_claude3_messages(messages),
+                    max_tokens=max_tokens or 1000,
+                    temperature=temperature,
+                    top_p=top_p,
+                    stop_sequences=stop or [],
+                    stream=True
+                )
+                
+                async for event in stream:
+                    # 只有content_block_delta事件携带文本增量
+                    if event.type != "content_block_delta":
+                        continue
+                    text = getattr(event.delta, "text", None)
+                    if text:
+                        chunks.append(text)
+                        yield text
+            else:
+                stream = await self._limiter.call(
+                    self.client.completions.create,
+                    model=self.model,
+                    prompt=self._to_legacy_prompt(messages),
+                    max_tokens_to_sample=max_tokens or 1000,
+                    temperature=temperature,
+                    top_p=top_p,
+                    stop_sequences=stop or [],
+                    stream=True
+                )
+                
+                async for completion in stream:
+                    if completion.completion:
+                        chunks.append(completion.completion)
+                        yield completion.completion
+            
+            response_cache.set(cache_key, "".join(chunks))
         except Exception as e:
-            print(f"Anthropic API调用失败: {e}")
-            # 重试一次
-            try:
-                await asyncio.sleep(1)  # 等待1秒后重试
-                if self.model.startswith("claude-3"):
-                    # 转换为Claude-3消息格式
-                    claude_messages = []
-                    for message in messages:
-                        role = message["role"]
-                        content = message["content"]
-                        
-                        if role == "user":
-                            claude_messages.append({"role": "user", "content": content})
-                        elif role == "assistant":
-                            claude_messages.append({"role": "assistant", "content": content})
-                        elif role == "system":
-                            claude_messages.append({"role": "system", "content": content})
-                    
-                    response = await self.client.messages.create(
-                        model=self.model,
-                        messages=claude_messages,
-                        max_tokens=max_tokens or 1000,
-                        temperature=temperature,
-                        top_p=top_p,
-                        stop_sequences=stop or []
-                    )
-                    
-                    return response.content[0].text
-                else:
-                    response = await self.client.completions.create(
-                        model=self.model,
-                        prompt=prompt,
-                        max_tokens_to_sample=max_tokens or 1000,
-                        temperature=temperature,
-                        top_p=top_p,
-                        stop_sequences=stop or []
-                    )
-                    
-                    return response.completion
-            except Exception as e:
-                print(f"Anthropic API重试失败: {e}")
-                return f"抱歉，我遇到了一些问题，无法生成回复。错误: {str(e)}"
+            logger.warning("Anthropic API流式调用失败: %s", e)
+            # 已经输出部分内容时直接结束，否则返回与非流式调用一致的错误提示
+            if not chunks:
+                yield f"{ERROR_RESPONSE_PREFIX}错误: {str(e)}"
     
-    async def count_tokens(self, text: str) -> int:
+    def count_tokens_sync(self, text: str) -> int:
         """
         计算文本的token数量
         
@@ -220,31 +238,79 @@ class AnthropicClient(BaseLLM):
         # Anthropic没有官方的token计数器，使用tiktoken的cl100k_base作为近似
         return count_tokens(text, "cl100k_base")
     
-    async def count_messages_tokens(self, messages: List[Dict[str, str]]) -> int:
+    # Claude消息中支持的角色
+    _CLAUDE_ROLES = frozenset(("user", "assistant", "system"))
+    
+    @classmethod
+    def _to_claude3_messages(cls, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
         """
-        计算消息列表的token数量
+        转换为Claude-3 messages API的消息格式
         
         Args:
-            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+            messages: 消息列表
         
         Returns:
-            token数量
+            Claude-3格式的消息列表
+        """
+        return [
+            {"role": message["role"], "content": message["content"]}
+            for message in messages
+            if message["role"] in cls._CLAUDE_ROLES
+        ]
+    
+    @staticmethod
+    def _to_legacy_prompt(messages: List[Dict[str, str]]) -> str:
+        """
+        转换为旧版completions API的提示文本，系统消息放在开头
+        
+        Args:
+            messages: 消息列表
+        
+        Returns:
+            提示文本
         """
-        # 将消息列表转换为文本
-        text = ""
+        # 提示标记在循环外绑定为局部变量，避免每条消息都查找模块属性
+        human_prompt = anthropic.HUMAN_PROMPT
+        ai_prompt = anthropic.AI_PROMPT
+        
+        system_parts = []
+        dialog_parts = []
         for message in messages:
             role = message["role"]
             content = message["content"]
             
             if role == "user":
-                text += f"Human: {content}\n"
+                dialog_parts.append(f"{human_prompt} {content} ")
             elif role == "assistant":
-                text += f"Assistant: {content}\n"
+                dialog_parts.append(f"{ai_prompt} {content} ")
             elif role == "system":
-                text += f"System: {content}\n"
+                system_parts.append(f"{content} ")
+        
+        # 后出现的系统消息在前，与逐条插入到开头的顺序一致；最后添加AI提示
+        return "".join(reversed(system_parts)) + "".join(dialog_parts) + ai_prompt
+    
+    # 计算token数量时每条消息的角色前缀
+    _ROLE_PREFIXES = {"user": "Human", "assistant": "Assistant", "system": "System"}
+    
+    def count_messages_tokens_sync(self, messages: List[Dict[str, str]]) -> int:
+        """
+        计算消息列表的token数量
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+        
+        Returns:
+            token数量
+        """
+        # 逐条计算每条消息的token数量并求和，单条消息的结果会被缓存，
+        # 对话增加新消息时只需编码新消息，无需重新拼接并编码整个历史
+        num_tokens = 0
+        for message in messages:
+            prefix = self._ROLE_PREFIXES.get(message["role"])
+            if prefix:
+                num_tokens += count_tokens(f"{prefix}: {message['content']}\n", "cl100k_base")
         
-        # 计算token数量
-        return await self.count_tokens(text)
+        return num_tokens
     
     def get_model_name(self) -> str:
         """
@@ -262,4 +328,4 @@ class AnthropicClient(BaseLLM):
         Returns:
             上下文窗口大小（token数）
         """
-        return self.context_sizes.get(self.model, 100000)  # 默认为100000
\ No newline at end of file
+        return self._context_size
\ No newline at end of file
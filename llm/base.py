@@ -1,5 +1,36 @@
+import os
+import asyncio
+import importlib.util
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, AsyncIterator
+
+from llm.cache import response_cache
+from utils.token_counter import run_in_tokenizer_pool, TOKENIZER_OFFLOAD_CHARS
+
+# 每个客户端共享的HTTP连接池大小
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+
+# 批量生成时同时进行的请求数
+LLM_BATCH_CONCURRENCY = int(os.getenv("LLM_BATCH_CONCURRENCY", "8"))
+
+# 是否启用HTTP/2，多个并发请求可以复用同一个连接；需要安装h2（httpx[http2]），未安装时使用HTTP/1.1
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+
+# 调用失败时返回给用户的回复前缀，组合多个客户端时据此判断底层客户端是否调用失败
+ERROR_RESPONSE_PREFIX = "抱歉，我遇到了一些问题，无法生成回复。"
+
+def is_error_response(text: str) -> bool:
+    """
+    判断回复是否为客户端调用失败时返回的错误提示
+    
+    Args:
+        text: 回复文本
+    
+    Returns:
+        是否为错误提示
+    """
+    return text.startswith(ERROR_RESPONSE_PREFIX)
 
 class BaseLLM(ABC):
     """大型语言模型的基础接口"""
@@ -35,7 +66,8 @@ class BaseLLM(ABC):
         max_tokens: Optional[int] = None,
         temperature: float = 0.7,
         top_p: float = 1.0,
-        stop: Optional[List[str]] = None
+        stop: Optional[List[str]] = None,
+        cache: Optional[bool] = None
     ) -> str:
         """
         生成聊天回复
@@ -46,16 +78,122 @@ class BaseLLM(ABC):
             temperature: 温度参数，控制随机性
             top_p: 核采样参数
             stop: 停止生成的标记列表
+            cache: 是否使用进程内的回复缓存，如果为None则只在temperature为0时使用
         
         Returns:
             生成的回复文本
         """
         pass
     
+    async def generate_chat_response_stream(
+        self, 
+        messages: List[Dict[str, str]], 
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        stop: Optional[List[str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        以流的形式生成聊天回复
+        
+        默认实现等待完整回复后一次性返回，支持流式输出的客户端可以重写此方法
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+            max_tokens: 生成的最大token数
+            temperature: 温度参数，控制随机性
+            top_p: 核采样参数
+            stop: 停止生成的标记列表
+        
+        Yields:
+            回复文本片段
+        """
+        yield await self.generate_chat_response(
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stop=stop
+        )
+    
+    async def generate_chat_responses(
+        self,
+        messages_list: List[List[Dict[str, str]]],
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        stop: Optional[List[str]] = None,
+        max_concurrency: Optional[int] = None
+    ) -> List[str]:
+        """
+        批量生成多个对话的回复
+        
+        各个请求在有界并发下同时发出，通过共享的连接池（HTTP/2时为同一个连接）复用连接，
+        总耗时接近最慢的一个请求而不是所有请求之和
+        
+        Args:
+            messages_list: 多个对话的消息列表
+            max_tokens: 生成的最大token数
+            temperature: 温度参数，控制随机性
+            top_p: 核采样参数
+            stop: 停止生成的标记列表
+            max_concurrency: 最大并发请求数，如果为None则从环境变量获取
+        
+        Returns:
+            与输入一一对应的回复文本列表
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or LLM_BATCH_CONCURRENCY)
+        
+        async def generate(messages: List[Dict[str, str]]) -> str:
+            async with semaphore:
+                return await self.generate_chat_response(
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=top_p,
+                    stop=stop
+                )
+        
+        return await asyncio.gather(*(generate(messages) for messages in messages_list))
+    
+    def _response_cache_key(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int],
+        temperature: float,
+        top_p: float,
+        stop: Optional[List[str]],
+        cache: Optional[bool]
+    ) -> Optional[bytes]:
+        """
+        生成本次请求的回复缓存键，不使用缓存时返回None
+        
+        未指定cache时只缓存temperature为0的确定性请求，避免返回重复的随机采样结果
+        """
+        if not response_cache.enabled:
+            return None
+        if cache is None:
+            cache = temperature == 0
+        if not cache:
+            return None
+        return response_cache.make_key(
+            type(self).__name__, self.get_model_name(), messages, max_tokens, temperature, top_p, stop
+        )
+    
+    async def aclose(self):
+        """释放客户端持有的连接，默认不做任何操作，持有共享HTTP客户端的子类需要重写此方法"""
+        pass
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+    
     @abstractmethod
-    async def count_tokens(self, text: str) -> int:
+    def count_tokens_sync(self, text: str) -> int:
         """
-        计算文本的token数量
+        计算文本的token数量（同步版本，适合短文本）
         
         Args:
             text: 要计算的文本
@@ -66,9 +204,9 @@ class BaseLLM(ABC):
         pass
     
     @abstractmethod
-    async def count_messages_tokens(self, messages: List[Dict[str, str]]) -> int:
+    def count_messages_tokens_sync(self, messages: List[Dict[str, str]]) -> int:
         """
-        计算消息列表的token数量
+        计算消息列表的token数量（同步版本，适合短对话）
         
         Args:
             messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
@@ -78,6 +216,60 @@ class BaseLLM(ABC):
         """
         pass
     
+    async def count_tokens(self, text: str) -> int:
+        """
+        计算文本的token数量，长文本放到分词线程池中计算以免阻塞事件循环
+        
+        Args:
+            text: 要计算的文本
+        
+        Returns:
+            token数量
+        """
+        if len(text) <= TOKENIZER_OFFLOAD_CHARS:
+            return self.count_tokens_sync(text)
+        return await run_in_tokenizer_pool(self.count_tokens_sync, text)
+    
+    def count_tokens_batch_sync(self, texts: List[str]) -> List[int]:
+        """
+        批量计算多段文本的token数量（同步版本）
+        
+        Args:
+            texts: 文本列表
+        
+        Returns:
+            与文本一一对应的token数量列表
+        """
+        return [self.count_tokens_sync(text) for text in texts]
+    
+    async def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """
+        批量计算多段文本的token数量，总长度较长时放到分词线程池中计算以免阻塞事件循环
+        
+        Args:
+            texts: 文本列表
+        
+        Returns:
+            与文本一一对应的token数量列表
+        """
+        if sum(len(text) for text in texts) <= TOKENIZER_OFFLOAD_CHARS:
+            return self.count_tokens_batch_sync(texts)
+        return await run_in_tokenizer_pool(self.count_tokens_batch_sync, texts)
+    
+    async def count_messages_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """
+        计算消息列表的token数量，总长度较长时放到分词线程池中计算以免阻塞事件循环
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+        
+        Returns:
+            token数量
+        """
+        if sum(len(message["content"]) for message in messages) <= TOKENIZER_OFFLOAD_CHARS:
+            return self.count_messages_tokens_sync(messages)
+        return await run_in_tokenizer_pool(self.count_messages_tokens_sync, messages)
+    
     @abstractmethod
     def get_model_name(self) -> str:
         """
@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# 回复缓存配置
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "4096"))  # 最多缓存的回复数量
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))  # 缓存回复的有效期（秒）
+
+class ResponseCache:
+    """
+    进程内的LLM回复缓存，按(客户端, 模型, 消息, 生成参数)精确匹配
+
+    使用LRU淘汰并为每条回复设置有效期。所有操作都是同步的，
+    在事件循环中执行时不会被其他协程打断，因此无需加锁
+    """
+
+    def __init__(self, maxsize: int = LLM_CACHE_SIZE, ttl: int = LLM_CACHE_TTL, enabled: bool = LLM_CACHE_ENABLED):
+        """
+        初始化回复缓存
+
+        Args:
+            maxsize: 最多缓存的回复数量
+            ttl: 缓存回复的有效期（秒）
+            enabled: 是否启用缓存
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries: "OrderedDict[bytes, Tuple[float, str]]" = OrderedDict()
+
+    @staticmethod
+    def make_key(
+        client: str,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int],
+        temperature: float,
+        top_p: float,
+        stop: Optional[List[str]]
+    ) -> bytes:
+        """
+        根据请求内容生成稳定的缓存键
+
+        Returns:
+            16字节的blake2b摘要
+        """
+        payload = {
+            "client": client,
+            "model": model,
+            "messages": [[message["role"], message["content"]] for message in messages],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "stop": list(stop or ())
+        }
+        data = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def get(self, key: Optional[bytes]) -> Optional[str]:
+        """
+        获取缓存的回复
+
+        Args:
+            key: 缓存键，为None时直接返回None
+
+        Returns:
+            缓存的回复，未命中或已过期时返回None
+        """
+        if key is None:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return response
+
+    def set(self, key: Optional[bytes], response: str):
+        """
+        缓存一条回复，超过容量时淘汰最久未使用的回复
+
+        Args:
+            key: 缓存键，为None时不做任何操作
+            response: 回复文本
+        """
+        if key is None:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        self._entries.clear()
+
+# 所有LLM客户端共享的回复缓存
+response_cache = ResponseCache()
@@ -0,0 +1,420 @@
+import os
+import time
+import asyncio
+import logging
+from typing import List, Dict, Optional, Union, AsyncIterator, Awaitable, Callable
+
+from llm.base import BaseLLM, is_error_response
+
+logger = logging.getLogger(__name__)
+
+# 连接池中每个客户端同时进行的请求数
+LLM_POOL_CONCURRENCY = int(os.getenv("LLM_POOL_CONCURRENCY", "16"))
+
+class _MultiClient(BaseLLM):
+    """组合多个LLM客户端的基类，token计数交给第一个客户端处理"""
+
+    def __init__(self, clients: List[BaseLLM]):
+        """
+        初始化组合客户端
+
+        Args:
+            clients: 底层LLM客户端列表，第一个客户端用于token计数
+        """
+        if not clients:
+            raise ValueError("至少需要一个LLM客户端")
+
+        self.clients = list(clients)
+
+    async def generate_chat_response_stream(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        stop: Optional[List[str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        以流的形式生成聊天回复，按顺序尝试各个客户端
+
+        流一旦开始输出就无法切换，因此只在客户端第一个片段就是错误提示时才尝试下一个客户端
+
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+            max_tokens: 生成的最大token数
+            temperature: 温度参数，控制随机性
+            top_p: 核采样参数
+            stop: 停止生成的标记列表
+
+        Yields:
+            回复文本片段
+        """
+        error_chunk = None
+        for client in self._stream_order():
+            stream = client.generate_chat_response_stream(
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                stop=stop
+            )
+            started = False
+            try:
+                async for chunk in stream:
+                    if not started and is_error_response(chunk):
+                        error_chunk = chunk
+                        break
+                    started = True
+                    yield chunk
+            finally:
+                await stream.aclose()
+
+            if started:
+                return
+            logger.warning("%s流式调用失败，切换到下一个客户端", client.get_model_name())
+
+        if error_chunk is not None:
+            yield error_chunk
+
+    def _stream_order(self) -> List[BaseLLM]:
+        """
+        获取流式调用时尝试客户端的顺序
+
+        Returns:
+            客户端列表
+        """
+        return self.clients
+
+    async def aclose(self):
+        """关闭所有底层客户端"""
+        await asyncio.gather(*(client.aclose() for client in self.clients))
+
+    def count_tokens_sync(self, text: str) -> int:
+        """
+        计算文本的token数量
+
+        Args:
+            text: 要计算的文本
+
+        Returns:
+            token数量
+        """
+        return self.clients[0].count_tokens_sync(text)
+
+    def count_messages_tokens_sync(self, messages: List[Dict[str, str]]) -> int:
+        """
+        计算消息列表的token数量
+
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+
+        Returns:
+            token数量
+        """
+        return self.clients[0].count_messages_tokens_sync(messages)
+
+    def get_model_name(self) -> str:
+        """
+        获取模型名称
+
+        Returns:
+            以逗号分隔的所有底层模型名称
+        """
+        return ",".join(client.get_model_name() for client in self.clients)
+
+    def get_model_context_size(self) -> int:
+        """
+        获取模型上下文窗口大小
+
+        Returns:
+            所有底层模型中最小的上下文窗口大小，保证提示对任何一个客户端都不会超长
+        """
+        return min(client.get_model_context_size() for client in self.clients)
+
+class RaceClient(_MultiClient):
+    """
+    同时向所有客户端发送请求，使用最先成功返回的回复并取消其余请求
+
+    以更多的API调用换取更低的尾延迟，适合对响应时间敏感的场景
+    """
+
+    async def _race(self, call: Callable[[BaseLLM], Awaitable[str]]) -> str:
+        """
+        同时调用所有客户端，返回最先成功的结果
+
+        Args:
+            call: 接收客户端并发起调用的函数
+
+        Returns:
+            最先成功的结果，全部失败时返回最后一个错误提示
+        """
+        tasks = [asyncio.create_task(call(client)) for client in self.clients]
+        result = None
+        last_error = None
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                success = None
+                for task in done:
+                    error = task.exception()
+                    if error is not None:
+                        last_error = error
+                        logger.warning("LLM客户端调用失败: %s", error)
+                        continue
+                    result = task.result()
+                    if success is None and not is_error_response(result):
+                        success = result
+
+                if success is not None:
+                    return success
+        finally:
+            # 取消仍在进行的请求
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        if result is None:
+            raise last_error
+        return result
+
+    async def generate_text(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        stop: Optional[List[str]] = None
+    ) -> str:
+        """
+        生成文本
+
+        Args:
+            prompt: 提示文本
+            max_tokens: 生成的最大token数
+            temperature: 温度参数，控制随机性
+            top_p: 核采样参数
+            stop: 停止生成的标记列表
+
+        Returns:
+            生成的文本
+        """
+        return await self._race(lambda client: client.generate_text(
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stop=stop
+        ))
+
+    async def generate_chat_response(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        stop: Optional[List[str]] = None,
+        cache: Optional[bool] = None
+    ) -> str:
+        """
+        生成聊天回复
+
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+            max_tokens: 生成的最大token数
+            temperature: 温度参数，控制随机性
+            top_p: 核采样参数
+            stop: 停止生成的标记列表
+            cache: 是否使用进程内的回复缓存，如果为None则只在temperature为0时使用
+
+        Returns:
+            生成的回复文本
+        """
+        return await self._race(lambda client: client.generate_chat_response(
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stop=stop,
+            cache=cache
+        ))
+
+class PoolClient(_MultiClient):
+    """
+    在多个客户端之间分配请求，并在客户端失败时自动切换到下一个
+
+    每个客户端有独立的并发上限，按延迟的指数移动平均的倒数加权轮询，
+    响应越快的客户端分到的请求越多；并发已满的客户端排在后面
+    """
+
+    def __init__(
+        self,
+        clients: List[BaseLLM],
+        concurrency_limits: Optional[Union[int, List[int]]] = None,
+        ewma_alpha: float = 0.2,
+        failure_penalty: float = 10.0
+    ):
+        """
+        初始化连接池客户端
+
+        Args:
+            clients: 底层LLM客户端列表，第一个客户端用于token计数
+            concurrency_limits: 每个客户端同时进行的请求数，可以是统一的数值或与客户端一一对应的列表，
+                如果为None则从环境变量获取
+            ewma_alpha: 延迟移动平均的平滑系数
+            failure_penalty: 调用失败时计入的延迟（秒），失败的客户端会分到更少的请求
+        """
+        super().__init__(clients)
+
+        limits = concurrency_limits or LLM_POOL_CONCURRENCY
+        if isinstance(limits, int):
+            limits = [limits] * len(self.clients)
+        if len(limits) != len(self.clients):
+            raise ValueError("并发上限的数量与客户端数量不一致")
+
+        self.ewma_alpha = ewma_alpha
+        self.failure_penalty = failure_penalty
+        self._semaphores = [asyncio.Semaphore(limit) for limit in limits]
+        # 尚未调用过的客户端按1秒估计延迟
+        self._latency = [1.0] * len(self.clients)
+        self._current_weights = [0.0] * len(self.clients)
+
+    def _ordered_indexes(self) -> List[int]:
+        """
+        按平滑加权轮询选出首选客户端，其余客户端按延迟从低到高排列作为备选
+
+        Returns:
+            客户端下标列表
+        """
+        weights = [1.0 / latency for latency in self._latency]
+        for index, weight in enumerate(weights):
+            self._current_weights[index] += weight
+
+        best = max(range(len(self.clients)), key=self._current_weights.__getitem__)
+        self._current_weights[best] -= sum(weights)
+
+        fallbacks = sorted(
+            (index for index in range(len(self.clients)) if index != best),
+            key=self._latency.__getitem__
+        )
+        # 稳定排序，并发已满的客户端移到最后
+        return sorted([best] + fallbacks, key=lambda index: self._semaphores[index].locked())
+
+    def _stream_order(self) -> List[BaseLLM]:
+        """
+        获取流式调用时尝试客户端的顺序
+
+        Returns:
+            客户端列表
+        """
+        return [self.clients[index] for index in self._ordered_indexes()]
+
+    def _record(self, index: int, elapsed: float, ok: bool):
+        """
+        更新客户端的延迟移动平均
+
+        Args:
+            index: 客户端下标
+            elapsed: 本次调用耗时（秒）
+            ok: 本次调用是否成功
+        """
+        sample = elapsed if ok else max(elapsed, self.failure_penalty)
+        self._latency[index] += self.ewma_alpha * (sample - self._latency[index])
+
+    async def _failover(self, call: Callable[[BaseLLM], Awaitable[str]]) -> str:
+        """
+        依次尝试各个客户端，直到有一个调用成功
+
+        Args:
+            call: 接收客户端并发起调用的函数
+
+        Returns:
+            第一个成功的结果，全部失败时返回最后一个错误提示
+        """
+        result = None
+        last_error = None
+        for index in self._ordered_indexes():
+            client = self.clients[index]
+            async with self._semaphores[index]:
+                start = time.monotonic()
+                try:
+                    text = await call(client)
+                except Exception as e:
+                    self._record(index, time.monotonic() - start, False)
+                    last_error = e
+                    logger.warning("%s调用失败，切换到下一个客户端: %s", client.get_model_name(), e)
+                    continue
+
+            ok = not is_error_response(text)
+            self._record(index, time.monotonic() - start, ok)
+            if ok:
+                return text
+
+            result = text
+            logger.warning("%s调用失败，切换到下一个客户端", client.get_model_name())
+
+        if result is None:
+            raise last_error
+        return result
+
+    async def generate_text(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        stop: Optional[List[str]] = None
+    ) -> str:
+        """
+        生成文本
+
+        Args:
+            prompt: 提示文本
+            max_tokens: 生成的最大token数
+            temperature: 温度参数，控制随机性
+            top_p: 核采样参数
+            stop: 停止生成的标记列表
+
+        Returns:
+            生成的文本
+        """
+        return await self._failover(lambda client: client.generate_text(
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stop=stop
+        ))
+
+    async def generate_chat_response(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        stop: Optional[List[str]] = None,
+        cache: Optional[bool] = None
+    ) -> str:
+        """
+        生成聊天回复
+
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+            max_tokens: 生成的最大token数
+            temperature: 温度参数，控制随机性
+            top_p: 核采样参数
+            stop: 停止生成的标记列表
+            cache: 是否使用进程内的回复缓存，如果为None则只在temperature为0时使用
+
+        Returns:
+            生成的回复文本
+        """
+        return await self._failover(lambda client: client.generate_chat_response(
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stop=stop,
+            cache=cache
+        ))
@@ -1,10 +1,14 @@
 import os
 import openai
-from typing import List, Dict, Any, Optional, Union
-import asyncio
+from typing import List, Dict, Any, Optional, Union, AsyncIterator
+import logging
 from utils.token_counter import count_tokens, count_messages_tokens
 
-from llm.base import BaseLLM
+from llm.cache import response_cache
+from llm.base import BaseLLM, ERROR_RESPONSE_PREFIX
+from llm.rate_limit import RateLimiter, sdk_max_retries
+
+logger = logging.getLogger(__name__)
 
 class OpenAIClient(BaseLLM):
     """OpenAI API客户端"""
@@ -23,8 +27,11 @@ class OpenAIClient(BaseLLM):
         
         self.model = model or os.getenv("OPENAI_MODEL", "gpt-4")
         
+        # 按OPENAI_RPM限制发送请求的速率，收到429时自动降速
+        self._limiter = RateLimiter.from_env("OPENAI")
         # 设置OpenAI客户端
-        self.client = openai.AsyncOpenAI(api_key=self.api_key)
+        # 网络错误、限流和服务端错误的重试：启用限流时由限流器重试，每次重试都获取令牌，否则由SDK自动重试
+        self.client = openai.AsyncOpenAI(api_key=self.api_key, max_retries=sdk_max_retries(self._limiter))
         
         # 模型上下文窗口大小
         self.context_sizes = {
@@ -35,6 +42,8 @@ class OpenAIClient(BaseLLM):
             "gpt-4-turbo": 128000,
             "gpt-4o": 128000
         }
+        # 模型在初始化后不再变化，上下文窗口大小只需查找一次；未知模型默认为4096
+        self._context_size = self.context_sizes.get(self.model, 4096)
     
     async def generate_text(
         self, 
@@ -72,7 +81,8 @@ class OpenAIClient(BaseLLM):
         max_tokens: Optional[int] = None,
         temperature: float = 0.7,
         top_p: float = 1.0,
-        stop: Optional[List[str]] = None
+        stop: Optional[List[str]] = None,
+        cache: Optional[bool] = None
     ) -> str:
         """
         生成聊天回复
@@ -83,12 +93,21 @@ class OpenAIClient(BaseLLM):
             temperature: 温度参数，控制随机性
             top_p: 核采样参数
             stop: 停止生成的标记列表
+            cache: 是否使用进程内的回复缓存，如果为None则只在temperature为0时使用
         
         Returns:
             生成的回复文本
         """
+        # 命中回复缓存时直接返回
+        cache_key = self._response_cache_key(messages, max_tokens, temperature, top_p, stop, cache)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # 临时错误按指数退避重试（见RateLimiter.call）
         try:
-            response = await self.client.chat.completions.create(
+            response = await self._limiter.call(
+                self.client.chat.completions.create,
                 model=self.model,
                 messages=messages,
                 max_tokens=max_tokens,
@@ -97,27 +116,71 @@ class OpenAIClient(BaseLLM):
                 stop=stop
             )
             
-            return response.choices[0].message.content
+            content = response.choices[0].message.content
+            response_cache.set(cache_key, content)
+            return content
+        except Exception as e:
+            logger.warning("OpenAI API调用失败: %s", e)
+            return f"{ERROR_RESPONSE_PREFIX}错误: {str(e)}"
+    
+    async def generate_chat_response_stream(
+        self, 
+        messages: List[Dict[str, str]], 
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        stop: Optional[List[str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        以流的形式生成聊天回复，收到增量内容后立即返回
+        
+        命中回复缓存时直接返回缓存的完整回复
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+            max_tokens: 生成的最大token数
+            temperature: 温度参数，控制随机性
+            top_p: 核采样参数
+            stop: 停止生成的标记列表
+        
+        Yields:
+            回复文本片段
+        """
+        cache_key = self._response_cache_key(messages, max_tokens, temperature, top_p, stop, None)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        try:
+            stream = await self._limiter.call(
+                self.client.chat.completions.create,
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                stop=stop,
+                stream=True
+            )
+            
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    chunks.append(content)
+                    yield content
+            
+            response_cache.set(cache_key, "".join(chunks))
         except Exception as e:
-            print(f"OpenAI API调用失败: {e}")
-            # 重试一次
-            try:
-                await asyncio.sleep(1)  # 等待1秒后重试
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    top_p=top_p,
-                    stop=stop
-                )
-                
-                return response.choices[0].message.content
-            except Exception as e:
-                print(f"OpenAI API重试失败: {e}")
-                return f"抱歉，我遇到了一些问题，无法生成回复。错误: {str(e)}"
+            logger.warning("OpenAI API流式调用失败: %s", e)
+            # 已经输出部分内容时直接结束，否则返回与非流式调用一致的错误提示
+            if not chunks:
+                yield f"{ERROR_RESPONSE_PREFIX}错误: {str(e)}"
     
-    async def count_tokens(self, text: str) -> int:
+    def count_tokens_sync(self, text: str) -> int:
         """
         计算文本的token数量
         
@@ -129,7 +192,7 @@ class OpenAIClient(BaseLLM):
         """
         return count_tokens(text, self.model)
     
-    async def count_messages_tokens(self, messages: List[Dict[str, str]]) -> int:
+    def count_messages_tokens_sync(self, messages: List[Dict[str, str]]) -> int:
         """
         计算消息列表的token数量
         
@@ -157,4 +220,4 @@ class OpenAIClient(BaseLLM):
         Returns:
             上下文窗口大小（token数）
         """
-        return self.context_sizes.get(self.model, 4096)  # 默认为4096
\ No newline at end of file
+        return self._context_size
\ No newline at end of file
@@ -1,11 +1,16 @@
 import os
 import httpx
-from typing import List, Dict, Any, Optional, Union
-import asyncio
-import json
+from typing import List, Dict, Any, Optional, Union, AsyncIterator
+import orjson
+import logging
 from utils.token_counter import count_tokens, count_messages_tokens
 
-from llm.base import BaseLLM
+from llm.cache import response_cache
+from llm.base import BaseLLM, ERROR_RESPONSE_PREFIX, LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_HTTP2
+from llm.retry import retry_async, describe_error
+from llm.rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
 
 class OpenRouterClient(BaseLLM):
     """OpenRouter API客户端，支持访问多种LLM"""
@@ -46,6 +51,55 @@ class OpenRouterClient(BaseLLM):
             "deepseek/deepseek-chat": 8192,
             "deepseek/deepseek-coder": 16384
         }
+        # 模型在初始化后不再变化，上下文窗口大小只需查找一次；未知模型默认为8192
+        self._context_size = self.context_sizes.get(self.model, 8192)
+        
+        # 计算token时使用的模型：OpenAI模型使用去掉前缀的模型名称，其他模型使用cl100k_base作为近似
+        if "gpt" in self.model or "openai" in self.model:
+            self._token_model = self.model.split("/")[-1]
+        else:
+            self._token_model = "cl100k_base"
+        
+        # 请求地址和固定的请求头只需构建一次
+        self._endpoint_url = f"{self.api_base}/chat/completions"
+        self._headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+            "HTTP-Referer": "https://memory-enhanced-ai-chat.example.com",  # 你的应用域名
+            "X-Title": self.app_name,
+            "X-Version": self.app_version
+        }
+        
+        # 共享的HTTP客户端，首次请求时创建，复用连接避免每次请求重新握手
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        # 按OPENROUTER_RPM限制发送请求的速率，收到429时自动降速
+        self._limiter = RateLimiter.from_env("OPENROUTER")
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """
+        获取共享的HTTP客户端，首次调用时创建
+        
+        Returns:
+            HTTP客户端
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=60.0,
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS
+                ),
+                headers=self._headers,
+                http2=LLM_HTTP2
+            )
+        return self._client
+    
+    async def aclose(self):
+        """关闭共享的HTTP客户端"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     async def generate_text(
         self, 
@@ -83,7 +137,8 @@ class OpenRouterClient(BaseLLM):
         max_tokens: Optional[int] = None,
         temperature: float = 0.7,
         top_p: float = 1.0,
-        stop: Optional[List[str]] = None
+        stop: Optional[List[str]] = None,
+        cache: Optional[bool] = None
     ) -> str:
         """
         生成聊天回复
@@ -94,10 +149,44 @@ class OpenRouterClient(BaseLLM):
             temperature: 温度参数，控制随机性
             top_p: 核采样参数
             stop: 停止生成的标记列表
+            cache: 是否使用进程内的回复缓存，如果为None则只在temperature为0时使用
         
         Returns:
             生成的回复文本
         """
+        # 命中回复缓存时直接返回
+        cache_key = self._response_cache_key(messages, max_tokens, temperature, top_p, stop, cache)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        request_data = self._build_request_data(messages, max_tokens, temperature, top_p, stop)
+        
+        # 发送请求，临时错误由_post按指数退避重试
+        try:
+            response_data = await self._post(request_data)
+            content = response_data["choices"][0]["message"]["content"]
+            response_cache.set(cache_key, content)
+            return content
+        except Exception as e:
+            error_msg = f"OpenRouter API调用失败: {describe_error(e)}"
+            logger.warning(error_msg)
+            return f"{ERROR_RESPONSE_PREFIX}错误: {error_msg}"
+    
+    def _build_request_data(
+        self, 
+        messages: List[Dict[str, str]], 
+        max_tokens: Optional[int],
+        temperature: float,
+        top_p: float,
+        stop: Optional[List[str]]
+    ) -> Dict[str, Any]:
+        """
+        构建聊天补全的请求数据
+        
+        Returns:
+            请求数据
+        """
         # 构建请求数据
         request_data = {
             "model": self.model,
@@ -112,58 +201,90 @@ class OpenRouterClient(BaseLLM):
         if stop:
             request_data["stop"] = stop
         
-        # 发送请求
+        return request_data
+    
+    async def generate_chat_response_stream(
+        self, 
+        messages: List[Dict[str, str]], 
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        stop: Optional[List[str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        以流的形式生成聊天回复，边解析SSE事件边返回文本片段
+        
+        流式请求不做重试；命中回复缓存时直接返回缓存的完整回复
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+            max_tokens: 生成的最大token数
+            temperature: 温度参数，控制随机性
+            top_p: 核采样参数
+            stop: 停止生成的标记列表
+        
+        Yields:
+            回复文本片段
+        """
+        cache_key = self._response_cache_key(messages, max_tokens, temperature, top_p, stop, None)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        request_data = self._build_request_data(messages, max_tokens, temperature, top_p, stop)
+        request_data["stream"] = True
+        
+        chunks = []
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{self.api_base}/chat/completions",
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {self.api_key}",
-                        "HTTP-Referer": "https://memory-enhanced-ai-chat.example.com",  # 你的应用域名
-                        "X-Title": self.app_name,
-                        "X-Version": self.app_version
-                    },
-                    json=request_data
-                )
-                
+            client = await self._get_client()
+            async with self._limiter, client.stream("POST", self._endpoint_url, content=orjson.dumps(request_data)) as response:
                 if response.status_code != 200:
-                    error_msg = f"OpenRouter API调用失败: {response.status_code} - {response.text}"
-                    print(error_msg)
-                    return f"抱歉，我遇到了一些问题，无法生成回复。错误: {error_msg}"
+                    await response.aread()
+                    response.raise_for_status()
                 
-                response_data = response.json()
-                return response_data["choices"][0]["message"]["content"]
-        except Exception as e:
-            print(f"OpenRouter API调用失败: {e}")
-            # 重试一次
-            try:
-                await asyncio.sleep(1)  # 等待1秒后重试
-                async with httpx.AsyncClient(timeout=60.0) as client:
-                    response = await client.post(
-                        f"{self.api_base}/chat/completions",
-                        headers={
-                            "Content-Type": "application/json",
-                            "Authorization": f"Bearer {self.api_key}",
-                            "HTTP-Referer": "https://memory-enhanced-ai-chat.example.com",  # 你的应用域名
-                            "X-Title": self.app_name,
-                            "X-Version": self.app_version
-                        },
-                        json=request_data
-                    )
-                    
-                    if response.status_code != 200:
-                        error_msg = f"OpenRouter API调用失败: {response.status_code} - {response.text}"
-                        print(error_msg)
-                        return f"抱歉，我遇到了一些问题，无法生成回复。错误: {error_msg}"
+                async for line in response.aiter_lines():
+                    # 忽略空行和以冒号开头的注释（保活）行
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
                     
-                    response_data = response.json()
-                    return response_data["choices"][0]["message"]["content"]
-            except Exception as e:
-                print(f"OpenRouter API重试失败: {e}")
-                return f"抱歉，我遇到了一些问题，无法生成回复。错误: {str(e)}"
+                    choices = orjson.loads(data).get("choices")
+                    if not choices:
+                        continue
+                    content = (choices[0].get("delta") or {}).get("content")
+                    if content:
+                        chunks.append(content)
+                        yield content
+            
+            response_cache.set(cache_key, "".join(chunks))
+        except Exception as e:
+            error_msg = f"OpenRouter API流式调用失败: {describe_error(e)}"
+            logger.warning(error_msg)
+            # 已经输出部分内容时直接结束，否则返回与非流式调用一致的错误提示
+            if not chunks:
+                yield f"{ERROR_RESPONSE_PREFIX}错误: {error_msg}"
     
-    async def count_tokens(self, text: str) -> int:
+    @retry_async()
+    async def _post(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        发送聊天补全请求，网络错误、限流和服务端错误会自动重试
+        
+        Args:
+            request_data: 请求数据
+        
+        Returns:
+            响应数据
+        """
+        client = await self._get_client()
+        async with self._limiter:
+            response = await client.post(self._endpoint_url, content=orjson.dumps(request_data))
+            response.raise_for_status()
+        return orjson.loads(response.content)
+    
+    def count_tokens_sync(self, text: str) -> int:
         """
         计算文本的token数量
         
@@ -173,15 +294,9 @@ class OpenRouterClient(BaseLLM):
         Returns:
             token数量
         """
-        # 根据模型选择合适的token计数方法
-        if "gpt" in self.model or "openai" in self.model:
-            model_name = self.model.split("/")[-1] if "/" in self.model else self.model
-            return count_tokens(text, model_name)
-        else:
-            # 对于非OpenAI模型，使用cl100k_base作为近似
-            return count_tokens(text, "cl100k_base")
+        return count_tokens(text, self._token_model)
     
-    async def count_messages_tokens(self, messages: List[Dict[str, str]]) -> int:
+    def count_messages_tokens_sync(self, messages: List[Dict[str, str]]) -> int:
         """
         计算消息列表的token数量
         
@@ -191,13 +306,7 @@ class OpenRouterClient(BaseLLM):
         Returns:
             token数量
         """
-        # 根据模型选择合适的token计数方法
-        if "gpt" in self.model or "openai" in self.model:
-            model_name = self.model.split("/")[-1] if "/" in self.model else self.model
-            return count_messages_tokens(messages, model_name)
-        else:
-            # 对于非OpenAI模型，使用cl100k_base作为近似
-            return count_messages_tokens(messages, "cl100k_base")
+        return count_messages_tokens(messages, self._token_model)
     
     def get_model_name(self) -> str:
         """
@@ -215,9 +324,4 @@ class OpenRouterClient(BaseLLM):
         Returns:
             上下文窗口大小（token数）
         """
-        # 尝试从模型名称中提取基础模型
-        model_key = self.model
-        if "/" in model_key:
-            model_key = self.model  # 使用完整模型名称作为键
-        
-        return self.context_sizes.get(model_key, 8192)  # 默认为8192
\ No newline at end of file
+        return self._context_size
\ No newline at end of file
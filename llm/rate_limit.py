@@ -0,0 +1,165 @@
+import os
+import time
+import asyncio
+import functools
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+
+from llm.retry import LLM_RETRY_ATTEMPTS, retry_async
+
+logger = logging.getLogger(__name__)
+
+def is_rate_limited(error: Optional[BaseException]) -> bool:
+    """
+    判断异常是否为服务端返回的限流错误（HTTP 429）
+
+    Args:
+        error: 异常
+
+    Returns:
+        是否为限流错误
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429
+    # OpenAI和Anthropic SDK的API错误带有status_code属性
+    return getattr(error, "status_code", None) == 429
+
+def sdk_max_retries(limiter: "RateLimiter") -> int:
+    """
+    SDK客户端自动重试的次数
+
+    SDK的重试发生在限流器内部，既不获取令牌，也要等重试用完后限流器才能降速，
+    所以启用限流时关闭SDK的重试，改由RateLimiter.call重试
+
+    Args:
+        limiter: 客户端使用的限流器
+
+    Returns:
+        启用限流时为0，否则与其他客户端使用相同的重试次数
+    """
+    return 0 if limiter.enabled else LLM_RETRY_ATTEMPTS - 1
+
+class RateLimiter:
+    """
+    基于令牌桶的异步限流器，控制每个客户端发送请求的速率
+
+    在请求发出前等待令牌，避免并发请求超过服务商的限额后触发429再重试。
+    请求返回429时速率减半，之后每次成功的请求逐步恢复到设定的速率；
+    所有操作都在事件循环中执行，等待令牌时由锁保证按顺序放行。
+    令牌桶启动时只装入initial_fill比例的令牌，避免启动瞬间放行整个时间窗口的请求；
+    空闲一个时间窗口后令牌桶会补满，此时最多突发max_rate个请求
+    """
+
+    def __init__(
+        self,
+        max_rate: float,
+        time_period: float = 60.0,
+        min_rate: float = 1.0,
+        initial_fill: Optional[float] = None
+    ):
+        """
+        初始化限流器
+
+        Args:
+            max_rate: 每个时间窗口内最多发送的请求数，小于等于0时不限流
+            time_period: 时间窗口（秒）
+            min_rate: 收到限流响应后速率降低的下限
+            initial_fill: 启动时令牌桶装满的比例（0到1），至少装入1个令牌，如果为None则从环境变量获取
+        """
+        if initial_fill is None:
+            initial_fill = float(os.getenv("LLM_RATE_INITIAL_FILL", "0.1"))
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self.min_rate = min(min_rate, max_rate) if max_rate > 0 else min_rate
+        self.rate = max_rate
+        self._tokens = min(max_rate, max(1.0, max_rate * initial_fill)) if max_rate > 0 else 0.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls, provider: str) -> "RateLimiter":
+        """
+        根据环境变量{provider}_RPM创建每分钟请求数的限流器
+
+        Args:
+            provider: 服务商名称，如DEEPSEEK
+
+        Returns:
+            限流器
+        """
+        return cls(float(os.getenv(f"{provider}_RPM", "300")), 60.0)
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用限流"""
+        return self.max_rate > 0
+
+    def _refill(self):
+        """按经过的时间补充令牌，最多补满一个时间窗口的请求数"""
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.time_period)
+        self._updated = now
+
+    async def acquire(self):
+        """等待直到可以发送一个请求"""
+        if not self.enabled:
+            return
+
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) * self.time_period / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def throttle(self):
+        """收到限流响应后将速率减半"""
+        if not self.enabled:
+            return
+
+        rate = max(self.min_rate, self.rate / 2)
+        if rate < self.rate:
+            logger.warning("请求被限流，速率降低为每%.0f秒%.1f个请求", self.time_period, rate)
+        self.rate = rate
+        self._tokens = min(self._tokens, self.rate)
+
+    def recover(self):
+        """请求成功后逐步恢复速率，每次恢复设定速率的5%"""
+        if self.enabled and self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        在限流下调用SDK方法
+
+        启用限流时SDK客户端不自动重试（见sdk_max_retries），由这里按指数退避重试临时错误，
+        每次尝试都重新获取令牌，收到429时立即降速；不限流时由SDK自己重试
+
+        Args:
+            func: 要调用的异步函数，如client.chat.completions.create
+            *args: 位置参数
+            **kwargs: 关键字参数
+
+        Returns:
+            func的返回值
+        """
+        @functools.wraps(func)
+        async def attempt():
+            async with self:
+                return await func(*args, **kwargs)
+
+        if not self.enabled:
+            return await attempt()
+        return await retry_async()(attempt)()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc is None:
+            self.recover()
+        elif is_rate_limited(exc):
+            self.throttle()
@@ -0,0 +1,107 @@
+import os
+import random
+import asyncio
+import logging
+import functools
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 重试配置：最多尝试的次数和指数退避的等待时间（秒）
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))
+LLM_RETRY_INITIAL_DELAY = float(os.getenv("LLM_RETRY_INITIAL_DELAY", "0.2"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "4"))
+
+# 可以重试的HTTP状态码：超时、限流和服务端错误，其他4xx错误重试也不会成功
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# OpenAI和Anthropic SDK的连接错误（超时错误是它的子类），未安装的SDK跳过
+_SDK_CONNECTION_ERRORS = []
+try:
+    import openai
+    _SDK_CONNECTION_ERRORS.append(openai.APIConnectionError)
+except ImportError:
+    pass
+try:
+    import anthropic
+    _SDK_CONNECTION_ERRORS.append(anthropic.APIConnectionError)
+except ImportError:
+    pass
+_SDK_CONNECTION_ERRORS = tuple(_SDK_CONNECTION_ERRORS)
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    判断异常是否为可以重试的临时错误
+
+    Args:
+        error: 异常
+
+    Returns:
+        网络错误、超时、限流和服务端错误返回True
+    """
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    if isinstance(error, _SDK_CONNECTION_ERRORS):
+        return True
+    # OpenAI和Anthropic SDK的API错误带有status_code属性
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+def describe_error(error: Exception) -> str:
+    """
+    生成异常的描述，HTTP错误包含状态码和响应内容
+
+    Args:
+        error: 异常
+
+    Returns:
+        错误描述
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"{error.response.status_code} - {error.response.text}"
+    return str(error)
+
+def retry_async(
+    attempts: Optional[int] = None,
+    initial_delay: Optional[float] = None,
+    max_delay: Optional[float] = None,
+    retry_if: Callable[[Exception], bool] = is_transient_error
+):
+    """
+    异步函数的重试装饰器，使用带随机抖动的指数退避
+
+    第n次重试前等待min(max_delay, initial_delay * 2^(n-1) + 抖动)秒，
+    不可重试的错误或达到最大次数后直接抛出最后一次的异常
+
+    Args:
+        attempts: 最多尝试的次数（包括第一次调用），如果为None则从环境变量获取
+        initial_delay: 第一次重试前的等待时间（秒），如果为None则从环境变量获取
+        max_delay: 最长等待时间（秒），如果为None则从环境变量获取
+        retry_if: 判断异常是否可以重试的函数
+    """
+    attempts = attempts or LLM_RETRY_ATTEMPTS
+    initial_delay = initial_delay if initial_delay is not None else LLM_RETRY_INITIAL_DELAY
+    max_delay = max_delay if max_delay is not None else LLM_RETRY_MAX_DELAY
+
+    def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(1, attempts + 1):
+                try:
+                    return await func(*args, **kwargs)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if attempt >= attempts or not retry_if(e):
+                        raise
+                    delay = min(max_delay, initial_delay * 2 ** (attempt - 1) + random.uniform(0, initial_delay))
+                    logger.warning(
+                        "%s调用失败（第%d次），%.2f秒后重试: %s",
+                        func.__qualname__, attempt, delay, describe_error(e)
+                    )
+                    await asyncio.sleep(delay)
+        return wrapper
+    return decorator
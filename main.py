@@ -1,4 +1,6 @@
 import os
+import importlib.util
+from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
@@ -10,12 +12,47 @@ load_dotenv()
 # 导入API路由
 from api.chat import router as chat_router
 from api.memory import router as memory_router
+from db.redis_client import close_shared_pool
+from api.clients import get_redis, get_postgres, get_vector_store, close_llm_clients
+from memory.vector_store import close_embedding_http_client
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用启动时创建共享的Redis、PostgreSQL客户端和向量数据库并预热连接，整个进程只创建一个数据库引擎；
+    应用关闭时释放Redis、PostgreSQL、LLM客户端和嵌入API的连接
+    """
+    app.state.redis = get_redis()
+    app.state.postgres = get_postgres()
+    
+    # 预热失败不影响启动，对应的连接会在第一次请求时再建立
+    try:
+        await app.state.postgres.warmup(int(os.getenv("PG_WARMUP_CONNECTIONS", "5")))
+    except Exception as e:
+        print(f"PostgreSQL连接池预热失败: {e}")
+    
+    if not await app.state.redis.ping():
+        print("Redis连接预热失败")
+    
+    try:
+        await get_vector_store().warmup()
+    except Exception as e:
+        print(f"向量数据库预热失败: {e}")
+    
+    yield
+    
+    await app.state.redis.close()
+    await close_shared_pool()
+    await app.state.postgres.close()
+    await close_llm_clients()
+    close_embedding_http_client()
 
 # 创建FastAPI应用
 app = FastAPI(
     title="Memory-Enhanced AI Chat System",
     description="一个具有长期记忆能力的AI对话系统",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 添加CORS中间件
@@ -42,6 +79,9 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8083,
         reload=False,  # 生产环境关闭热重载
+        # 安装了uvloop和httptools（uvicorn[standard]）时使用更快的事件循环和HTTP解析器
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
         workers=4,    # 生产环境建议多worker
         ssl_keyfile="/path/to/key.pem",  # 如需直接HTTPS
         ssl_certfile="/path/to/cert.pem"
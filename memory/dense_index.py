@@ -0,0 +1,266 @@
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    将向量（或矩阵的每一行）归一化为单位长度，归一化后点积即为余弦相似度
+
+    Args:
+        vectors: 一维向量或二维矩阵
+
+    Returns:
+        float32类型的归一化结果
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+# int8量化时每次反量化计算的行数，限制临时float32块的大小
+INT8_BLOCK_ROWS = 4096
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    将向量按行对称量化为int8，每行使用独立的缩放系数
+
+    Args:
+        vectors: 二维float32矩阵，形状为(N, d)
+
+    Returns:
+        (int8编码矩阵, float32缩放系数向量)，原向量约等于codes * scales[:, None]
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=-1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+def top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    在已归一化的矩阵中查找与查询向量最相似的k行
+
+    使用一次矩阵向量乘法计算全部相似度，再用argpartition选出前k个，
+    避免对所有结果完整排序
+
+    Args:
+        matrix: 已归一化的矩阵，形状为(N, d)
+        query: 已归一化的查询向量，形状为(d,)
+        k: 返回结果数量
+
+    Returns:
+        (行号数组, 相似度数组)，按相似度从高到低排列
+    """
+    n = matrix.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    scores = matrix @ query
+    return select_top_k(scores, k)
+
+def select_top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    从相似度数组中选出最大的k个
+
+    Args:
+        scores: 相似度数组，形状为(N,)
+        k: 返回结果数量
+
+    Returns:
+        (行号数组, 相似度数组)，按相似度从高到低排列
+    """
+    n = scores.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    k = min(k, n)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    order = candidates[np.argsort(-scores[candidates])]
+    return order, scores[order]
+
+class DenseIndex:
+    """
+    进程内的稠密向量索引，使用连续存储的矩阵做暴力余弦相似度检索
+
+    支持两种存储格式：
+    - float32: 直接存储归一化后的向量
+    - int8: 按行量化为int8编码矩阵加float32缩放系数（SoA布局），内存和带宽约为float32的1/4
+    """
+
+    DTYPES = ("float32", "int8")
+
+    def __init__(self, dim: Optional[int] = None, capacity: int = 1024, dtype: str = "float32"):
+        """
+        初始化向量索引
+
+        Args:
+            dim: 向量维度，如果为None则在第一次添加时确定
+            capacity: 预分配的行数，容量不足时自动翻倍
+            dtype: 存储格式，float32或int8
+        """
+        if dtype not in self.DTYPES:
+            raise ValueError(f"不支持的存储格式: {dtype}")
+
+        self.dim = dim
+        self.dtype = dtype
+        self._capacity = capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._size = 0
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+
+        if dim is not None:
+            self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        """按当前容量分配存储，并保留已有的数据"""
+        matrix = np.empty((capacity, self.dim), dtype=np.int8 if self.dtype == "int8" else np.float32)
+        scales = np.empty(capacity, dtype=np.float32) if self.dtype == "int8" else None
+        if self._matrix is not None:
+            matrix[:self._size] = self._matrix[:self._size]
+            if scales is not None:
+                scales[:self._size] = self._scales[:self._size]
+        self._matrix = matrix
+        self._scales = scales
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._rows
+
+    def _ensure_capacity(self, extra: int):
+        """确保矩阵还能容纳extra行，不足时按倍数扩容"""
+        needed = self._size + extra
+        if needed <= self._capacity:
+            return
+        while self._capacity < needed:
+            self._capacity *= 2
+        self._allocate(self._capacity)
+
+    def add(self, id: str, vector: Sequence[float]):
+        """
+        添加或替换一个向量
+
+        Args:
+            id: 向量ID
+            vector: 向量
+        """
+        self.add_many([id], [vector])
+
+    def add_many(self, ids: List[str], vectors: Sequence[Sequence[float]]):
+        """
+        批量添加或替换向量
+
+        Args:
+            ids: 向量ID列表
+            vectors: 向量列表，与ID一一对应
+        """
+        if not ids:
+            return
+
+        vectors = normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._allocate(self._capacity)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: 期望{self.dim}，实际{vectors.shape[1]}")
+
+        # 只在写入时量化一次
+        scales = None
+        if self.dtype == "int8":
+            vectors, scales = quantize_int8(vectors)
+
+        self._ensure_capacity(len(ids))
+        for i, id in enumerate(ids):
+            row = self._rows.get(id)
+            if row is None:
+                row = self._size
+                self._size += 1
+                self._ids.append(id)
+                self._rows[id] = row
+            self._matrix[row] = vectors[i]
+            if scales is not None:
+                self._scales[row] = scales[i]
+
+    def remove(self, id: str) -> bool:
+        """
+        删除一个向量，使用最后一行填补空位以保持矩阵连续
+
+        Args:
+            id: 向量ID
+
+        Returns:
+            是否删除成功
+        """
+        row = self._rows.pop(id, None)
+        if row is None:
+            return False
+
+        last = self._size - 1
+        if row != last:
+            last_id = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            if self._scales is not None:
+                self._scales[row] = self._scales[last]
+            self._ids[row] = last_id
+            self._rows[last_id] = row
+        self._ids.pop()
+        self._size -= 1
+        return True
+
+    def search(self, query: Sequence[float], k: int = 5) -> List[Tuple[str, float]]:
+        """
+        查找与查询向量最相似的k个向量
+
+        Args:
+            query: 查询向量
+            k: 返回结果数量
+
+        Returns:
+            (向量ID, 余弦相似度)列表，按相似度从高到低排列
+        """
+        if self._size == 0:
+            return []
+
+        query = normalize(query)
+        if query.shape[0] != self.dim:
+            return []
+
+        if self.dtype == "int8":
+            rows, scores = select_top_k(self._int8_scores(query), k)
+        else:
+            rows, scores = top_k(self._matrix[:self._size], query, k)
+        return [(self._ids[row], float(score)) for row, score in zip(rows, scores)]
+
+    def _int8_scores(self, query: np.ndarray) -> np.ndarray:
+        """
+        计算int8编码矩阵与查询向量的相似度
+
+        查询向量同样量化为int8，分块计算编码的整数点积后乘以两侧的缩放系数，
+        存储的编码不会被整体反量化
+
+        Args:
+            query: 已归一化的查询向量
+
+        Returns:
+            相似度数组
+        """
+        query_codes, query_scale = quantize_int8(query.reshape(1, -1))
+        query_codes = query_codes[0].astype(np.float32)
+
+        scores = np.empty(self._size, dtype=np.float32)
+        for start in range(0, self._size, INT8_BLOCK_ROWS):
+            end = min(start + INT8_BLOCK_ROWS, self._size)
+            # 每次只把一个块的编码转换为float32参与计算，避免整个矩阵反量化
+            scores[start:end] = self._matrix[start:end].astype(np.float32) @ query_codes
+        return scores * self._scales[:self._size] * query_scale[0]
+
+    def clear(self):
+        """清空索引"""
+        self._size = 0
+        self._ids = []
+        self._rows = {}
@@ -0,0 +1,239 @@
+import os
+import base64
+import hashlib
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
+
+import numpy as np
+
+from db.redis_client import RedisClient
+from memory.embedding_store import EmbeddingStore
+
+class EmbeddingCache:
+    """
+    查询向量缓存，避免对相同文本重复调用嵌入API
+
+    按顺序查询三级缓存：进程内LRU缓存、本地磁盘上的SQLite存储、Redis
+    """
+
+    def __init__(
+        self,
+        embed_func: Callable[[List[str]], Awaitable[List[List[float]]]],
+        model_name: str,
+        redis_client: Optional[RedisClient] = None,
+        store: Optional[EmbeddingStore] = None,
+        maxsize: int = 2048,
+        expiry: Optional[int] = None
+    ):
+        """
+        初始化向量缓存
+
+        Args:
+            embed_func: 实际的嵌入函数，接收文本列表并返回向量列表
+            model_name: 嵌入模型名称，作为缓存键的一部分
+            redis_client: Redis客户端，如果为None则不使用Redis缓存
+            store: 持久化向量存储，如果为None则不使用磁盘缓存
+            maxsize: 进程内LRU缓存的最大条目数
+            expiry: Redis缓存的过期时间（秒），如果为None则从环境变量获取
+        """
+        self.embed_func = embed_func
+        self.model_name = model_name
+        self.redis_client = redis_client
+        self.store = store
+        self.maxsize = maxsize
+        self.expiry = expiry or int(os.getenv("EMBEDDING_CACHE_TTL", "604800"))  # 默认7天
+        # Redis中的向量以float16存储，体积约为JSON浮点数列表的十分之一
+        self.redis_float16 = os.getenv("EMBEDDING_CACHE_FLOAT16", "true").lower() == "true"
+
+        # 进程内LRU缓存，键为(模型名称, 文本哈希)
+        self._cache: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+
+    @staticmethod
+    def _hash_text(text: str) -> str:
+        """
+        计算归一化文本的哈希值
+
+        Args:
+            text: 文本
+
+        Returns:
+            SHA-256哈希值
+        """
+        return hashlib.sha256(text.strip().lower().encode("utf-8")).hexdigest()
+
+    def _redis_key(self, text_hash: str) -> str:
+        """
+        构建Redis缓存键
+
+        Args:
+            text_hash: 文本哈希值
+
+        Returns:
+            Redis键
+        """
+        return f"embed:{self.model_name}:{text_hash}"
+
+    def _store_key(self, text_hash: str) -> str:
+        """
+        构建持久化存储的缓存键
+
+        Args:
+            text_hash: 文本哈希值
+
+        Returns:
+            存储键
+        """
+        return f"{self.model_name}:{text_hash}"
+
+    def _encode_redis_value(self, embedding: List[float]) -> Dict[str, Any]:
+        """
+        将向量编码为Redis缓存的值
+        
+        Args:
+            embedding: 向量
+        
+        Returns:
+            float16的base64字符串或原始的浮点数列表
+        """
+        if self.redis_float16:
+            data = np.asarray(embedding, dtype=np.float16).tobytes()
+            return {"embedding16": base64.b64encode(data).decode("ascii")}
+        return {"embedding": embedding}
+    
+    @staticmethod
+    def _decode_redis_value(data: Optional[Dict[str, Any]]) -> Optional[List[float]]:
+        """
+        解码Redis缓存的值，兼容以浮点数列表缓存的旧数据
+        
+        Args:
+            data: Redis缓存的值
+        
+        Returns:
+            向量，如果没有缓存则返回None
+        """
+        if not data:
+            return None
+        if "embedding16" in data:
+            return np.frombuffer(base64.b64decode(data["embedding16"]), dtype=np.float16).astype(np.float32).tolist()
+        return data.get("embedding")
+
+    def _get_local(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        """从进程内缓存获取向量，并将其标记为最近使用"""
+        embedding = self._cache.get(key)
+        if embedding is not None:
+            self._cache.move_to_end(key)
+        return embedding
+
+    def _set_local(self, key: Tuple[str, str], embedding: List[float]):
+        """写入进程内缓存，超过容量时淘汰最久未使用的条目"""
+        self._cache[key] = embedding
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    async def embed_query_with_cache(self, text: str) -> List[float]:
+        """
+        获取文本的嵌入向量，优先从缓存读取
+
+        Args:
+            text: 要嵌入的文本
+
+        Returns:
+            嵌入向量
+        """
+        return (await self.embed_many([text]))[0]
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量获取文本的嵌入向量，只对缓存未命中的文本调用一次嵌入函数
+        
+        Args:
+            texts: 要嵌入的文本列表
+        
+        Returns:
+            与输入文本一一对应的向量列表
+        """
+        text_hashes = [self._hash_text(text) for text in texts]
+        results: List[Optional[List[float]]] = [
+            self._get_local((self.model_name, text_hash)) for text_hash in text_hashes
+        ]
+        
+        # 进程内缓存未命中的文本，查询磁盘上的持久化存储
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
+        if missing and self.store:
+            try:
+                stored = await self.store.get_many(
+                    [self._store_key(text_hashes[i]) for i in missing]
+                )
+                for i, embedding in zip(missing, stored):
+                    if embedding is not None:
+                        results[i] = embedding
+                        self._set_local((self.model_name, text_hashes[i]), embedding)
+                missing = [i for i in missing if results[i] is None]
+            except Exception as e:
+                print(f"读取持久化向量缓存失败: {e}")
+        
+        # 仍未命中的文本，使用一次MGET查询Redis
+        if missing and self.redis_client:
+            cached = await self.redis_client.get_json_many(
+                [self._redis_key(text_hashes[i]) for i in missing]
+            )
+            redis_hits: Dict[str, List[float]] = {}
+            for i, data in zip(missing, cached):
+                embedding = self._decode_redis_value(data)
+                if embedding is not None:
+                    results[i] = embedding
+                    redis_hits[text_hashes[i]] = embedding
+                    self._set_local((self.model_name, text_hashes[i]), embedding)
+            missing = [i for i in missing if results[i] is None]
+            
+            # 从Redis读取到的向量同时写入本地存储，下次无需访问网络
+            await self._set_store(redis_hits)
+        
+        # 剩余的文本去重后一次性调用嵌入函数
+        if missing:
+            unique: Dict[str, int] = {}
+            for i in missing:
+                unique.setdefault(text_hashes[i], i)
+            embeddings = await self.embed_func([texts[i] for i in unique.values()])
+            
+            new_embeddings: Dict[str, List[float]] = {}
+            for text_hash, embedding in zip(unique.keys(), embeddings):
+                embedding = [float(x) for x in embedding]
+                new_embeddings[text_hash] = embedding
+                self._set_local((self.model_name, text_hash), embedding)
+            for i in missing:
+                results[i] = new_embeddings[text_hashes[i]]
+            
+            await self._set_store(new_embeddings)
+            if self.redis_client:
+                await self.redis_client.set_json_many(
+                    {
+                        self._redis_key(text_hash): self._encode_redis_value(embedding)
+                        for text_hash, embedding in new_embeddings.items()
+                    },
+                    self.expiry
+                )
+        
+        return results
+    
+    async def _set_store(self, embeddings: Dict[str, List[float]]):
+        """
+        将向量写入持久化存储，写入失败时只记录错误
+
+        Args:
+            embeddings: 文本哈希值到向量的映射
+        """
+        if not self.store or not embeddings:
+            return
+        try:
+            await self.store.set_many({
+                self._store_key(text_hash): embedding
+                for text_hash, embedding in embeddings.items()
+            })
+        except Exception as e:
+            print(f"写入持久化向量缓存失败: {e}")
+    
+    def clear(self):
+        """清空进程内缓存"""
+        self._cache.clear()
@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import asyncio
+import threading
+from typing import List, Dict, Optional
+
+import numpy as np
+
+class EmbeddingStore:
+    """
+    基于SQLite的持久化向量存储，作为嵌入缓存的磁盘层
+
+    向量以float32原始字节保存，服务重启后缓存依然有效，
+    同一台机器上的多个worker可以共享同一个数据库文件（WAL模式支持并发读写）
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化向量存储
+
+        Args:
+            path: 数据库文件路径，如果为None则从环境变量获取
+        """
+        self.path = path or os.getenv("EMBEDDING_STORE_PATH", "./embedding_cache.db")
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        # 连接在线程池中使用，由锁保证同一时间只有一个线程访问
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _get_many_sync(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """批量读取向量，在线程池中执行"""
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            # SQLite对单条语句的参数数量有限制，分批查询
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                found.update(rows)
+
+        return [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+
+    def _set_many_sync(self, items: Dict[str, List[float]]):
+        """批量写入向量，在线程池中执行"""
+        rows = [
+            (key, np.asarray(embedding, dtype=np.float32).tobytes())
+            for key, embedding in items.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    async def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """
+        批量获取向量
+
+        Args:
+            keys: 缓存键列表
+
+        Returns:
+            与键一一对应的向量列表，不存在的键对应None
+        """
+        if not keys:
+            return []
+        return await asyncio.to_thread(self._get_many_sync, keys)
+
+    async def set_many(self, items: Dict[str, List[float]]):
+        """
+        批量写入向量
+
+        Args:
+            items: 缓存键到向量的映射
+        """
+        if not items:
+            return
+        await asyncio.to_thread(self._set_many_sync, items)
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -1,15 +1,26 @@
 import os
 from typing import List, Dict, Any, Optional, Union, Tuple
 from datetime import datetime
-import json
 import asyncio
+import base64
+import time
+import hashlib
+
+import numpy as np
 
 from db.postgres_client import PostgresClient
 from db.redis_client import RedisClient
 from memory.vector_store import VectorStore
+from memory.embedding_cache import EmbeddingCache
+from memory.dense_index import top_k
 from utils.summarizer import ConversationSummarizer
+from utils.batcher import EmbeddingBatcher
 from llm.base import BaseLLM
 
+def _relevance(memory: Dict[str, Any]) -> float:
+    """获取记忆的相关性，缺少相关性的记忆按0处理"""
+    return memory.get("relevance") or 0.0
+
 class LongTermMemory:
     """长期记忆管理，用于存储和检索用户的长期记忆"""
     
@@ -18,7 +29,8 @@ class LongTermMemory:
         postgres_client: PostgresClient, 
         redis_client: RedisClient,
         vector_store: VectorStore,
-        llm_client: BaseLLM
+        llm_client: BaseLLM,
+        embedding_cache: Optional[EmbeddingCache] = None
     ):
         """
         初始化长期记忆管理器
@@ -28,14 +40,37 @@ class LongTermMemory:
             redis_client: Redis客户端
             vector_store: 向量数据库
             llm_client: LLM客户端
+            embedding_cache: 查询向量缓存，如果为None则基于向量数据库的嵌入函数创建
         """
         self.postgres_client = postgres_client
         self.redis_client = redis_client
         self.vector_store = vector_store
         self.llm_client = llm_client
         self.summarizer = ConversationSummarizer(llm_client)
+        self.embedding_cache = embedding_cache or EmbeddingCache(
+            embed_func=vector_store.embed_texts,
+            model_name=vector_store.embedding_model_name,
+            redis_client=redis_client
+        )
+        
+        # 短时间内创建的多条记忆合并为一次批量嵌入调用
+        self.embedding_batcher = EmbeddingBatcher(vector_store.embed_texts)
         
         self.memory_retrieval_limit = int(os.getenv("MEMORY_RETRIEVAL_LIMIT", "5"))
+        
+        # 相似度缓存配置：连续的相似查询直接复用上一次的检索结果
+        self.similarity_cache_size = int(os.getenv("SIMILARITY_CACHE_SIZE", "32"))
+        self.similarity_cache_threshold = float(os.getenv("SIMILARITY_CACHE_THRESHOLD", "0.97"))
+        self.similarity_cache_ttl = int(os.getenv("SIMILARITY_CACHE_TTL", "300"))
+        
+        # 搜索结果缓存配置：完全相同的搜索直接返回缓存的结果，结果数量过大的搜索不缓存
+        self.search_cache_ttl = int(os.getenv("SEARCH_CACHE_TTL", "300"))
+        self.search_cache_max_limit = int(os.getenv("SEARCH_CACHE_MAX_LIMIT", "50"))
+        self.search_cache_hits = 0
+        self.search_cache_misses = 0
+        
+        # 新记忆与用户已有记忆的余弦相似度达到该值时合并到已有记忆，小于等于0时不去重
+        self.dedup_threshold = float(os.getenv("MEMORY_DEDUP_THRESHOLD", "0"))
     
     async def create_memory(
         self,
@@ -63,6 +98,233 @@ class LongTermMemory:
             创建的记忆
         """
         # 添加到向量数据库
+        vector_metadata = self._build_vector_metadata(user_id, source, importance, category, metadata)
+        
+        # 计算记忆向量，并发创建的记忆会被合并到同一次嵌入调用中
+        try:
+            embedding = await self.embedding_batcher.embed(content)
+        except Exception as e:
+            print(f"批量计算记忆向量失败，由向量数据库计算: {e}")
+            embedding = None
+        
+        # 与已有记忆重复时合并到已有记忆，不再写入新记忆
+        duplicate = (await self._find_duplicates(user_id, [embedding]))[0]
+        if duplicate is not None:
+            return await self._merge_duplicate(duplicate, importance, tags)
+        
+        embedding_id = await self.vector_store.add_memory(
+            text=content,
+            metadata=vector_metadata,
+            embedding=embedding
+        )
+        
+        # 记忆和标签在同一个事务中写入PostgreSQL
+        async with self.postgres_client.transaction():
+            memory = await self.postgres_client.create_memory(
+                user_id=user_id,
+                content=content,
+                source=source,
+                importance=importance,
+                category=category,
+                metadata=metadata,
+                embedding_id=embedding_id
+            )
+            
+            # 添加标签
+            if tags:
+                await self.postgres_client.add_memory_tags(memory.id, tags)
+        
+        # 使缓存失效
+        await self.redis_client.invalidate_user_memory_cache(user_id)
+        
+        # 返回记忆对象
+        return self._memory_to_dict(memory, tags)
+    
+    async def create_memories(
+        self,
+        user_id: str,
+        memories: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        批量创建记忆，向量只计算一次，PostgreSQL只需一次INSERT
+        
+        启用去重时，与已有记忆重复的记忆合并到已有记忆中，返回的是合并后的已有记忆
+        
+        Args:
+            user_id: 用户ID
+            memories: 记忆列表，每项包含content，以及可选的source、importance、category、metadata、tags
+        
+        Returns:
+            创建的记忆列表
+        """
+        if not memories:
+            return []
+        
+        # 一次性计算所有记忆的向量
+        contents = [memory["content"] for memory in memories]
+        try:
+            embeddings = await self.vector_store.embed_texts(contents)
+        except Exception as e:
+            print(f"批量计算记忆向量失败，由向量数据库计算: {e}")
+            embeddings = [None] * len(memories)
+        
+        # 与已有记忆重复的记忆合并到已有记忆中，其余的记忆再批量写入
+        merged = {}
+        for index, duplicate in enumerate(await self._find_duplicates(user_id, embeddings)):
+            if duplicate is not None:
+                merged[index] = await self._merge_duplicate(
+                    duplicate,
+                    memories[index].get("importance", 0.5),
+                    memories[index].get("tags")
+                )
+        if not merged:
+            return await self._write_memories(user_id, memories, contents, embeddings)
+        
+        new_indexes = [index for index in range(len(memories)) if index not in merged]
+        created = iter(await self._write_memories(
+            user_id,
+            [memories[index] for index in new_indexes],
+            [contents[index] for index in new_indexes],
+            [embeddings[index] for index in new_indexes]
+        ) if new_indexes else [])
+        return [merged[index] if index in merged else next(created) for index in range(len(memories))]
+    
+    async def _write_memories(
+        self,
+        user_id: str,
+        memories: List[Dict[str, Any]],
+        contents: List[str],
+        embeddings: List[Optional[List[float]]]
+    ) -> List[Dict[str, Any]]:
+        """
+        将一批记忆写入向量数据库和PostgreSQL
+        
+        Args:
+            user_id: 用户ID
+            memories: 记忆列表
+            contents: 与记忆一一对应的记忆内容
+            embeddings: 与记忆一一对应的向量，其中有None时由向量数据库计算
+        
+        Returns:
+            创建的记忆列表
+        """
+        # 一次性添加到向量数据库
+        embedding_ids = await self.vector_store.add_memories(
+            texts=contents,
+            metadatas=[
+                self._build_vector_metadata(
+                    user_id,
+                    memory.get("source"),
+                    memory.get("importance", 0.5),
+                    memory.get("category"),
+                    memory.get("metadata")
+                )
+                for memory in memories
+            ],
+            embeddings=embeddings if all(embedding is not None for embedding in embeddings) else None
+        )
+        
+        # 一次性添加到PostgreSQL，记忆和标签在同一个事务中写入
+        async with self.postgres_client.transaction():
+            created = await self.postgres_client.create_memories_bulk([
+                {**memory, "user_id": user_id, "embedding_id": embedding_id}
+                for memory, embedding_id in zip(memories, embedding_ids)
+            ])
+            
+            # 一次性添加所有标签
+            await self.postgres_client.add_memory_tags_bulk({
+                record.id: memory.get("tags") or []
+                for record, memory in zip(created, memories)
+            })
+        
+        # 使缓存失效
+        await self.redis_client.invalidate_user_memory_cache(user_id)
+        
+        return [
+            self._memory_to_dict(record, memory.get("tags"))
+            for record, memory in zip(created, memories)
+        ]
+    
+    async def _find_duplicates(
+        self,
+        user_id: str,
+        embeddings: List[Optional[List[float]]]
+    ) -> List[Optional[Any]]:
+        """
+        查找与新记忆足够相似的用户已有记忆，所有新记忆通过一次向量查询完成
+        
+        Args:
+            user_id: 用户ID
+            embeddings: 新记忆的向量列表
+        
+        Returns:
+            与向量一一对应的已有记忆对象，没有重复或未启用去重时对应None
+        """
+        duplicates = [None] * len(embeddings)
+        if self.dedup_threshold <= 0 or not embeddings or any(embedding is None for embedding in embeddings):
+            return duplicates
+        
+        try:
+            nearest = await self.vector_store.find_nearest(embeddings, {"user_id": user_id})
+        except Exception as e:
+            print(f"查找重复记忆失败，直接写入新记忆: {e}")
+            return duplicates
+        
+        matches = [
+            match[0] if match is not None and match[1] >= self.dedup_threshold else None
+            for match in nearest
+        ]
+        embedding_ids = [embedding_id for embedding_id in matches if embedding_id is not None]
+        if not embedding_ids:
+            return duplicates
+        
+        memories = await self.postgres_client.get_memories_by_embedding_ids(user_id, embedding_ids)
+        memories_by_embedding_id = {memory.embedding_id: memory for memory in memories}
+        return [memories_by_embedding_id.get(embedding_id) for embedding_id in matches]
+    
+    async def _merge_duplicate(
+        self,
+        memory: Any,
+        importance: float,
+        tags: Optional[List[str]]
+    ) -> Dict[str, Any]:
+        """
+        将重复的新记忆合并到已有记忆：保留较高的重要性并合并标签
+        
+        Args:
+            memory: 已有记忆对象
+            importance: 新记忆的重要性评分
+            tags: 新记忆的标签列表
+        
+        Returns:
+            合并后的记忆
+        """
+        print(f"新记忆与已有记忆{memory.id}重复，合并到已有记忆")
+        
+        existing_tags = await self.postgres_client.get_memory_tags(memory.id)
+        merged_tags = list(existing_tags) + [tag for tag in tags or [] if tag not in existing_tags]
+        merged_importance = max(memory.importance or 0, importance)
+        
+        if merged_importance != memory.importance or len(merged_tags) != len(existing_tags):
+            await self.update_memory(memory.id, importance=merged_importance, tags=merged_tags)
+            memory = await self.postgres_client.get_memory_by_id(memory.id)
+        
+        return self._memory_to_dict(memory, merged_tags)
+    
+    @staticmethod
+    def _build_vector_metadata(
+        user_id: str,
+        source: Optional[str],
+        importance: float,
+        category: Optional[str],
+        metadata: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        构建写入向量数据库的元数据
+        
+        Returns:
+            元数据字典
+        """
         vector_metadata = {
             "user_id": user_id,
             "source": source,
@@ -74,31 +336,20 @@ class LongTermMemory:
         if metadata:
             vector_metadata.update(metadata)
         
-        embedding_id = await self.vector_store.add_memory(
-            text=content,
-            metadata=vector_metadata
-        )
-        
-        # 添加到PostgreSQL
-        memory = await self.postgres_client.create_memory(
-            user_id=user_id,
-            content=content,
-            source=source,
-            importance=importance,
-            category=category,
-            metadata=metadata,
-            embedding_id=embedding_id
-        )
-        
-        # 添加标签
-        if tags:
-            for tag in tags:
-                await self.postgres_client.add_memory_tag(memory.id, tag)
+        return vector_metadata
+    
+    @staticmethod
+    def _memory_to_dict(memory: Any, tags: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        将新创建的记忆对象转换为字典
         
-        # 使缓存失效
-        await self.redis_client.invalidate_user_memory_cache(user_id)
+        Args:
+            memory: 记忆对象
+            tags: 标签列表
         
-        # 返回记忆对象
+        Returns:
+            记忆字典
+        """
         return {
             "id": memory.id,
             "user_id": memory.user_id,
@@ -106,7 +357,7 @@ class LongTermMemory:
             "source": memory.source,
             "importance": memory.importance,
             "category": memory.category,
-            "metadata": memory.metadata,
+            "metadata": memory.meta_data,
             "created_at": memory.created_at.isoformat(),
             "updated_at": memory.updated_at.isoformat(),
             "embedding_id": memory.embedding_id,
@@ -123,12 +374,12 @@ class LongTermMemory:
         Returns:
             记忆对象，如果不存在则返回None
         """
-        memory = await self.postgres_client.get_memory_by_id(memory_id)
+        memory = await self.postgres_client.get_memory_by_id(memory_id, with_tags=True)
         if not memory:
             return None
         
         # 获取标签
-        tags = await self.postgres_client.get_memory_tags(memory_id)
+        tags = [memory_tag.tag for memory_tag in memory.tags]
         
         return {
             "id": memory.id,
@@ -137,7 +388,7 @@ class LongTermMemory:
             "source": memory.source,
             "importance": memory.importance,
             "category": memory.category,
-            "metadata": memory.metadata,
+            "metadata": memory.meta_data,
             "created_at": memory.created_at.isoformat(),
             "updated_at": memory.updated_at.isoformat(),
             "embedding_id": memory.embedding_id,
@@ -201,30 +452,32 @@ class LongTermMemory:
                     **vector_update
                 )
         
-        # 更新PostgreSQL
-        success = await self.postgres_client.update_memory(
-            memory_id=memory_id,
-            content=content,
-            importance=importance,
-            category=category,
-            metadata=metadata,
-            is_active=is_active
-        )
-        
-        # 更新标签
-        if tags is not None:
-            # 获取现有标签
-            existing_tags = await self.postgres_client.get_memory_tags(memory_id)
+        # 记忆内容和标签在同一个事务中更新
+        async with self.postgres_client.transaction():
+            # 更新PostgreSQL
+            success = await self.postgres_client.update_memory(
+                memory_id=memory_id,
+                content=content,
+                importance=importance,
+                category=category,
+                metadata=metadata,
+                is_active=is_active
+            )
             
-            # 删除不在新标签列表中的标签
-            for tag in existing_tags:
-                if tag not in tags:
-                    await self.postgres_client.remove_memory_tag(memory_id, tag)
+            # 更新标签
+            if tags is not None:
+                # 获取现有标签
+                existing_tags = await self.postgres_client.get_memory_tags(memory_id)
             
-            # 添加新标签
-            for tag in tags:
-                if tag not in existing_tags:
-                    await self.postgres_client.add_memory_tag(memory_id, tag)
+                # 删除不在新标签列表中的标签
+                for tag in existing_tags:
+                    if tag not in tags:
+                        await self.postgres_client.remove_memory_tag(memory_id, tag)
+            
+                # 添加新标签
+                new_tags = [tag for tag in tags if tag not in existing_tags]
+                if new_tags:
+                    await self.postgres_client.add_memory_tags(memory_id, new_tags)
         
         # 使缓存失效
         await self.redis_client.invalidate_user_memory_cache(memory.user_id)
@@ -259,12 +512,42 @@ class LongTermMemory:
         
         return success
     
+    async def embed_query_with_cache(self, query: str) -> List[float]:
+        """
+        获取查询文本的嵌入向量，优先使用缓存
+        
+        Args:
+            query: 查询文本
+        
+        Returns:
+            查询向量
+        """
+        return await self.embedding_cache.embed_query_with_cache(query)
+    
+    async def _try_embed_query(self, query: str) -> Optional[List[float]]:
+        """
+        计算查询向量，失败时返回None
+        
+        Args:
+            query: 查询文本
+        
+        Returns:
+            查询向量，如果嵌入失败则返回None
+        """
+        try:
+            return await self.embed_query_with_cache(query)
+        except Exception as e:
+            # 嵌入失败时交给向量数据库自行嵌入查询文本（其中包含备选方案）
+            print(f"计算查询向量失败: {e}")
+            return None
+    
     async def search_memories(
         self,
         user_id: str,
         query: str,
         category: Optional[str] = None,
-        limit: Optional[int] = None
+        limit: Optional[int] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Dict[str, Any]]:
         """
         搜索记忆
@@ -274,59 +557,91 @@ class LongTermMemory:
             query: 查询文本
             category: 记忆类别
             limit: 结果数量限制
+            query_embedding: 预先计算好的查询向量，如果为None则通过缓存计算
         
         Returns:
             记忆列表
         """
+        limit = limit or self.memory_retrieval_limit
+        
+        # 完全相同的搜索直接返回缓存的结果，跳过嵌入、向量搜索和数据库查询
+        cache_field = None
+        if self.search_cache_ttl > 0 and limit <= self.search_cache_max_limit:
+            cache_field = self._search_cache_field(query, category, limit)
+            cached = await self.redis_client.get_user_search_cache(user_id, cache_field)
+            if cached is not None and time.time() - cached.get("ts", 0) < self.search_cache_ttl:
+                self.search_cache_hits += 1
+                return cached["memories"]
+            self.search_cache_misses += 1
+        
         # 构建过滤条件
         filter = {"user_id": user_id}
         if category:
             filter["category"] = category
         
+        # 计算查询向量（相同的查询直接命中缓存）
+        if query_embedding is None:
+            query_embedding = await self._try_embed_query(query)
+        
         # 从向量数据库中搜索
         vector_results = await self.vector_store.search_memories(
             query=query,
             filter=filter,
-            limit=limit or self.memory_retrieval_limit
+            limit=limit,
+            query_embedding=query_embedding
+        )
+        
+        # 一次查询获取所有命中的激活记忆，按embedding_id匹配向量搜索结果
+        memories = await self.postgres_client.get_memories_by_embedding_ids(
+            user_id,
+            [vector_result["id"] for vector_result in vector_results]
+        )
+        memories_by_embedding_id = {memory.embedding_id: memory for memory in memories}
+        matched = [
+            (memories_by_embedding_id[vector_result["id"]], vector_result)
+            for vector_result in vector_results
+            if vector_result["id"] in memories_by_embedding_id
+        ]
+        
+        # 一次查询获取所有命中记忆的标签
+        tags_by_memory = await self.postgres_client.get_memory_tags_bulk(
+            [memory.id for memory, _ in matched]
         )
         
-        # 获取完整的记忆对象
         results = []
-        for vector_result in vector_results:
-            # 通过embedding_id查找PostgreSQL中的记忆
-            memory = None
-            # 获取用户记忆列表（这是一个普通列表，不是异步迭代器）
-            memories = await self.postgres_client.get_user_memories(user_id)
-            # 使用普通for循环而不是async for
-            for mem in memories:
-                if mem.embedding_id == vector_result["id"]:
-                    memory = mem
-                    break
+        for memory, vector_result in matched:
+            tags = tags_by_memory.get(memory.id, [])
             
-            if memory and memory.is_active:
-                # 获取标签
-                tags = await self.postgres_client.get_memory_tags(memory.id)
-                
-                results.append({
-                    "id": memory.id,
-                    "user_id": memory.user_id,
-                    "content": memory.content,
-                    "source": memory.source,
-                    "importance": memory.importance,
-                    "category": memory.category,
-                    "metadata": memory.metadata,
-                    "created_at": memory.created_at.isoformat(),
-                    "updated_at": memory.updated_at.isoformat(),
-                    "embedding_id": memory.embedding_id,
-                    "tags": tags,
-                    "relevance": 1.0 - (vector_result["distance"] if vector_result.get("distance") else 0)
-                })
-        
-        # 按相关性排序
-        results.sort(key=lambda x: x.get("relevance", 0), reverse=True)
+            results.append({
+                "id": memory.id,
+                "user_id": memory.user_id,
+                "content": memory.content,
+                "source": memory.source,
+                "importance": memory.importance,
+                "category": memory.category,
+                "metadata": memory.meta_data,
+                "created_at": memory.created_at.isoformat(),
+                "updated_at": memory.updated_at.isoformat(),
+                "embedding_id": memory.embedding_id,
+                "tags": tags,
+                "relevance": 1.0 - (vector_result.get("distance") or 0.0)
+            })
+        
+        # 向量搜索的结果已按距离从近到远排列，按其顺序匹配得到的结果即按相关性从高到低排列，无需再排序
+        
+        if cache_field is not None:
+            await self.redis_client.set_user_search_cache(
+                user_id, cache_field, {"memories": results, "ts": time.time()}, self.search_cache_ttl
+            )
         
         return results
     
+    @staticmethod
+    def _search_cache_field(query: str, category: Optional[str], limit: int) -> str:
+        """生成搜索条件的摘要，作为搜索结果缓存的字段名"""
+        data = f"{category or ''}\x00{limit}\x00{query}".encode("utf-8")
+        return hashlib.sha1(data).hexdigest()
+    
     async def get_relevant_memories(
         self,
         user_id: str,
@@ -346,19 +661,122 @@ class LongTermMemory:
         Returns:
             记忆列表
         """
-        return await self.search_memories(
+        limit = limit or self.memory_retrieval_limit
+        query_embedding = await self._try_embed_query(context)
+        
+        # 如果之前有足够相似的查询，直接复用其检索结果
+        if query_embedding is not None:
+            cached = await self._lookup_similarity_cache(user_id, query_embedding, category, limit)
+            if cached is not None:
+                return cached
+        
+        memories = await self.search_memories(
             user_id=user_id,
             query=context,
             category=category,
-            limit=limit
+            limit=limit,
+            query_embedding=query_embedding
         )
+        
+        if query_embedding is not None:
+            await self._store_similarity_cache(user_id, query_embedding, category, limit, memories)
+        
+        return memories
+    
+    @staticmethod
+    def _encode_embedding(embedding: List[float]) -> str:
+        """将向量归一化并编码为float16的base64字符串，减小缓存体积"""
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+        return base64.b64encode(vec.astype(np.float16).tobytes()).decode("ascii")
+    
+    @staticmethod
+    def _decode_embedding(data: str) -> np.ndarray:
+        """解码缓存中的向量"""
+        return np.frombuffer(base64.b64decode(data), dtype=np.float16).astype(np.float32)
+    
+    async def _lookup_similarity_cache(
+        self,
+        user_id: str,
+        query_embedding: List[float],
+        category: Optional[str],
+        limit: int
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        在用户的相似度缓存中查找与当前查询足够相似的历史查询
+        
+        Args:
+            user_id: 用户ID
+            query_embedding: 查询向量
+            category: 记忆类别
+            limit: 结果数量限制
+        
+        Returns:
+            缓存的记忆列表，如果未命中则返回None
+        """
+        entries = await self.redis_client.get_user_similarity_cache(user_id)
+        if not entries:
+            return None
+        
+        now = time.time()
+        candidates = [
+            entry for entry in entries
+            if entry.get("category") == category
+            and entry.get("limit") == limit
+            and now - entry.get("ts", 0) < self.similarity_cache_ttl
+        ]
+        if not candidates:
+            return None
+        
+        query_vec = self._decode_embedding(self._encode_embedding(query_embedding))
+        stacked = np.stack([self._decode_embedding(entry["embedding"]) for entry in candidates])
+        if stacked.shape[1] != query_vec.shape[0]:
+            return None
+        
+        # 所有向量均已归一化，点积即为余弦相似度
+        rows, scores = top_k(stacked, query_vec, 1)
+        if len(rows) and scores[0] >= self.similarity_cache_threshold:
+            return candidates[int(rows[0])]["memories"]
+        return None
+    
+    async def _store_similarity_cache(
+        self,
+        user_id: str,
+        query_embedding: List[float],
+        category: Optional[str],
+        limit: int,
+        memories: List[Dict[str, Any]]
+    ):
+        """
+        将检索结果写入用户的相似度缓存，超过容量时淘汰最旧的条目
+        
+        Args:
+            user_id: 用户ID
+            query_embedding: 查询向量
+            category: 记忆类别
+            limit: 结果数量限制
+            memories: 检索到的记忆列表
+        """
+        entries = await self.redis_client.get_user_similarity_cache(user_id)
+        entries.append({
+            "embedding": self._encode_embedding(query_embedding),
+            "category": category,
+            "limit": limit,
+            "memories": memories,
+            "ts": time.time()
+        })
+        entries = entries[-self.similarity_cache_size:]
+        await self.redis_client.set_user_similarity_cache(user_id, entries, self.similarity_cache_ttl)
     
     async def summarize_conversation(
         self,
         conversation_id: str,
         user_id: str,
         messages: List[Dict[str, str]],
-        existing_summary: Optional[Dict[str, Any]] = None
+        existing_summary: Optional[Dict[str, Any]] = None,
+        summarized_message_count: Optional[int] = None
     ) -> Dict[str, Any]:
         """
         总结对话并存储为长期记忆
@@ -368,76 +786,81 @@ class LongTermMemory:
             user_id: 用户ID
             messages: 消息列表
             existing_summary: 已有的摘要
+            summarized_message_count: 本次总结后对话已覆盖的消息数量
         
         Returns:
             摘要
         """
-        # 生成摘要
-        summary = await self.summarizer.summarize_conversation(messages, existing_summary)
+        # 生成摘要和提取关键信息是两次互不依赖的LLM调用，并发执行
+        summary, key_info = await asyncio.gather(
+            self.summarizer.summarize_conversation(messages, existing_summary),
+            self.summarizer.extract_key_information(messages)
+        )
         
         # 更新对话摘要
-        await self.postgres_client.update_conversation_summary(conversation_id, summary)
-        
-        # 提取关键信息
-        key_info = await self.summarizer.extract_key_information(messages)
+        await self.postgres_client.update_conversation_summary(
+            conversation_id,
+            summary,
+            summarized_message_count=summarized_message_count
+        )
         
         # 存储关键信息为长期记忆
+        new_memories = []
         if key_info.get("personal_info"):
             personal_info = key_info["personal_info"]
             if personal_info.get("preferences"):
                 for pref in personal_info["preferences"]:
-                    await self.create_memory(
-                        user_id=user_id,
-                        content=f"用户偏好: {pref}",
-                        source=f"conversation:{conversation_id}",
-                        importance=0.8,
-                        category="preference",
-                        metadata={"conversation_id": conversation_id},
-                        tags=["preference"]
-                    )
+                    new_memories.append({
+                        "content": f"用户偏好: {pref}",
+                        "importance": 0.8,
+                        "category": "preference",
+                        "metadata": {"conversation_id": conversation_id},
+                        "tags": ["preference"]
+                    })
             
             if personal_info.get("background"):
-                await self.create_memory(
-                    user_id=user_id,
-                    content=f"用户背景: {personal_info['background']}",
-                    source=f"conversation:{conversation_id}",
-                    importance=0.7,
-                    category="background",
-                    metadata={"conversation_id": conversation_id},
-                    tags=["background"]
-                )
+                new_memories.append({
+                    "content": f"用户背景: {personal_info['background']}",
+                    "importance": 0.7,
+                    "category": "background",
+                    "metadata": {"conversation_id": conversation_id},
+                    "tags": ["background"]
+                })
         
         if key_info.get("tasks"):
             for task in key_info["tasks"]:
-                await self.create_memory(
-                    user_id=user_id,
-                    content=f"任务: {task['description']}",
-                    source=f"conversation:{conversation_id}",
-                    importance=0.9,
-                    category="task",
-                    metadata={
+                new_memories.append({
+                    "content": f"任务: {task['description']}",
+                    "importance": 0.9,
+                    "category": "task",
+                    "metadata": {
                         "conversation_id": conversation_id,
                         "deadline": task.get("deadline"),
                         "priority": task.get("priority")
                     },
-                    tags=["task"]
-                )
+                    "tags": ["task"]
+                })
         
         if key_info.get("important_dates"):
             for date_info in key_info["important_dates"]:
-                await self.create_memory(
-                    user_id=user_id,
-                    content=f"重要日期: {date_info['event']} - {date_info['date']}",
-                    source=f"conversation:{conversation_id}",
-                    importance=0.8,
-                    category="date",
-                    metadata={
+                new_memories.append({
+                    "content": f"重要日期: {date_info['event']} - {date_info['date']}",
+                    "importance": 0.8,
+                    "category": "date",
+                    "metadata": {
                         "conversation_id": conversation_id,
                         "event": date_info["event"],
                         "date": date_info["date"]
                     },
-                    tags=["date"]
-                )
+                    "tags": ["date"]
+                })
+        
+        # 一次性创建所有记忆
+        if new_memories:
+            await self.create_memories(
+                user_id,
+                [{**memory, "source": f"conversation:{conversation_id}"} for memory in new_memories]
+            )
         
         return summary
     
@@ -459,24 +882,29 @@ class LongTermMemory:
         if not memories:
             return ""
         
-        # 按相关性排序
-        memories.sort(key=lambda x: x.get("relevance", 0) if x.get("relevance") is not None else 0, reverse=True)
+        # search_memories的结果已经按相关性排序，只有顺序不对时才复制一份重新排序，不修改传入的列表
+        relevances = [_relevance(memory) for memory in memories]
+        if any(previous < current for previous, current in zip(relevances, relevances[1:])):
+            memories = sorted(memories, key=_relevance, reverse=True)
         
         context_parts = ["以下是与当前对话相关的记忆:"]
         
         total_tokens = 0
         token_limit_reached = False
         
+        memory_texts = []
         for memory in memories:
             memory_text = f"- {memory['content']}"
             if memory.get("category"):
                 memory_text += f" [类别: {memory['category']}]"
             if memory.get("tags"):
                 memory_text += f" [标签: {', '.join(memory['tags'])}]"
-            
-            # 估算token数量
-            memory_tokens = await self.llm_client.count_tokens(memory_text)
-            
+            memory_texts.append(memory_text)
+        
+        # 一次计算所有记忆的token数量，相同的记忆文本直接命中缓存
+        token_counts = await self.llm_client.count_tokens_batch(memory_texts)
+        
+        for memory_text, memory_tokens in zip(memory_texts, token_counts):
             if total_tokens + memory_tokens > max_tokens:
                 token_limit_reached = True
                 break
@@ -1,26 +1,93 @@
 import os
+from enum import IntEnum
 from typing import List, Dict, Any, Optional, Union
 from datetime import datetime
-import json
+
+import numpy as np
 
 from db.redis_client import RedisClient
 from db.postgres_client import PostgresClient
-from utils.token_counter import count_messages_tokens
+from memory.embedding_cache import EmbeddingCache
+from memory.dense_index import normalize
+from utils.token_counter import count_each_message_tokens, run_in_tokenizer_pool, TOKENS_PER_REQUEST
+
+class Role(IntEnum):
+    """缓存中使用的消息角色编码，过滤历史消息时比较整数而不是字符串"""
+    SYSTEM = 0
+    USER = 1
+    ASSISTANT = 2
+
+ROLE_CODES: Dict[str, int] = {role.name.lower(): int(role) for role in Role}
+ROLE_NAMES: Dict[int, str] = {code: name for name, code in ROLE_CODES.items()}
+
+def encode_role(role: Union[str, int]) -> Union[str, int]:
+    """将角色名称转换为整数编码，未知角色保持原样"""
+    if isinstance(role, str):
+        return ROLE_CODES.get(role, role)
+    return role
+
+def decode_role(role: Union[str, int]) -> str:
+    """将整数编码转换回角色名称，兼容缓存中仍为字符串的旧数据"""
+    if isinstance(role, int):
+        return ROLE_NAMES[role]
+    return role
+
+async def count_tokens_in_executor(messages: List[Dict[str, Any]], model: str) -> List[int]:
+    """
+    在线程池中计算每条消息的token数量
+    
+    Args:
+        messages: 消息列表
+        model: 用于计算token的模型名称
+    
+    Returns:
+        与消息一一对应的token数量列表
+    """
+    if not messages:
+        return []
+    return await run_in_tokenizer_pool(count_each_message_tokens, messages, model)
 
 class ShortTermMemory:
     """短期记忆管理，用于缓存当前对话的上下文"""
     
-    def __init__(self, redis_client: RedisClient, postgres_client: PostgresClient):
+    def __init__(
+        self, 
+        redis_client: RedisClient, 
+        postgres_client: PostgresClient,
+        embedding_cache: Optional[EmbeddingCache] = None
+    ):
         """
         初始化短期记忆管理器
         
         Args:
             redis_client: Redis客户端
             postgres_client: PostgreSQL客户端
+            embedding_cache: 向量缓存，用于按与当前查询的相关性筛选历史消息，如果为None则只按时间截断
         """
         self.redis_client = redis_client
         self.postgres_client = postgres_client
+        self.embedding_cache = embedding_cache
         self.max_messages = int(os.getenv("MAX_SHORT_TERM_MEMORY", "10"))
+        self.context_recent_messages = int(os.getenv("CONTEXT_RECENT_MESSAGES", "4"))
+    
+    @staticmethod
+    def _strip_tokens(messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """
+        去掉缓存的token数量字段并还原角色名称，得到可以直接发送给LLM的消息
+        
+        Args:
+            messages: 带有tokens字段和角色编码的消息列表
+        
+        Returns:
+            只包含role和content的消息列表
+        """
+        return [
+            {
+                "role": decode_role(msg["role"]),
+                "content": msg["content"]
+            }
+            for msg in messages
+        ]
     
     async def get_conversation_messages(
         self, 
@@ -37,16 +104,39 @@ class ShortTermMemory:
         Returns:
             消息列表
         """
+        messages = await self._get_cached_messages(conversation_id, limit)
+        return self._strip_tokens(messages)
+    
+    async def _get_cached_messages(
+        self, 
+        conversation_id: str, 
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        获取对话的消息，保留每条消息缓存的token数量
+        
+        Args:
+            conversation_id: 对话ID
+            limit: 消息数量限制，如果为None则使用配置的最大消息数
+        
+        Returns:
+            消息列表，角色为Role编码，格式为[{"role": 1, "content": "Hello", "tokens": 5}, ...]
+        """
         # 首先尝试从Redis获取
         messages = await self.redis_client.get_conversation_messages(conversation_id)
         
+        # 兼容缓存中角色仍为字符串的旧数据
+        for msg in messages:
+            msg["role"] = encode_role(msg["role"])
+        
         # 如果Redis中没有，则从PostgreSQL获取
         if not messages:
-            db_messages = await self.postgres_client.get_conversation_messages(conversation_id)
+            db_messages = await self.postgres_client.get_conversation_messages_lite(conversation_id)
             messages = [
                 {
-                    "role": msg.role,
-                    "content": msg.content
+                    "role": encode_role(msg.role),
+                    "content": msg.content,
+                    "tokens": msg.tokens
                 }
                 for msg in db_messages
             ]
@@ -91,8 +181,8 @@ class ShortTermMemory:
             "content": content
         }
         
-        # 计算token数量
-        tokens = count_messages_tokens([message], model)
+        # 计算token数量，只在写入时计算一次
+        tokens = (await count_tokens_in_executor([message], model))[0]
         
         # 添加到PostgreSQL
         await self.postgres_client.create_message(
@@ -102,16 +192,67 @@ class ShortTermMemory:
             tokens=tokens
         )
         
-        # 添加到Redis
+        # 添加到Redis，同时缓存token数量
         await self.redis_client.add_conversation_message(
             conversation_id=conversation_id,
-            message=message,
+            message={**message, "role": encode_role(role), "tokens": tokens},
             max_messages=self.max_messages,
             expiry=86400  # 1天
         )
         
         return message
     
+    async def add_messages(
+        self, 
+        conversation_id: str, 
+        messages: List[Dict[str, str]],
+        model: str = "gpt-4"
+    ) -> List[Dict[str, str]]:
+        """
+        批量添加消息到对话
+        
+        与逐条调用add_message相比，PostgreSQL只需一次批量写入，Redis缓存只需一次读写
+        
+        Args:
+            conversation_id: 对话ID
+            messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+            model: 用于计算token的模型名称
+        
+        Returns:
+            添加的消息列表
+        """
+        messages = [
+            {
+                "role": msg["role"],
+                "content": msg["content"]
+            }
+            for msg in messages
+        ]
+        
+        # 计算token数量，只在写入时计算一次
+        token_counts = await count_tokens_in_executor(messages, model)
+        
+        added_messages = [
+            {**message, "tokens": tokens}
+            for message, tokens in zip(messages, token_counts)
+        ]
+        
+        # 一次性添加到PostgreSQL
+        await self.postgres_client.create_messages(conversation_id, added_messages)
+        
+        # 一次性添加到Redis，同时缓存token数量，角色以整数编码存储
+        await self.redis_client.add_conversation_messages(
+            conversation_id=conversation_id,
+            messages=[
+                {**message, "role": encode_role(message["role"])}
+                for message in added_messages
+            ],
+            max_messages=self.max_messages,
+            expiry=86400  # 1天
+        )
+        
+        return messages
+    
     async def get_messages_with_token_limit(
         self, 
         conversation_id: str, 
@@ -131,8 +272,8 @@ class ShortTermMemory:
         Returns:
             消息列表
         """
-        # 获取所有消息
-        all_messages = await self.get_conversation_messages(conversation_id)
+        # 获取所有消息（带缓存的token数量）
+        all_messages = await self._get_cached_messages(conversation_id)
         
         # 如果没有消息，返回空列表
         if not all_messages:
@@ -140,36 +281,124 @@ class ShortTermMemory:
         
         # 如果不包含系统消息，过滤掉系统消息
         if not include_system_message:
-            all_messages = [msg for msg in all_messages if msg["role"] != "system"]
+            all_messages = [msg for msg in all_messages if msg["role"] != Role.SYSTEM]
+        
+        # 使用写入时缓存的token数量，只有旧数据缺少该字段时才重新计算
+        uncounted = [msg for msg in all_messages if msg.get("tokens") is None]
+        for msg, tokens in zip(uncounted, await count_tokens_in_executor(self._strip_tokens(uncounted), model)):
+            msg["tokens"] = tokens
         
         # 计算总token数
-        total_tokens = count_messages_tokens(all_messages, model)
+        total_tokens = sum(msg["tokens"] for msg in all_messages) + TOKENS_PER_REQUEST
         
         # 如果总token数小于等于限制，直接返回所有消息
         if total_tokens <= max_tokens:
-            return all_messages
+            return self._strip_tokens(all_messages)
         
         # 否则，从最新的消息开始，逐步添加消息，直到达到token限制
         result_messages = []
-        current_tokens = 0
+        current_tokens = TOKENS_PER_REQUEST
         
         # 首先添加系统消息（如果有）
-        system_messages = [msg for msg in all_messages if msg["role"] == "system"]
+        system_messages = [msg for msg in all_messages if msg["role"] == Role.SYSTEM]
         if include_system_message and system_messages:
             result_messages.extend(system_messages)
-            current_tokens += count_messages_tokens(system_messages, model)
+            current_tokens += sum(msg["tokens"] for msg in system_messages)
         
         # 然后从最新的消息开始添加
-        non_system_messages = [msg for msg in all_messages if msg["role"] != "system"]
+        non_system_messages = [msg for msg in all_messages if msg["role"] != Role.SYSTEM]
         for msg in reversed(non_system_messages):
-            msg_tokens = count_messages_tokens([msg], model)
+            msg_tokens = msg["tokens"]
             if current_tokens + msg_tokens <= max_tokens:
                 result_messages.insert(0, msg)
                 current_tokens += msg_tokens
             else:
                 break
         
-        return result_messages
+        return self._strip_tokens(result_messages)
+    
+    async def select_context(
+        self, 
+        conversation_id: str, 
+        query: str,
+        max_tokens: int,
+        model: str = "gpt-4"
+    ) -> List[Dict[str, str]]:
+        """
+        在token限制内选择与当前查询最相关的对话上下文
+        
+        始终保留系统消息、第一条用户消息和最近的若干条消息，
+        中间的消息按与查询的余弦相似度从高到低填充剩余的token预算，
+        最终结果保持原有的时间顺序
+        
+        Args:
+            conversation_id: 对话ID
+            query: 当前的用户查询
+            max_tokens: 最大token数
+            model: 用于计算token的模型名称
+        
+        Returns:
+            消息列表
+        """
+        all_messages = await self._get_cached_messages(conversation_id)
+        if not all_messages:
+            return []
+        
+        uncounted = [msg for msg in all_messages if msg.get("tokens") is None]
+        for msg, tokens in zip(uncounted, await count_tokens_in_executor(self._strip_tokens(uncounted), model)):
+            msg["tokens"] = tokens
+        
+        # 总token数未超过限制时直接返回
+        if sum(msg["tokens"] for msg in all_messages) + TOKENS_PER_REQUEST <= max_tokens:
+            return self._strip_tokens(all_messages)
+        
+        # 没有向量缓存时退化为按时间截断
+        if not self.embedding_cache:
+            return await self.get_messages_with_token_limit(conversation_id, max_tokens, model)
+        
+        selected = set()
+        current_tokens = TOKENS_PER_REQUEST
+        
+        def try_select(index: int) -> bool:
+            nonlocal current_tokens
+            msg_tokens = all_messages[index]["tokens"]
+            if current_tokens + msg_tokens > max_tokens:
+                return False
+            selected.add(index)
+            current_tokens += msg_tokens
+            return True
+        
+        # 首先保留所有系统消息和第一条用户消息
+        first_user = next((i for i, msg in enumerate(all_messages) if msg["role"] == Role.USER), None)
+        for i, msg in enumerate(all_messages):
+            if msg["role"] == Role.SYSTEM or i == first_user:
+                try_select(i)
+        
+        # 然后从最新的消息开始保留最近的若干条
+        middle = [i for i in range(len(all_messages)) if i not in selected]
+        recent = middle[-self.context_recent_messages:] if self.context_recent_messages > 0 else []
+        for i in reversed(recent):
+            if not try_select(i):
+                break
+        middle = [i for i in middle if i not in recent]
+        
+        # 中间的消息按与查询的相关性填充剩余预算
+        if middle and current_tokens < max_tokens:
+            try:
+                embeddings = await self.embedding_cache.embed_many(
+                    [query] + [all_messages[i]["content"] for i in middle]
+                )
+                vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+                scores = vectors[1:] @ vectors[0]
+                for j in np.argsort(-scores):
+                    try_select(middle[int(j)])
+            except Exception as e:
+                print(f"计算上下文相关性失败，按时间顺序填充: {e}")
+                for i in reversed(middle):
+                    if not try_select(i):
+                        break
+        
+        return self._strip_tokens([all_messages[i] for i in sorted(selected)])
     
     async def clear_conversation(self, conversation_id: str) -> bool:
         """
@@ -182,7 +411,6 @@ class ShortTermMemory:
             是否成功
         """
         # 从Redis中删除
-        key = f"conversation:{conversation_id}:messages"
-        await self.redis_client.delete(key)
+        await self.redis_client.clear_conversation_messages(conversation_id)
         
         return True
\ No newline at end of file
@@ -1,11 +1,437 @@
 import os
 import uuid
-import chromadb
-from chromadb.config import Settings
-from chromadb.utils import embedding_functions
 from typing import List, Dict, Any, Optional, Tuple, Union
-import json
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import httpx
+import numpy as np
+import orjson
+from urllib.parse import urlparse
+
+from memory.dense_index import DenseIndex
+from utils.batcher import MicroBatcher
+
+try:
+    from openai import APIError, NotFoundError
+except ImportError:
+    APIError = NotFoundError = ()
+
+try:
+    from chromadb.errors import ChromaError
+except ImportError:
+    ChromaError = ()
+
+# 向量数据库和嵌入API的错误，只有这些错误才改用默认嵌入函数重试，其他异常（程序错误）直接抛出
+_VECTOR_ERRORS = tuple(
+    error for error in (ChromaError, httpx.HTTPError, APIError) if isinstance(error, type)
+)
+
+logger = logging.getLogger(__name__)
+
+# 进程内共享的Chroma客户端、嵌入函数和集合，所有VectorStore实例复用，
+# 避免重复打开持久化目录、初始化嵌入函数和查找集合
+_shared_lock = threading.RLock()
+_shared_clients: Dict[str, Any] = {}
+_shared_embedding_function: Optional[Tuple[Any, str]] = None
+_shared_collections: Dict[Tuple[int, str], Any] = {}
+_shared_dense_mirrors: Dict[Tuple[int, str], "_DenseMirror"] = {}
+# 所有OpenAI兼容嵌入函数共享的HTTP客户端
+_embedding_http_client: Optional[httpx.Client] = None
+# 嵌入API不可用时使用的本地ONNX嵌入函数，只加载一次模型
+_onnx_embedding_function: Optional[Any] = None
+
+# Chroma的读写和嵌入函数都是同步调用，放到线程池中执行以免阻塞事件循环；
+# 线程数同时限制了并发的嵌入API请求数
+_chroma_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CHROMA_WORKERS", "8")),
+    thread_name_prefix="chroma"
+)
+
+# 同时执行的Chroma写操作数，写入本地SQLite时并发过高会产生锁竞争
+_chroma_write_semaphore = asyncio.Semaphore(int(os.getenv("CHROMA_WRITE_CONCURRENCY", "2")))
+
+def _log_vector_error(action: str, error: Exception):
+    """
+    记录向量数据库操作失败的原因，嵌入模型不存在时附带配置建议
+    
+    Args:
+        action: 失败的操作
+        error: 异常
+    """
+    if isinstance(error, NotFoundError):
+        logger.warning(
+            "%s失败: %r（OpenAI API错误: 模型或资源不存在，请检查API密钥和模型名称，"
+            "建议使用最新的嵌入模型，如text-embedding-3-small）",
+            action, error
+        )
+    else:
+        logger.warning("%s失败: %r", action, error)
+
+# Chroma元数据原生支持的标量类型，其他类型的值编码为JSON字符串
+_SCALAR_TYPES = (str, int, float, bool)
+
+def normalize_metadata(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    将元数据转换为Chroma支持的格式，返回新的字典，不修改传入的元数据
+    
+    标量值保持原样，字典、列表等其他值编码为JSON字符串，None值被丢弃（Chroma不支持空值）
+    
+    Args:
+        metadata: 元数据或过滤条件
+    
+    Returns:
+        转换后的元数据
+    """
+    if not metadata:
+        return {}
+    return {
+        key: value if isinstance(value, _SCALAR_TYPES) else orjson.dumps(value, default=str).decode()
+        for key, value in metadata.items()
+        if value is not None
+    }
+
+def _hnsw_metadata() -> Dict[str, Any]:
+    """
+    新建集合时使用的HNSW索引参数，已存在的集合保持创建时的参数
+    
+    Returns:
+        集合元数据
+    """
+    return {
+        "hnsw:space": os.getenv("CHROMA_HNSW_SPACE", "cosine"),
+        "hnsw:M": int(os.getenv("CHROMA_HNSW_M", "16")),
+        "hnsw:construction_ef": int(os.getenv("CHROMA_HNSW_CONSTRUCTION_EF", "100")),
+        "hnsw:search_ef": int(os.getenv("CHROMA_HNSW_SEARCH_EF", "64"))
+    }
+
+def get_embedding_http_client() -> httpx.Client:
+    """
+    获取进程内共享的嵌入API HTTP客户端，启用HTTP/2并复用连接，避免每次嵌入调用都重新建立TLS连接
+    
+    嵌入函数在Chroma线程池中同步调用，因此使用线程安全的同步httpx.Client
+    
+    Returns:
+        HTTP客户端
+    """
+    global _embedding_http_client
+    with _shared_lock:
+        if _embedding_http_client is None:
+            max_connections = int(os.getenv("EMBEDDING_HTTP_MAX_CONNECTIONS", "32"))
+            _embedding_http_client = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections
+                ),
+                timeout=float(os.getenv("EMBEDDING_HTTP_TIMEOUT", "30"))
+            )
+        return _embedding_http_client
+
+def close_embedding_http_client():
+    """关闭共享的嵌入API HTTP客户端，在应用关闭时调用"""
+    global _embedding_http_client
+    with _shared_lock:
+        if _embedding_http_client is not None:
+            _embedding_http_client.close()
+            _embedding_http_client = None
+
+def get_onnx_embedding_function():
+    """
+    获取进程内共享的本地ONNX嵌入函数（all-MiniLM-L6-v2），作为嵌入API不可用时的备选
+    
+    模型和ONNX推理会话只创建一次，避免每次备选调用都重新加载模型；
+    执行后端由环境变量ONNX_EMBEDDING_PROVIDERS指定，未设置时使用CPU
+    
+    Returns:
+        嵌入函数
+    """
+    global _onnx_embedding_function
+    with _shared_lock:
+        if _onnx_embedding_function is None:
+            from chromadb.utils import embedding_functions
+            
+            providers = [
+                provider.strip()
+                for provider in os.getenv("ONNX_EMBEDDING_PROVIDERS", "CPUExecutionProvider").split(",")
+                if provider.strip()
+            ]
+            _onnx_embedding_function = embedding_functions.ONNXMiniLM_L6_V2(
+                preferred_providers=providers or None
+            )
+        return _onnx_embedding_function
+
+class OpenAICompatibleEmbeddingFunction:
+    """调用OpenAI兼容嵌入API的Chroma嵌入函数，所有实例共享同一个HTTP客户端"""
+    
+    def __init__(self, api_key: str, model_name: str, api_base: Optional[str] = None):
+        """
+        初始化嵌入函数
+        
+        Args:
+            api_key: API密钥
+            model_name: 嵌入模型名称
+            api_base: API地址，如果为None则使用OpenAI官方地址
+        """
+        import openai
+        
+        self.model_name = model_name
+        self._client = openai.OpenAI(
+            api_key=api_key,
+            base_url=api_base,
+            http_client=get_embedding_http_client()
+        ).embeddings
+    
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        """
+        计算文本向量，所有文本通过一次请求发送
+        
+        Args:
+            input: 文本列表（参数名与Chroma的嵌入函数接口保持一致）
+        
+        Returns:
+            与文本一一对应的向量列表
+        """
+        # 与Chroma内置的OpenAI嵌入函数一致，换行替换为空格
+        texts = [text.replace("\n", " ") for text in input]
+        response = self._client.create(input=texts, model=self.model_name)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+# 进程内向量矩阵按该元数据字段分区，每次搜索只计算同一分区（同一用户）的向量
+_DENSE_PARTITION_KEY = "user_id"
+# 从Chroma加载向量矩阵时每次读取的记忆数
+_DENSE_LOAD_PAGE = 1000
+
+class _DenseMirror:
+    """
+    Chroma集合在进程内的向量副本，按user_id分区存放在DenseIndex中
+    
+    集合较小时，带user_id过滤的搜索直接在矩阵上计算余弦相似度，省去HNSW查询的线程切换和SQLite读取。
+    所有操作都在事件循环中同步执行，不会被其他协程打断，因此无需加锁；
+    加载期间发生的写操作直接应用到副本，加载的快照不会覆盖这些记忆
+    """
+    
+    def __init__(self, dtype: str = "int8"):
+        """
+        初始化向量副本
+        
+        Args:
+            dtype: DenseIndex的存储格式，float32或int8
+        """
+        self.dtype = dtype
+        self.loaded = False
+        self.oversized = False
+        self.load_lock = asyncio.Lock()
+        self._generation = 0
+        self._touched: Optional[set] = None
+        self._indexes: Dict[Any, DenseIndex] = {}
+        self._metadatas: Dict[str, Dict[str, Any]] = {}
+        self._partitions: Dict[str, Any] = {}
+    
+    def __len__(self) -> int:
+        return len(self._metadatas)
+    
+    @property
+    def active(self) -> bool:
+        """副本是否已加载或正在加载，只有此时才需要同步写操作"""
+        return self.loaded or self._touched is not None
+    
+    def begin_load(self) -> int:
+        """
+        开始加载，之后的写操作会被记录，加载的快照不会覆盖它们
+        
+        Returns:
+            当前的版本号，副本失效后版本号会改变
+        """
+        self._touched = set()
+        return self._generation
+    
+    def finish_load(
+        self,
+        generation: int,
+        ids: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Optional[Dict[str, Any]]]
+    ) -> bool:
+        """
+        写入加载的快照，跳过加载期间被写入或删除的记忆
+        
+        Args:
+            generation: begin_load返回的版本号
+            ids: 记忆ID列表
+            embeddings: 向量列表
+            metadatas: 元数据列表
+        
+        Returns:
+            是否加载成功，加载期间副本失效时返回False
+        """
+        touched, self._touched = self._touched, None
+        if generation != self._generation:
+            return False
+        
+        rows = [
+            (memory_id, embedding, metadata)
+            for memory_id, embedding, metadata in zip(ids, embeddings, metadatas)
+            if memory_id not in touched
+        ]
+        if rows and not self._add_rows(*map(list, zip(*rows))):
+            return False
+        self.loaded = True
+        return True
+    
+    def invalidate(self):
+        """清空副本，下次搜索时重新加载"""
+        self._generation += 1
+        self.loaded = False
+        self._touched = None
+        self._indexes = {}
+        self._metadatas = {}
+        self._partitions = {}
+    
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Optional[Dict[str, Any]]]):
+        """
+        添加或替换记忆的向量
+        
+        Args:
+            ids: 记忆ID列表
+            embeddings: 向量列表
+            metadatas: 已转换格式的元数据列表
+        """
+        if not self.active:
+            return
+        if self._touched is not None:
+            self._touched.update(ids)
+        self._add_rows(ids, embeddings, metadatas)
+    
+    def _add_rows(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Optional[Dict[str, Any]]]
+    ) -> bool:
+        """
+        按分区写入向量，向量维度与已有向量不一致时清空副本
+        
+        Returns:
+            是否写入成功
+        """
+        groups: Dict[Any, Tuple[List[str], List[List[float]]]] = {}
+        for memory_id, embedding, metadata in zip(ids, embeddings, metadatas):
+            metadata = metadata or {}
+            partition = metadata.get(_DENSE_PARTITION_KEY)
+            previous = self._partitions.get(memory_id)
+            if memory_id in self._partitions and previous != partition:
+                self._indexes[previous].remove(memory_id)
+            self._partitions[memory_id] = partition
+            self._metadatas[memory_id] = metadata
+            group = groups.setdefault(partition, ([], []))
+            group[0].append(memory_id)
+            group[1].append(embedding)
+        
+        try:
+            for partition, (group_ids, group_embeddings) in groups.items():
+                index = self._indexes.get(partition)
+                if index is None:
+                    index = self._indexes[partition] = DenseIndex(capacity=16, dtype=self.dtype)
+                index.add_many(group_ids, group_embeddings)
+        except ValueError as e:
+            logger.warning("进程内向量矩阵写入失败，等待重新加载: %r", e)
+            self.invalidate()
+            return False
+        return True
+    
+    def remove(self, ids: List[str]):
+        """
+        删除记忆的向量
+        
+        Args:
+            ids: 记忆ID列表
+        """
+        if not self.active:
+            return
+        if self._touched is not None:
+            self._touched.update(ids)
+        for memory_id in ids:
+            if memory_id in self._partitions:
+                self._indexes[self._partitions.pop(memory_id)].remove(memory_id)
+                del self._metadatas[memory_id]
+    
+    def search(
+        self,
+        query_embedding: List[float],
+        filter: Optional[Dict[str, Any]],
+        limit: int
+    ) -> Optional[List[Tuple[str, float]]]:
+        """
+        在查询所属的分区中查找最相似的记忆
+        
+        Args:
+            query_embedding: 查询向量
+            filter: 已转换格式的过滤条件，必须包含user_id且只能是等值条件
+            limit: 返回结果数量
+        
+        Returns:
+            (记忆ID, 余弦相似度)列表，无法用副本完成的搜索返回None
+        """
+        if not self.loaded or not filter or _DENSE_PARTITION_KEY not in filter:
+            return None
+        if any(key.startswith("$") for key in filter):
+            return None
+        
+        index = self._indexes.get(filter[_DENSE_PARTITION_KEY])
+        if index is None or len(index) == 0:
+            return []
+        if index.dim != len(query_embedding):
+            return None
+        
+        conditions = [(key, value) for key, value in filter.items() if key != _DENSE_PARTITION_KEY]
+        if not conditions:
+            return index.search(query_embedding, limit)
+        
+        # 还有其他过滤条件时计算分区内全部记忆的相似度，按顺序取前limit条满足条件的记忆
+        hits = (
+            (memory_id, similarity)
+            for memory_id, similarity in index.search(query_embedding, len(index))
+            if all(self._metadatas[memory_id].get(key) == value for key, value in conditions)
+        )
+        return [hit for _, hit in zip(range(limit), hits)]
+
+def get_shared_client(persist_directory: str):
+    """
+    获取进程内共享的Chroma客户端，每个持久化目录（或Chroma服务地址）只创建一次
+    
+    设置了CHROMA_SERVER_URL时连接独立的Chroma服务，多个进程共享同一份数据；否则使用本地持久化存储
+    
+    Args:
+        persist_directory: 持久化目录
+    
+    Returns:
+        Chroma客户端
+    """
+    server_url = os.getenv("CHROMA_SERVER_URL")
+    key = server_url or persist_directory
+    with _shared_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            # chromadb会间接导入onnxruntime、tokenizers等重量级依赖，推迟到第一次使用时导入，加快启动速度
+            import chromadb
+            from chromadb.config import Settings
+            
+            settings = Settings(anonymized_telemetry=False)
+            if server_url:
+                url = urlparse(server_url)
+                client = chromadb.HttpClient(
+                    host=url.hostname,
+                    port=str(url.port or (443 if url.scheme == "https" else 8000)),
+                    ssl=url.scheme == "https",
+                    settings=settings
+                )
+            else:
+                client = chromadb.PersistentClient(path=persist_directory, settings=settings)
+            _shared_clients[key] = client
+        return client
 
 class VectorStore:
     """向量数据库接口，用于存储和检索向量化的记忆"""
@@ -16,31 +442,56 @@ class VectorStore:
         
         Args:
             collection_name: 集合名称
-            persist_directory: 持久化目录，如果为None则使用内存存储
+            persist_directory: 持久化目录，如果为None则使用./chroma_db（设置了CHROMA_SERVER_URL时不使用）
         """
         self.collection_name = collection_name
         self.persist_directory = persist_directory or "./chroma_db"
+        self.embedding_model_name = "default"
         
-        # 创建Chroma客户端
-        self.client = chromadb.Client(Settings(
-            persist_directory=self.persist_directory,
-            anonymized_telemetry=False
-        ))
+        # 复用进程内共享的Chroma客户端
+        self.client = get_shared_client(self.persist_directory)
         
-        # 选择嵌入函数
-        self.embedding_function = self._get_embedding_function()
+        global _shared_embedding_function
+        with _shared_lock:
+            # 选择嵌入函数，只在第一次创建实例时根据环境变量初始化
+            if _shared_embedding_function is None:
+                _shared_embedding_function = (self._get_embedding_function(), self.embedding_model_name)
+            self.embedding_function, self.embedding_model_name = _shared_embedding_function
+            
+            # 获取或创建集合，同一目录下的同名集合只查找一次
+            key = (id(self.client), self.collection_name)
+            collection = _shared_collections.get(key)
+            if collection is None:
+                collection = self.client.get_or_create_collection(
+                    name=self.collection_name,
+                    metadata=_hnsw_metadata(),
+                    embedding_function=self.embedding_function
+                )
+                _shared_collections[key] = collection
+            self.collection = collection
+            
+            # 同一集合的所有实例共享进程内的向量副本
+            dense_mirror = _shared_dense_mirrors.get(key)
+            if dense_mirror is None:
+                dense_mirror = _DenseMirror(os.getenv("VECTOR_DENSE_SEARCH_DTYPE", "int8"))
+                _shared_dense_mirrors[key] = dense_mirror
+            self._dense_mirror = dense_mirror
         
-        # 获取或创建集合
-        try:
-            self.collection = self.client.get_collection(
-                name=self.collection_name,
-                embedding_function=self.embedding_function
-            )
-        except ValueError:
-            self.collection = self.client.create_collection(
-                name=self.collection_name,
-                embedding_function=self.embedding_function
-            )
+        # 每次调用Chroma的add最多写入的记忆数，并发的add_memory在短时间内合并为一次写入
+        self.add_batch_size = int(os.getenv("CHROMA_ADD_BATCH_SIZE", "200"))
+        self._add_batcher = MicroBatcher(
+            self._add_memory_batch,
+            max_batch=self.add_batch_size,
+            max_delay=float(os.getenv("CHROMA_ADD_BATCH_DELAY", "0.01")),
+            # 合并写入失败时逐条重试，一条出错的记忆不会导致同批的其他记忆写入失败
+            #（已写入的记忆再次add时会被Chroma忽略）
+            isolate_failures=True
+        )
+        
+        # 集合的记忆数不超过该值时，带user_id过滤的搜索使用进程内的向量矩阵，默认0表示禁用；
+        # 副本只能看到本进程的写入，只应在唯一写入该Chroma目录的进程中启用
+        #（多个uvicorn worker或单独的摘要worker会写入同一目录）
+        self.dense_search_max_size = int(os.getenv("VECTOR_DENSE_SEARCH_MAX_SIZE", "0"))
     
     def _get_embedding_function(self):
         """
@@ -49,15 +500,33 @@ class VectorStore:
         Returns:
             嵌入函数
         """
+        from chromadb.utils import embedding_functions
+        
+        # 优先使用本地的SentenceTransformer模型，查询向量无需调用远程API
+        local_model = os.getenv("LOCAL_EMBEDDING_MODEL")
+        if local_model:
+            try:
+                embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+                    model_name=local_model,
+                    device=os.getenv("LOCAL_EMBEDDING_DEVICE", "cpu"),
+                    normalize_embeddings=True
+                )
+                self.embedding_model_name = f"local/{local_model}"
+                return embedding_function
+            except Exception as e:
+                print(f"本地嵌入模型{local_model}初始化失败: {e}")
+        
         # 尝试使用OpenRouter的嵌入API
         openrouter_api_key = os.getenv("OPENROUTER_API_KEY")
         if openrouter_api_key:
             try:
-                return embedding_functions.OpenAIEmbeddingFunction(
+                embedding_function = OpenAICompatibleEmbeddingFunction(
                     api_key=openrouter_api_key,
                     model_name="text-embedding-ada-002",
                     api_base="https://openrouter.ai/api/v1"
                 )
+                self.embedding_model_name = "openrouter/text-embedding-ada-002"
+                return embedding_function
             except Exception as e:
                 print(f"OpenRouter嵌入函数初始化失败: {e}")
         
@@ -66,11 +535,13 @@ class VectorStore:
         if deepseek_api_key:
             try:
                 # 如果DeepSeek提供了与OpenAI兼容的嵌入API，可以使用这个
-                return embedding_functions.OpenAIEmbeddingFunction(
+                embedding_function = OpenAICompatibleEmbeddingFunction(
                     api_key=deepseek_api_key,
                     model_name="deepseek-embedding",
                     api_base="https://api.deepseek.com/v1"
                 )
+                self.embedding_model_name = "deepseek/deepseek-embedding"
+                return embedding_function
             except Exception as e:
                 print(f"DeepSeek嵌入函数初始化失败: {e}")
         
@@ -80,19 +551,23 @@ class VectorStore:
             try:
                 # 尝试使用新的嵌入模型
                 print("尝试使用OpenAI的text-embedding-3-small模型...")
-                return embedding_functions.OpenAIEmbeddingFunction(
+                embedding_function = OpenAICompatibleEmbeddingFunction(
                     api_key=openai_api_key,
                     model_name="text-embedding-3-small"
                 )
+                self.embedding_model_name = "openai/text-embedding-3-small"
+                return embedding_function
             except Exception as e:
                 print(f"OpenAI text-embedding-3-small初始化失败: {e}")
                 try:
                     # 如果新模型失败，尝试使用旧模型
                     print("尝试使用OpenAI的text-embedding-ada-002模型...")
-                    return embedding_functions.OpenAIEmbeddingFunction(
+                    embedding_function = OpenAICompatibleEmbeddingFunction(
                         api_key=openai_api_key,
                         model_name="text-embedding-ada-002"
                     )
+                    self.embedding_model_name = "openai/text-embedding-ada-002"
+                    return embedding_function
                 except Exception as e:
                     print(f"OpenAI text-embedding-ada-002初始化失败: {e}")
                     print(f"错误类型: {type(e)}")
@@ -102,88 +577,422 @@ class VectorStore:
         print("警告: 所有嵌入API都不可用，使用默认的嵌入函数")
         print("注意: 默认嵌入函数性能较差，建议配置至少一个嵌入API")
         print("可用的嵌入API选项: OpenAI, DeepSeek, OpenRouter")
-        return embedding_functions.DefaultEmbeddingFunction()
+        self.embedding_model_name = "default"
+        return get_onnx_embedding_function()
+    
+    @staticmethod
+    async def _run(func, *args, **kwargs):
+        """
+        在Chroma线程池中执行同步调用
+        
+        Args:
+            func: 要执行的函数
+            args: 位置参数
+            kwargs: 关键字参数
+        
+        Returns:
+            函数的返回值
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_chroma_pool, functools.partial(func, *args, **kwargs))
+    
+    @classmethod
+    async def _write(cls, func, *args, **kwargs):
+        """
+        在Chroma线程池中执行写操作，并发的写操作数受CHROMA_WRITE_CONCURRENCY限制
+        
+        Args:
+            func: 要执行的函数
+            args: 位置参数
+            kwargs: 关键字参数
+        
+        Returns:
+            函数的返回值
+        """
+        async with _chroma_write_semaphore:
+            return await cls._run(func, *args, **kwargs)
+    
+    async def warmup(self):
+        """
+        预热向量数据库：在Chroma线程池中读取一次集合，提前加载持久化的数据和索引，
+        集合较小时同时加载进程内的向量矩阵
+        """
+        await self._run(self.collection.count)
+        await self._load_dense_mirror()
+    
+    def _dense_search_enabled(self) -> bool:
+        """
+        是否可以使用进程内的向量矩阵搜索
+        
+        连接独立的Chroma服务时其他进程也会写入，副本无法保持同步；
+        集合不使用余弦距离时矩阵计算的结果与HNSW不一致，这两种情况都不启用
+        
+        Returns:
+            是否启用
+        """
+        return (
+            self.dense_search_max_size > 0
+            and not self._dense_mirror.oversized
+            and not os.getenv("CHROMA_SERVER_URL")
+            and (self.collection.metadata or {}).get("hnsw:space") == "cosine"
+        )
+    
+    async def _load_dense_mirror(self) -> bool:
+        """
+        从Chroma分页读取全部向量，加载进程内的向量矩阵，已加载时直接返回
+        
+        Returns:
+            向量矩阵是否可用
+        """
+        mirror = self._dense_mirror
+        if mirror.loaded:
+            return True
+        if not self._dense_search_enabled():
+            return False
+        
+        async with mirror.load_lock:
+            if mirror.loaded:
+                return True
+            
+            try:
+                count = await self._run(self.collection.count)
+                if count > self.dense_search_max_size:
+                    mirror.oversized = True
+                    print(f"集合记忆数{count}超过{self.dense_search_max_size}，搜索使用HNSW索引")
+                    return False
+                
+                generation = mirror.begin_load()
+                ids: List[str] = []
+                embeddings: List[List[float]] = []
+                metadatas: List[Optional[Dict[str, Any]]] = []
+                for offset in range(0, count, _DENSE_LOAD_PAGE):
+                    page = await self._run(
+                        self.collection.get,
+                        limit=_DENSE_LOAD_PAGE,
+                        offset=offset,
+                        include=["embeddings", "metadatas"]
+                    )
+                    ids.extend(page["ids"])
+                    embeddings.extend(page["embeddings"])
+                    metadatas.extend(page["metadatas"])
+            except _VECTOR_ERRORS as e:
+                _log_vector_error("加载进程内向量矩阵", e)
+                mirror.invalidate()
+                return False
+            
+            if not mirror.finish_load(generation, ids, embeddings, metadatas):
+                return False
+            
+            # 分页读取期间的删除可能使部分记忆被跳过，数量不一致时下次搜索重新加载
+            if len(mirror) != await self._run(self.collection.count):
+                mirror.invalidate()
+                return False
+            
+            print(f"进程内向量矩阵加载完成，记忆数: {len(mirror)}")
+            return True
+    
+    async def _sync_dense_mirror(
+        self,
+        ids: List[str],
+        embeddings: Optional[List[List[float]]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ):
+        """
+        将写入Chroma的记忆同步到进程内的向量矩阵
+        
+        没有提供向量（由嵌入函数计算）时从Chroma读取一次写入后的向量和元数据
+        
+        Args:
+            ids: 记忆ID列表
+            embeddings: 写入的向量列表
+            metadatas: 写入的已转换格式的元数据列表
+        """
+        mirror = self._dense_mirror
+        if not mirror.active or not ids:
+            return
+        
+        if embeddings is None or metadatas is None:
+            try:
+                results = await self._run(
+                    self.collection.get,
+                    ids=ids,
+                    include=["embeddings", "metadatas"]
+                )
+            except _VECTOR_ERRORS as e:
+                _log_vector_error("同步进程内向量矩阵", e)
+                mirror.invalidate()
+                return
+            ids, embeddings, metadatas = results["ids"], results["embeddings"], results["metadatas"]
+        
+        mirror.add(ids, embeddings, metadatas)
+        if len(mirror) > self.dense_search_max_size:
+            mirror.invalidate()
+            mirror.oversized = True
+    
+    async def _dense_search(
+        self,
+        filter: Optional[Dict[str, Any]],
+        limit: int,
+        query_embedding: List[float]
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        使用进程内的向量矩阵搜索记忆，命中的记忆通过一次Chroma的get读取文本和元数据
+        
+        Args:
+            filter: 已转换格式的过滤条件
+            limit: 返回结果数量限制
+            query_embedding: 查询向量
+        
+        Returns:
+            与search_memories格式相同的记忆列表，无法使用向量矩阵时返回None
+        """
+        if not await self._load_dense_mirror():
+            return None
+        
+        hits = self._dense_mirror.search(query_embedding, filter, limit)
+        if hits is None:
+            return None
+        if not hits:
+            return []
+        
+        try:
+            results = await self._run(self.collection.get, ids=[memory_id for memory_id, _ in hits])
+        except _VECTOR_ERRORS as e:
+            _log_vector_error("读取搜索结果", e)
+            return None
+        
+        found = {
+            memory_id: (text, metadata)
+            for memory_id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+        }
+        # 集合使用余弦距离，与HNSW返回的distance一致
+        return [
+            {
+                "id": memory_id,
+                "text": found[memory_id][0],
+                "metadata": found[memory_id][1],
+                "distance": 1.0 - similarity
+            }
+            for memory_id, similarity in hits
+            if memory_id in found
+        ]
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """
+        使用当前的嵌入函数计算文本向量
+        
+        Args:
+            texts: 文本列表
+        
+        Returns:
+            向量列表，与输入文本一一对应
+        """
+        return await self._run(self.embedding_function, texts)
+    
+    async def _embed_with_default(self, texts: List[str]) -> List[List[float]]:
+        """
+        使用共享的本地ONNX嵌入函数计算文本向量，作为当前嵌入函数失败时的备选
+        
+        向量单独计算后显式传给Chroma，不修改进程内共享集合的嵌入函数，
+        以免并发的其他请求也使用备选模型
+        
+        Args:
+            texts: 文本列表
+        
+        Returns:
+            向量列表，与输入文本一一对应
+        """
+        return await self._run(lambda: get_onnx_embedding_function()(texts))
     
     async def add_memory(
         self,
         text: str,
         metadata: Optional[Dict[str, Any]] = None,
-        id: Optional[str] = None
+        id: Optional[str] = None,
+        embedding: Optional[List[float]] = None
     ) -> str:
         """
         添加记忆到向量数据库
         
+        并发添加的记忆会被合并到同一次Chroma写入中
+        
         Args:
             text: 记忆文本
             metadata: 元数据
             id: 记忆ID，如果为None则自动生成
+            embedding: 预先计算好的向量，如果提供则不再重新嵌入记忆文本
         
         Returns:
             记忆ID
         """
+        memory_id = id or str(uuid.uuid4())
+        
+        print(f"正在添加记忆，ID: {memory_id}, 文本长度: {len(text)}")
+        
+        await self._add_batcher.submit((text, normalize_metadata(metadata), memory_id, embedding))
+        
+        print(f"记忆添加成功，ID: {memory_id}")
+        return memory_id
+    
+    async def _add_memory_batch(
+        self,
+        items: List[Tuple[str, Dict[str, Any], str, Optional[List[float]]]]
+    ) -> List[str]:
+        """
+        将合并后的多条记忆写入向量数据库，由add_memory的微批处理器调用
+        
+        Chroma要求同一次写入中的记忆全部提供或全部不提供向量，因此按是否提供向量分成两组写入
+        
+        Args:
+            items: (记忆文本, 元数据, 记忆ID, 向量)列表
+        
+        Returns:
+            与输入一一对应的记忆ID列表
+        """
+        with_embeddings = [item for item in items if item[3] is not None]
+        without_embeddings = [item for item in items if item[3] is None]
+        
+        if with_embeddings:
+            texts, metadatas, memory_ids, embeddings = map(list, zip(*with_embeddings))
+            await self._add_documents(texts, metadatas, memory_ids, embeddings)
+        if without_embeddings:
+            texts, metadatas, memory_ids, _ = map(list, zip(*without_embeddings))
+            await self._add_documents(texts, metadatas, memory_ids)
+        
+        return [memory_id for _, _, memory_id, _ in items]
+    
+    async def _add_documents(
+        self,
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        ids: List[str],
+        embeddings: Optional[List[List[float]]] = None
+    ):
+        """
+        调用一次Chroma的add写入一批记忆，失败时整批改用默认嵌入函数重试
+        
+        Args:
+            texts: 记忆文本列表
+            metadatas: 已转换格式的元数据列表
+            ids: 记忆ID列表
+            embeddings: 预先计算好的向量列表，如果为None则由嵌入函数计算
+        """
         try:
-            memory_id = id or str(uuid.uuid4())
-            
-            # 确保元数据中的所有值都是字符串
-            if metadata:
-                for key, value in metadata.items():
-                    if isinstance(value, (dict, list)):
-                        metadata[key] = json.dumps(value)
-                    elif not isinstance(value, str):
-                        metadata[key] = str(value)
-            
-            print(f"正在添加记忆，ID: {memory_id}, 文本长度: {len(text)}")
+            await self._write(
+                self.collection.add,
+                documents=texts,
+                embeddings=embeddings,
+                metadatas=metadatas,
+                ids=ids
+            )
+            await self._sync_dense_mirror(ids, embeddings, metadatas)
+            return
+        except _VECTOR_ERRORS as e:
+            _log_vector_error("添加记忆到向量数据库", e)
+        
+        # 尝试使用默认嵌入函数作为备选
+        print("尝试使用默认嵌入函数作为备选...")
+        try:
+            default_embeddings = await self._embed_with_default(texts)
+            await self._write(
+                self.collection.add,
+                documents=texts,
+                embeddings=default_embeddings,
+                metadatas=metadatas,
+                ids=ids
+            )
             
-            try:
-                self.collection.add(
-                    documents=[text],
-                    metadatas=[metadata or {}],
-                    ids=[memory_id]
-                )
-                print(f"记忆添加成功，ID: {memory_id}")
-                return memory_id
-            except Exception as e:
-                print(f"添加记忆到向量数据库失败: {e}")
-                print(f"错误类型: {type(e)}")
-                print(f"错误详情: {str(e)}")
-                
-                # 检查是否是OpenAI API错误
-                if "openai.NotFoundError" in str(type(e)):
-                    print("OpenAI API错误: 模型或资源不存在")
-                    print("请检查您的OpenAI API密钥和模型名称是否正确")
-                    print("建议: 更新到最新的OpenAI嵌入模型，如text-embedding-3-small")
-                
-                # 尝试使用默认嵌入函数作为备选
-                print("尝试使用默认嵌入函数作为备选...")
-                try:
-                    # 临时切换到默认嵌入函数
-                    original_embedding_function = self.collection._embedding_function
-                    self.collection._embedding_function = embedding_functions.DefaultEmbeddingFunction()
-                    
-                    self.collection.add(
-                        documents=[text],
-                        metadatas=[metadata or {}],
-                        ids=[memory_id]
-                    )
-                    
-                    print(f"使用默认嵌入函数添加记忆成功，ID: {memory_id}")
-                    
-                    # 恢复原始嵌入函数
-                    self.collection._embedding_function = original_embedding_function
-                    
-                    return memory_id
-                except Exception as backup_error:
-                    print(f"使用默认嵌入函数添加记忆失败: {backup_error}")
-                    raise
-        except Exception as outer_error:
-            print(f"添加记忆过程中发生未处理异常: {outer_error}")
+            await self._sync_dense_mirror(ids, default_embeddings, metadatas)
+            print(f"使用默认嵌入函数添加记忆成功，数量: {len(texts)}")
+        except _VECTOR_ERRORS as backup_error:
+            print(f"使用默认嵌入函数添加记忆失败: {backup_error}")
             raise
     
+    async def add_memories(
+        self,
+        texts: List[str],
+        metadatas: List[Optional[Dict[str, Any]]],
+        ids: Optional[List[str]] = None,
+        embeddings: Optional[List[List[float]]] = None
+    ) -> List[str]:
+        """
+        批量添加记忆到向量数据库，每CHROMA_ADD_BATCH_SIZE条记忆调用一次Chroma的add
+        （未提供向量时每批文本合并为一次嵌入请求）
+        
+        Args:
+            texts: 记忆文本列表
+            metadatas: 与文本一一对应的元数据列表
+            ids: 记忆ID列表，如果为None则自动生成
+            embeddings: 预先计算好的向量列表，如果提供则不再重新嵌入记忆文本
+        
+        Returns:
+            与文本一一对应的记忆ID列表
+        """
+        if not texts:
+            return []
+        
+        memory_ids = ids or [str(uuid.uuid4()) for _ in texts]
+        
+        normalized_metadatas = [normalize_metadata(metadata) for metadata in metadatas]
+        
+        print(f"正在批量添加记忆，数量: {len(texts)}")
+        
+        for start in range(0, len(texts), self.add_batch_size):
+            end = start + self.add_batch_size
+            await self._add_documents(
+                texts[start:end],
+                normalized_metadatas[start:end],
+                memory_ids[start:end],
+                embeddings[start:end] if embeddings is not None else None
+            )
+        
+        print(f"批量添加记忆成功，数量: {len(texts)}")
+        return memory_ids
+    
+    async def find_nearest(
+        self,
+        embeddings: List[List[float]],
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[Optional[Tuple[str, float]]]:
+        """
+        为每个向量查找最相似的一条记忆，所有向量通过一次查询完成
+        
+        相似度由返回的向量直接计算余弦值，与集合使用的距离度量无关
+        
+        Args:
+            embeddings: 向量列表
+            filter: 过滤条件
+        
+        Returns:
+            与向量一一对应的(记忆ID, 余弦相似度)列表，没有找到记忆时对应None
+        """
+        if not embeddings:
+            return []
+        
+        results = await self._run(
+            self.collection.query,
+            query_embeddings=embeddings,
+            n_results=1,
+            where=normalize_metadata(filter) or None,
+            include=["embeddings"]
+        )
+        
+        nearest: List[Optional[Tuple[str, float]]] = [None] * len(embeddings)
+        for index, (ids, found) in enumerate(zip(results["ids"], results.get("embeddings") or [])):
+            if not ids or not found:
+                continue
+            query_vec = np.asarray(embeddings[index], dtype=np.float32)
+            found_vec = np.asarray(found[0], dtype=np.float32)
+            norm = float(np.linalg.norm(query_vec) * np.linalg.norm(found_vec))
+            nearest[index] = (ids[0], float(query_vec @ found_vec) / norm if norm > 0 else 0.0)
+        return nearest
+    
     async def search_memories(
         self,
         query: str,
         filter: Optional[Dict[str, Any]] = None,
-        limit: int = 5
+        limit: int = 5,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Dict[str, Any]]:
         """
         搜索记忆
@@ -192,77 +1001,77 @@ class VectorStore:
             query: 查询文本
             filter: 过滤条件
             limit: 返回结果数量限制
+            query_embedding: 预先计算好的查询向量，如果提供则不再重新嵌入查询文本
         
         Returns:
             记忆列表，每个记忆包含id、text、metadata和distance字段
         """
+        print(f"正在搜索记忆，查询: '{query}'")
+        
+        if filter:
+            filter = normalize_metadata(filter)
+            print(f"应用过滤条件: {filter}")
+        
+        # 集合较小时直接在进程内的向量矩阵上计算
+        if query_embedding is not None:
+            dense_results = await self._dense_search(filter, limit, query_embedding)
+            if dense_results is not None:
+                print(f"搜索成功（进程内向量矩阵），找到 {len(dense_results)} 条结果")
+                return dense_results
+        
         try:
-            print(f"正在搜索记忆，查询: '{query}'")
-            
-            # 确保过滤条件中的所有值都是字符串
-            if filter:
-                for key, value in filter.items():
-                    if isinstance(value, (dict, list)):
-                        filter[key] = json.dumps(value)
-                    elif not isinstance(value, str):
-                        filter[key] = str(value)
-                print(f"应用过滤条件: {filter}")
+            if query_embedding is not None:
+                results = await self._run(
+                    self.collection.query,
+                    query_embeddings=[query_embedding],
+                    n_results=limit,
+                    where=filter
+                )
+            else:
+                results = await self._run(
+                    self.collection.query,
+                    query_texts=[query],
+                    n_results=limit,
+                    where=filter
+                )
+            print(f"搜索成功，找到 {len(results['documents'][0]) if results['documents'] and len(results['documents']) > 0 else 0} 条结果")
+        except _VECTOR_ERRORS as e:
+            _log_vector_error("搜索记忆", e)
             
+            # 尝试使用默认嵌入函数作为备选
+            print("尝试使用默认嵌入函数作为备选...")
             try:
-                results = self.collection.query(
-                    query_texts=[query],
+                default_embeddings = await self._embed_with_default([query])
+                results = await self._run(
+                    self.collection.query,
+                    query_embeddings=default_embeddings,
                     n_results=limit,
                     where=filter
                 )
-                print(f"搜索成功，找到 {len(results['documents'][0]) if results['documents'] and len(results['documents']) > 0 else 0} 条结果")
-            except Exception as e:
-                print(f"搜索记忆失败: {e}")
-                print(f"错误类型: {type(e)}")
-                print(f"错误详情: {str(e)}")
-                
-                # 检查是否是OpenAI API错误
-                if "openai.NotFoundError" in str(type(e)):
-                    print("OpenAI API错误: 模型或资源不存在")
-                    print("请检查您的OpenAI API密钥和模型名称是否正确")
-                    print("建议: 更新到最新的OpenAI嵌入模型，如text-embedding-3-small")
                 
-                # 尝试使用默认嵌入函数作为备选
-                print("尝试使用默认嵌入函数作为备选...")
-                try:
-                    # 临时切换到默认嵌入函数
-                    original_embedding_function = self.collection._embedding_function
-                    self.collection._embedding_function = embedding_functions.DefaultEmbeddingFunction()
-                    
-                    results = self.collection.query(
-                        query_texts=[query],
-                        n_results=limit,
-                        where=filter
-                    )
-                    
-                    print(f"使用默认嵌入函数搜索成功，找到 {len(results['documents'][0]) if results['documents'] and len(results['documents']) > 0 else 0} 条结果")
-                    
-                    # 恢复原始嵌入函数
-                    self.collection._embedding_function = original_embedding_function
-                except Exception as backup_error:
-                    print(f"使用默认嵌入函数搜索失败: {backup_error}")
-                    # 如果备选方案也失败，返回空结果
-                    return []
-            
-            memories = []
-            if results["documents"] and len(results["documents"][0]) > 0:
-                for i in range(len(results["documents"][0])):
-                    memories.append({
-                        "id": results["ids"][0][i],
-                        "text": results["documents"][0][i],
-                        "metadata": results["metadatas"][0][i] if results["metadatas"] else {},
-                        "distance": results["distances"][0][i] if "distances" in results and results["distances"] else None
-                    })
-            
-            return memories
-        except Exception as outer_error:
-            print(f"搜索记忆过程中发生未处理异常: {outer_error}")
-            # 返回空结果
+                print(f"使用默认嵌入函数搜索成功，找到 {len(results['documents'][0]) if results['documents'] and len(results['documents']) > 0 else 0} 条结果")
+            except _VECTOR_ERRORS as backup_error:
+                print(f"使用默认嵌入函数搜索失败: {backup_error}")
+                # 如果备选方案也失败，返回空结果
+                return []
+        
+        if not results["documents"] or not results["documents"][0]:
             return []
+        
+        # 先取出各字段的结果列表，缺少的字段使用统一的默认值
+        documents = results["documents"][0]
+        metadatas = results["metadatas"][0] if results.get("metadatas") else [{}] * len(documents)
+        distances = results["distances"][0] if results.get("distances") else [None] * len(documents)
+        
+        return [
+            {
+                "id": memory_id,
+                "text": text,
+                "metadata": metadata,
+                "distance": distance
+            }
+            for memory_id, text, metadata, distance in zip(results["ids"][0], documents, metadatas, distances)
+        ]
     
     async def get_memory(self, id: str) -> Optional[Dict[str, Any]]:
         """
@@ -278,7 +1087,7 @@ class VectorStore:
             print(f"正在获取记忆，ID: {id}")
             
             try:
-                result = self.collection.get(ids=[id])
+                result = await self._run(self.collection.get, ids=[id])
                 
                 if result["documents"] and len(result["documents"]) > 0:
                     print(f"记忆获取成功，ID: {id}")
@@ -316,35 +1125,99 @@ class VectorStore:
             是否成功
         """
         try:
-            # 获取现有记忆
-            existing_memory = await self.get_memory(id)
-            if not existing_memory:
-                return False
-            
-            # 准备更新数据
-            update_text = text if text is not None else existing_memory["text"]
-            update_metadata = metadata if metadata is not None else existing_memory["metadata"]
+            if text is not None and metadata is not None:
+                # 文本和元数据都会被覆盖，无需先读取现有记忆
+                update_text = text
+                update_metadata = metadata
+            else:
+                # 获取现有记忆
+                existing_memory = await self.get_memory(id)
+                if not existing_memory:
+                    return False
+                
+                # 准备更新数据
+                update_text = text if text is not None else existing_memory["text"]
+                update_metadata = metadata if metadata is not None else existing_memory["metadata"]
             
-            # 确保元数据中的所有值都是字符串
-            if update_metadata:
-                for key, value in update_metadata.items():
-                    if isinstance(value, (dict, list)):
-                        update_metadata[key] = json.dumps(value)
-                    elif not isinstance(value, str):
-                        update_metadata[key] = str(value)
+            update_metadata = normalize_metadata(update_metadata)
             
             # 更新记忆
-            self.collection.update(
+            await self._write(
+                self.collection.update,
                 ids=[id],
                 documents=[update_text],
                 metadatas=[update_metadata]
             )
+            await self._sync_dense_mirror([id])
             
             return True
         except Exception as e:
             print(f"更新记忆失败: {e}")
             return False
     
+    async def update_memories(self, items: List[Dict[str, Any]]) -> bool:
+        """
+        批量更新记忆，每CHROMA_ADD_BATCH_SIZE条记忆调用一次Chroma的update
+        
+        只有缺少文本或元数据的记忆才需要先读取，这些记忆合并为一次Chroma的get；
+        不存在的记忆被跳过
+        
+        Args:
+            items: 更新列表，每项包含id，以及可选的text和metadata（为None或缺省时不更新）
+        
+        Returns:
+            是否成功
+        """
+        if not items:
+            return True
+        
+        try:
+            # 一次读取所有需要合并的现有记忆
+            merge_ids = [
+                item["id"] for item in items
+                if item.get("text") is None or item.get("metadata") is None
+            ]
+            existing = {}
+            if merge_ids:
+                results = await self._run(self.collection.get, ids=merge_ids)
+                existing = {
+                    memory_id: (document, metadata)
+                    for memory_id, document, metadata in zip(
+                        results["ids"], results["documents"], results["metadatas"]
+                    )
+                }
+            
+            ids = []
+            documents = []
+            metadatas = []
+            for item in items:
+                text = item.get("text")
+                metadata = item.get("metadata")
+                if text is None or metadata is None:
+                    if item["id"] not in existing:
+                        continue
+                    existing_text, existing_metadata = existing[item["id"]]
+                    text = text if text is not None else existing_text
+                    metadata = metadata if metadata is not None else existing_metadata
+                ids.append(item["id"])
+                documents.append(text)
+                metadatas.append(normalize_metadata(metadata))
+            
+            for start in range(0, len(ids), self.add_batch_size):
+                end = start + self.add_batch_size
+                await self._write(
+                    self.collection.update,
+                    ids=ids[start:end],
+                    documents=documents[start:end],
+                    metadatas=metadatas[start:end]
+                )
+                await self._sync_dense_mirror(ids[start:end])
+            
+            return True
+        except Exception as e:
+            print(f"批量更新记忆失败: {e}")
+            return False
+    
     async def delete_memory(self, id: str) -> bool:
         """
         删除记忆
@@ -356,7 +1229,8 @@ class VectorStore:
             是否成功
         """
         try:
-            self.collection.delete(ids=[id])
+            await self._write(self.collection.delete, ids=[id])
+            self._dense_mirror.remove([id])
             return True
         except Exception as e:
             print(f"删除记忆失败: {e}")
@@ -373,7 +1247,8 @@ class VectorStore:
             是否成功
         """
         try:
-            self.collection.delete(ids=ids)
+            await self._write(self.collection.delete, ids=ids)
+            self._dense_mirror.remove(ids)
             return True
         except Exception as e:
             print(f"批量删除记忆失败: {e}")
@@ -387,7 +1262,7 @@ class VectorStore:
             统计信息
         """
         try:
-            count = self.collection.count()
+            count = await self._run(self.collection.count)
             return {
                 "collection_name": self.collection_name,
                 "count": count
@@ -0,0 +1,141 @@
+import os
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+class MicroBatcher:
+    """
+    微批处理器，将短时间内的多个单独请求合并为一次批量调用
+
+    调用方通过submit提交单个请求并等待结果，后台任务最多等待max_delay秒或
+    凑满max_batch个请求后，调用一次批量处理函数并把结果分发给各个调用方
+
+    启用isolate_failures时，批量调用失败后逐个重新处理同批的请求，
+    只有本身出错的请求会收到异常，不会影响同一批中的其他调用方
+    """
+
+    def __init__(
+        self,
+        process_func: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch: int = 64,
+        max_delay: float = 0.01,
+        isolate_failures: bool = False
+    ):
+        """
+        初始化微批处理器
+
+        Args:
+            process_func: 批量处理函数，接收请求列表并返回一一对应的结果列表
+            max_batch: 每批的最大请求数
+            max_delay: 收集一批请求的最长等待时间（秒）
+            isolate_failures: 批量调用失败时是否逐个重试，要求批量处理函数失败时不留下部分结果（如在同一事务中写入）
+        """
+        self.process_func = process_func
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.isolate_failures = isolate_failures
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._pending: Set[asyncio.Task] = set()
+
+    def _ensure_worker(self):
+        """在当前事件循环中启动后台任务（首次提交时才创建）"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        """
+        提交一个请求并等待其结果
+
+        Args:
+            item: 请求
+
+        Returns:
+            该请求对应的结果
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        """持续从队列中收集请求并分批处理"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # 批量调用放到单独的任务中执行，不阻塞下一批请求的收集
+            task = asyncio.create_task(self._dispatch(batch))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future]]):
+        """
+        执行一次批量调用并将结果分发给各个调用方
+
+        Args:
+            batch: (请求, Future)列表
+        """
+        try:
+            results = await self.process_func([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"批量处理结果数量不匹配: 期望{len(batch)}，实际{len(results)}")
+        except Exception as e:
+            if self.isolate_failures and len(batch) > 1:
+                # 逐个重新处理，只有出错的请求会收到异常
+                await asyncio.gather(*(self._dispatch([entry]) for entry in batch))
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+class EmbeddingBatcher(MicroBatcher):
+    """嵌入请求的微批处理器，将并发的单条文本嵌入合并为一次批量嵌入调用"""
+
+    def __init__(
+        self,
+        embed_func: Callable[[List[str]], Awaitable[List[List[float]]]],
+        max_batch: Optional[int] = None,
+        max_delay: Optional[float] = None
+    ):
+        """
+        初始化嵌入批处理器
+
+        Args:
+            embed_func: 批量嵌入函数，接收文本列表并返回向量列表
+            max_batch: 每批的最大文本数，如果为None则从环境变量获取
+            max_delay: 收集一批文本的最长等待时间（秒），如果为None则从环境变量获取
+        """
+        super().__init__(
+            embed_func,
+            max_batch=max_batch or int(os.getenv("EMBEDDING_BATCH_SIZE", "64")),
+            max_delay=max_delay if max_delay is not None else float(os.getenv("EMBEDDING_BATCH_DELAY", "0.01"))
+        )
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        获取单条文本的嵌入向量
+
+        Args:
+            text: 要嵌入的文本
+
+        Returns:
+            嵌入向量
+        """
+        embedding = await self.submit(text)
+        return [float(x) for x in embedding]
@@ -1,7 +1,91 @@
 from typing import List, Dict, Any, Optional
-import json
+import re
+import orjson
 from llm.base import BaseLLM
 
+# 从LLM回复中提取JSON的正则，在模块加载时编译一次：
+# 先匹配```json和```之间的内容，没有找到时再匹配第一个{到最后一个}之间的内容
+_JSON_FENCE = re.compile(r'```json\s*(\{.*?\})\s*```', re.DOTALL)
+_JSON_OBJECT = re.compile(r'(\{.*\})', re.DOTALL)
+
+def _parse_json_response(text: str) -> Optional[Any]:
+    """
+    解析LLM回复中的JSON，先整体解析，失败后依次尝试```json代码块和最外层的{...}
+    
+    Args:
+        text: LLM回复文本
+    
+    Returns:
+        解析结果，无法解析时返回None
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
+    
+    for pattern in (_JSON_FENCE, _JSON_OBJECT):
+        json_match = pattern.search(text)
+        if not json_match:
+            continue
+        try:
+            return orjson.loads(json_match.group(1))
+        except orjson.JSONDecodeError as json_err:
+            print(f"JSON提取失败: {json_err}")
+    return None
+
+# 提示中不变的部分，在模块加载时构建一次，调用时只拼接对话内容
+_SUMMARY_HEADER = """请总结以下对话，并以JSON格式返回结构化摘要。
+        
+对话内容：
+"""
+
+_SUMMARY_FOOTER = """
+请以以下JSON格式返回摘要：
+```json
+{
+    "summary": "对话的整体摘要",
+    "key_points": ["要点1", "要点2", ...],
+    "entities": [
+        {"type": "person", "name": "名称", "attributes": {"属性1": "值1", ...}},
+        {"type": "location", "name": "地点", "attributes": {}},
+        ...
+    ],
+    "topics": ["主题1", "主题2", ...],
+    "user_preferences": {"偏好1": "值1", ...},
+    "action_items": ["待办事项1", ...]
+}
+```
+
+只返回JSON格式的摘要，不要添加其他解释。"""
+
+_EXTRACT_HEADER = """请从以下对话中提取关键信息，并以JSON格式返回。
+        
+对话内容：
+"""
+
+_EXTRACT_FOOTER = """
+
+请以以下JSON格式返回关键信息：
+```json
+{
+    "personal_info": {
+        "name": "用户名称（如果提到）",
+        "preferences": ["偏好1", "偏好2", ...],
+        "background": "背景信息"
+    },
+    "tasks": [
+        {"description": "任务描述", "deadline": "截止日期（如果提到）", "priority": "优先级（如果提到）"},
+        ...
+    ],
+    "questions": ["用户提出的问题1", ...],
+    "important_dates": [
+        {"event": "事件描述", "date": "日期"}
+    ]
+}
+```
+
+只返回JSON格式的信息，不要添加其他解释。如果某些字段没有相关信息，可以留空或省略。"""
+
 class ConversationSummarizer:
     """对话总结器，用于生成对话的结构化摘要"""
     
@@ -36,40 +120,17 @@ class ConversationSummarizer:
         summary_text = await self.llm_client.generate_text(prompt)
         
         # 解析摘要为JSON格式
-        try:
-            summary_json = json.loads(summary_text)
+        summary_json = _parse_json_response(summary_text)
+        if summary_json is not None:
             return summary_json
-        except json.JSONDecodeError:
-            # 如果解析失败，尝试提取JSON部分
-            try:
-                # 尝试找到JSON部分（通常在```json和```之间）
-                import re
-                json_match = re.search(r'```json\n(.*?)\n```', summary_text, re.DOTALL)
-                if json_match:
-                    summary_json = json.loads(json_match.group(1))
-                    return summary_json
-                
-                # 如果没有找到，尝试直接解析可能的JSON部分
-                json_match = re.search(r'(\{.*\})', summary_text, re.DOTALL)
-                if json_match:
-                    summary_json = json.loads(json_match.group(1))
-                    return summary_json
-                
-                # 如果仍然失败，返回一个基本的摘要结构
-                return {
-                    "summary": summary_text,
-                    "key_points": [],
-                    "entities": [],
-                    "topics": []
-                }
-            except Exception as e:
-                # 如果所有尝试都失败，返回一个基本的摘要结构
-                return {
-                    "summary": summary_text,
-                    "key_points": [],
-                    "entities": [],
-                    "topics": []
-                }
+        
+        # 如果解析失败，返回一个基本的摘要结构
+        return {
+            "summary": summary_text,
+            "key_points": [],
+            "entities": [],
+            "topics": []
+        }
     
     def _build_summary_prompt(
         self, 
@@ -86,45 +147,21 @@ class ConversationSummarizer:
         Returns:
             提示文本
         """
-        conversation_text = "\n".join([
+        conversation_text = "\n".join(
             f"{msg['role']}: {msg['content']}" for msg in messages
-        ])
-        
-        prompt = f"""请总结以下对话，并以JSON格式返回结构化摘要。
-        
-对话内容：
-{conversation_text}
-
-"""
+        )
         
+        parts = [_SUMMARY_HEADER, conversation_text, "\n\n"]
         if existing_summary:
-            prompt += f"""
+            parts.append(f"""
 已有的摘要：
 {existing_summary}
 
 请基于已有摘要更新，保留重要信息并添加新的内容。
-"""
+""")
+        parts.append(_SUMMARY_FOOTER)
         
-        prompt += """
-请以以下JSON格式返回摘要：
-```json
-{
-    "summary": "对话的整体摘要",
-    "key_points": ["要点1", "要点2", ...],
-    "entities": [
-        {"type": "person", "name": "名称", "attributes": {"属性1": "值1", ...}},
-        {"type": "location", "name": "地点", "attributes": {}},
-        ...
-    ],
-    "topics": ["主题1", "主题2", ...],
-    "user_preferences": {"偏好1": "值1", ...},
-    "action_items": ["待办事项1", ...]
-}
-```
-
-只返回JSON格式的摘要，不要添加其他解释。"""
-        
-        return prompt
+        return "".join(parts)
 
     async def extract_key_information(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
         """
@@ -140,38 +177,13 @@ class ConversationSummarizer:
             print("开始提取关键信息...")
             print(f"消息数量: {len(messages)}")
             
-            conversation_text = "\n".join([
+            conversation_text = "\n".join(
                 f"{msg['role']}: {msg['content']}" for msg in messages
-            ])
+            )
             
             print(f"对话文本长度: {len(conversation_text)}")
             
-            # 使用简单字符串而不是f-string，看看是否解决问题
-            prompt = f"""请从以下对话中提取关键信息，并以JSON格式返回。
-        
-对话内容：
-{conversation_text}
-
-请以以下JSON格式返回关键信息：
-```json
-{{
-    "personal_info": {{
-        "name": "用户名称（如果提到）",
-        "preferences": ["偏好1", "偏好2", ...],
-        "background": "背景信息"
-    }},
-    "tasks": [
-        {{"description": "任务描述", "deadline": "截止日期（如果提到）", "priority": "优先级（如果提到）"}},
-        ...
-    ],
-    "questions": ["用户提出的问题1", ...],
-    "important_dates": [
-        {{"event": "事件描述", "date": "日期"}}
-    ]
-}}
-```
-
-只返回JSON格式的信息，不要添加其他解释。如果某些字段没有相关信息，可以留空或省略。"""
+            prompt = "".join([_EXTRACT_HEADER, conversation_text, _EXTRACT_FOOTER])
             
             print("提示构建完成，长度:", len(prompt))
             print("开始调用LLM...")
@@ -183,42 +195,18 @@ class ConversationSummarizer:
             print("开始解析JSON...")
             
             # 解析为JSON格式
-            try:
-                info_json = json.loads(info_text)
+            info_json = _parse_json_response(info_text)
+            if info_json is not None:
                 return info_json
-            except json.JSONDecodeError as json_err:
-                print(f"JSON解析失败: {json_err}")
-                # 如果解析失败，尝试提取JSON部分
-                try:
-                    import re
-                    json_match = re.search(r'```json\n(.*?)\n```', info_text, re.DOTALL)
-                    if json_match:
-                        info_json = json.loads(json_match.group(1))
-                        return info_json
-                    
-                    # 如果没有找到，尝试直接解析可能的JSON部分
-                    json_match = re.search(r'(\{.*\})', info_text, re.DOTALL)
-                    if json_match:
-                        info_json = json.loads(json_match.group(1))
-                        return info_json
-                    
-                    # 如果仍然失败，返回一个基本的结构
-                    print("无法找到有效的JSON结构，返回默认结构")
-                    return {
-                        "personal_info": {},
-                        "tasks": [],
-                        "questions": [],
-                        "important_dates": []
-                    }
-                except Exception as e:
-                    print(f"JSON提取失败: {e}")
-                    # 如果所有尝试都失败，返回一个基本的结构
-                    return {
-                        "personal_info": {},
-                        "tasks": [],
-                        "questions": [],
-                        "important_dates": []
-                    }
+            
+            # 如果解析失败，返回一个基本的结构
+            print("无法找到有效的JSON结构，返回默认结构")
+            return {
+                "personal_info": {},
+                "tasks": [],
+                "questions": [],
+                "important_dates": []
+            }
         except Exception as e:
             print(f"提取关键信息时发生错误: {e}")
             print(f"错误类型: {type(e)}")
@@ -1,57 +1,194 @@
+import os
+import asyncio
 import tiktoken
-from typing import List, Dict, Any, Union
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Union, Callable, TypeVar
 
-def count_tokens(text: str, model: str = "gpt-4") -> int:
+T = TypeVar("T")
+
+TOKENS_PER_MESSAGE = 3  # 每条消息的基础token数
+TOKENS_PER_NAME = 1     # 如果有name字段，额外的token数
+TOKENS_PER_REQUEST = 3  # 每次请求的基础token数
+
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "8192"))  # 缓存的文本token数量的条数
+TOKENIZER_OFFLOAD_CHARS = int(os.getenv("TOKENIZER_OFFLOAD_CHARS", "50000"))  # 超过该字符数的文本放到线程池中计算token
+TOKENIZER_BATCH_CHARS = int(os.getenv("TOKENIZER_BATCH_CHARS", "20000"))  # 多段文本总字符数超过该值时使用encode_batch并行编码
+TOKENIZER_BATCH_THREADS = int(os.getenv("TOKENIZER_BATCH_THREADS", os.cpu_count() or 4))  # encode_batch使用的线程数
+
+# 分词是CPU密集型操作，放到线程池中执行以免阻塞事件循环（tiktoken在编码时会释放GIL）
+tokenizer_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TOKENIZER_WORKERS", os.cpu_count() or 4)),
+    thread_name_prefix="tokenizer"
+)
+
+async def run_in_tokenizer_pool(func: Callable[..., T], *args) -> T:
     """
-    计算文本的token数量
+    在分词线程池中执行函数
+    
+    Args:
+        func: 要执行的函数
+        args: 函数参数
+    
+    Returns:
+        函数的返回值
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(tokenizer_pool, func, *args)
+
+@lru_cache(maxsize=16)
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    """
+    获取模型对应的编码器，每个进程内每个模型只构建一次
     
     Args:
-        text: 要计算的文本
         model: 使用的模型名称
     
     Returns:
-        token数量
+        tiktoken编码器
     """
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         # 如果模型不在tiktoken的列表中，使用cl100k_base编码
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
+@lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)
+def _count_text_tokens(text: str, model: str) -> int:
+    """
+    计算文本的token数量并缓存结果，对话历史中不变的消息每轮只需编码一次
     
-    return len(encoding.encode(text))
+    Args:
+        text: 要计算的文本
+        model: 使用的模型名称
+    
+    Returns:
+        token数量
+    """
+    return len(_get_encoding(model).encode(text))
 
-def count_messages_tokens(messages: List[Dict[str, str]], model: str = "gpt-4") -> int:
+def count_tokens(text: str, model: str = "gpt-4") -> int:
     """
-    计算消息列表的token数量
+    计算文本的token数量
     
     Args:
-        messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+        text: 要计算的文本
         model: 使用的模型名称
     
     Returns:
         token数量
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
+    return _count_text_tokens(text, model)
+
+def count_texts_tokens(texts: List[str], model: str = "gpt-4") -> List[int]:
+    """
+    批量计算多段文本的token数量
+    
+    文本较短时逐条计算并命中缓存；总长度较长时通过tiktoken的encode_batch在多个线程中并行编码，
+    encode_batch每次调用都会创建线程，短文本使用反而更慢
+    
+    Args:
+        texts: 文本列表
+        model: 使用的模型名称
     
-    tokens_per_message = 3  # 每条消息的基础token数
-    tokens_per_name = 1     # 如果有name字段，额外的token数
+    Returns:
+        与文本一一对应的token数量列表
+    """
+    if len(texts) > 1 and sum(map(len, texts)) >= TOKENIZER_BATCH_CHARS:
+        encoded = _get_encoding(model).encode_batch(texts, num_threads=TOKENIZER_BATCH_THREADS)
+        return [len(tokens) for tokens in encoded]
+    return [_count_text_tokens(text, model) for text in texts]
+
+def count_each_message_tokens(messages: List[Dict[str, Any]], model: str = "gpt-4") -> List[int]:
+    """
+    计算每条消息的token数量（不含每次请求的基础token数），所有消息的文本合并为一次批量计算
     
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
+    Args:
+        messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+        model: 使用的模型名称
+    
+    Returns:
+        与消息一一对应的token数量列表
+    """
+    counts = [TOKENS_PER_MESSAGE] * len(messages)
+    texts = []
+    owners = []
+    for index, message in enumerate(messages):
         for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
+            # 跳过缓存的token数量等非文本字段
+            if key == "tokens" or not isinstance(value, str):
+                continue
+            texts.append(value)
+            owners.append(index)
             if key == "name":
-                num_tokens += tokens_per_name
+                counts[index] += TOKENS_PER_NAME
+    
+    for index, num_tokens in zip(owners, count_texts_tokens(texts, model)):
+        counts[index] += num_tokens
+    
+    return counts
+
+def count_message_tokens(message: Dict[str, Any], model: str = "gpt-4") -> int:
+    """
+    计算单条消息的token数量（不含每次请求的基础token数）
+    
+    Args:
+        message: 消息，格式为{"role": "user", "content": "Hello"}
+        model: 使用的模型名称
+    
+    Returns:
+        token数量
+    """
+    num_tokens = TOKENS_PER_MESSAGE
+    for key, value in message.items():
+        # 跳过缓存的token数量等非文本字段
+        if key == "tokens" or not isinstance(value, str):
+            continue
+        num_tokens += _count_text_tokens(value, model)
+        if key == "name":
+            num_tokens += TOKENS_PER_NAME
+    
+    return num_tokens
+
+def count_messages_tokens(messages: List[Dict[str, str]], model: str = "gpt-4") -> int:
+    """
+    计算消息列表的token数量
+    
+    Args:
+        messages: 消息列表，格式为[{"role": "user", "content": "Hello"}, ...]
+        model: 使用的模型名称
+    
+    Returns:
+        token数量
+    """
+    num_tokens = sum(count_each_message_tokens(messages, model))
     
     # 每次请求的基础token数
-    num_tokens += 3
+    num_tokens += TOKENS_PER_REQUEST
     
     return num_tokens
 
+def truncate_texts_to_token_limit(texts: List[str], max_tokens: int, model: str = "gpt-4") -> List[str]:
+    """
+    将多段文本分别截断到指定的token限制，所有文本通过一次encode_batch并行编码
+    
+    Args:
+        texts: 要截断的文本列表
+        max_tokens: 每段文本的最大token数
+        model: 使用的模型名称
+    
+    Returns:
+        与输入一一对应的截断后的文本列表
+    """
+    encoding = _get_encoding(model)
+    
+    encoded = encoding.encode_batch(texts, num_threads=TOKENIZER_BATCH_THREADS)
+    
+    return [
+        text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+        for text, tokens in zip(texts, encoded)
+    ]
+
 def truncate_text_to_token_limit(text: str, max_tokens: int, model: str = "gpt-4") -> str:
     """
     将文本截断到指定的token限制
@@ -64,10 +201,7 @@ def truncate_text_to_token_limit(text: str, max_tokens: int, model: str = "gpt-4
     Returns:
         截断后的文本
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = _get_encoding(model)
     
     tokens = encoding.encode(text)
     
@@ -0,0 +1,89 @@
+import os
+import socket
+import asyncio
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+from api.clients import get_redis
+from api.chat import summarize_conversation, SUMMARY_STREAM
+
+# 消费者组和并发配置
+SUMMARY_GROUP = os.getenv("SUMMARY_GROUP", "summarizers")
+SUMMARY_WORKER_CONCURRENCY = int(os.getenv("SUMMARY_WORKER_CONCURRENCY", "8"))  # 同时执行的总结任务数
+
+async def handle_message(message_id: str, fields: dict, semaphore: asyncio.Semaphore):
+    """
+    处理一条总结任务，完成后确认消息
+
+    Args:
+        message_id: Stream消息ID
+        fields: 消息字段，包含conversation_id和user_id
+        semaphore: 限制并发任务数的信号量
+    """
+    redis_client = get_redis()
+    try:
+        await summarize_conversation(fields["conversation_id"], fields["user_id"])
+    except Exception as e:
+        print(f"总结对话失败，消息ID: {message_id}, 错误: {e}")
+    finally:
+        await redis_client.ack_stream(SUMMARY_STREAM, SUMMARY_GROUP, message_id)
+        semaphore.release()
+
+async def run_worker():
+    """从Redis Stream中持续读取总结任务并在有界并发下执行"""
+    redis_client = get_redis()
+    consumer = os.getenv("SUMMARY_CONSUMER", socket.gethostname())  # 固定的消费者名称，重启后可以继续处理未确认的消息
+    semaphore = asyncio.Semaphore(SUMMARY_WORKER_CONCURRENCY)
+    tasks = set()
+
+    await redis_client.ensure_stream_group(SUMMARY_STREAM, SUMMARY_GROUP)
+    print(f"总结worker已启动，消费者: {consumer}, 并发数: {SUMMARY_WORKER_CONCURRENCY}")
+
+    def dispatch(message_id: str, fields: dict):
+        task = asyncio.create_task(handle_message(message_id, fields, semaphore))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    # 首先处理上次退出前已投递但未确认的消息
+    for message_id, fields in await redis_client.read_stream_group(
+        SUMMARY_STREAM,
+        SUMMARY_GROUP,
+        consumer,
+        count=1000,
+        pending=True
+    ):
+        await semaphore.acquire()
+        dispatch(message_id, fields)
+
+    while True:
+        # 等待空闲的并发名额后再读取，避免读取超过处理能力的消息
+        await semaphore.acquire()
+        try:
+            messages = await redis_client.read_stream_group(
+                SUMMARY_STREAM,
+                SUMMARY_GROUP,
+                consumer,
+                count=1
+            )
+        except Exception as e:
+            semaphore.release()
+            print(f"读取总结任务失败: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        if not messages:
+            semaphore.release()
+            continue
+
+        dispatch(*messages[0])
+
+if __name__ == "__main__":
+    # 安装了uvloop时使用更快的事件循环
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(run_worker())